@@ -1,197 +1,687 @@
 """AI サービスモジュール"""
 
-import anthropic
-from openai import AzureOpenAI
-from typing import Dict, List, Optional
+import asyncio
+import hashlib
+import json
+import re
+import time
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional, Tuple, Union
 from config.settings import settings
-from .prompts import prompt_manager
+from .cache import ResponseCache
+from .history import HistoryManager, estimate_tokens
+from .limiter import RequestCoalescer
+from .output_budget import OutputBudget, is_truncated, trim_to_sentence
+from .phrase_index import PhraseIndex
+from .prompts import PromptParts, prompt_manager
+from .providers import Completion, create_providers
+from .router import PROVIDER_NAMES, NoProviderAvailableError, ProviderRouter
+from .scheduler import SupersededError, current_turn
+from .semantic_cache import SemanticCache
+from .session_store import SessionStore
+from .shared_state import create_state_backend
+from .telemetry import current_level, record_truncated
+
+# チャット時にプロバイダーへ渡す追加パラメーター
+CHAT_OPTIONS = {
+    "azure_openai": {"temperature": 0.7, "top_p": 0.95}
+}
+
+# 呼び出しの種類ごとの max_tokens の上限（出力予算はこれを超えない。キャッシュキーにも使う）
+MAX_OUTPUT_TOKENS = {
+    "chat": 1000,
+    "translate": 500,
+    "feedback": 800,
+    "hint": 300,
+}
+
+# 設定の再読み込みで不要になったクライアントを閉じるまでの猶予（処理中の呼び出しを待つ）
+RETIRED_CLIENT_GRACE_SECONDS = 120
+
+# ヒントとして答えられない入力に対する回答の書き出し（索引には書き戻さない）
+HINT_REFUSAL_PREFIX = "申し訳ございません"
+
+# 一括翻訳の番号付き出力（JSON 配列で返らなかった場合の予備）
+_NUMBERED_ITEM_PATTERN = re.compile(r"^\s*\[(\d+)\]\s*", re.MULTILINE)
+_JSON_DECODER = json.JSONDecoder()
+
+
+def parse_batch_translations(response: str, count: int) -> Optional[List[str]]:
+    """一括翻訳の回答から count 件の翻訳を取り出す（取り出せなければ None）
+    
+    前置きや後書きに "[2]" のような括弧があっても、件数の合う最初の JSON 配列を使う。
+    """
+    start = response.find("[")
+    while start != -1:
+        try:
+            items, _ = _JSON_DECODER.raw_decode(response, start)
+        except ValueError:
+            items = None
+        if isinstance(items, list) and len(items) == count and all(isinstance(item, str) for item in items):
+            return [item.strip() for item in items]
+        start = response.find("[", start + 1)
+    
+    matches = list(_NUMBERED_ITEM_PATTERN.finditer(response))
+    numbered = {}
+    for match, next_match in zip(matches, matches[1:] + [None]):
+        body = response[match.end():next_match.start() if next_match else len(response)]
+        numbered[int(match.group(1))] = body.strip()
+    if sorted(numbered) == list(range(1, count + 1)):
+        return [numbered[i] for i in range(1, count + 1)]
+    return None
+
 
 class AIService:
-    """AI サービスを管理するクラス"""
+    """AI サービスを管理するクラス
+    
+    クライアントは非同期版を1つずつ生成して共有する。コルーチンは
+    background_loop 上で実行されることを前提とする。
+    プロバイダーはセッションごとに選択でき、router が失敗時の切り替えを行う。
+    shared_state の保存先が共有されるもの（sqlite / redis）なら、キャッシュ・セッション・
+    流量制限をワーカー間で共有する。セッションストアは共有状態やディスクを待つため、
+    コルーチンからは _offload でイベントループの外で呼ぶ。
+    """
     
     def __init__(self):
-        self.anthropic_client = None
-        self.azure_openai_client = None
-        self.current_provider = settings.get_default_provider()
-        self._initialize_clients()
-    
-    def _initialize_clients(self) -> None:
-        """APIクライアントを初期化"""
-        anthropic_key = settings.get_api_key('anthropic')
-        azure_openai_key = settings.get_api_key('azure_openai')
-        azure_openai_endpoint = settings.get_azure_openai_endpoint()
-        
-        if anthropic_key:
-            self.anthropic_client = anthropic.Anthropic(api_key=anthropic_key)
-            print("Anthropic Claude API が利用可能です")
-        
-        if azure_openai_key and azure_openai_endpoint:
-            self.azure_openai_client = AzureOpenAI(
-                api_key=azure_openai_key,
-                azure_endpoint=azure_openai_endpoint,
-                api_version=settings.get_azure_openai_api_version()
+        self.state = create_state_backend(settings.get_shared_state_config())
+        self.shared = self.state if self.state.shared else None
+        self.default_provider = settings.get_default_provider()
+        self.response_cache = self._create_response_cache()
+        self.semantic_cache = self._create_semantic_cache()
+        self.session_store = self._create_session_store()
+        self.phrase_index = self._create_phrase_index()
+        self.history_manager = HistoryManager(settings.get_history_config().get("min_recent_messages", 2))
+        self.providers = create_providers()
+        self.router = ProviderRouter(self.providers, settings.get_router_config(), settings.get_limits_config(),
+                                     shared=self.shared)
+        self.coalescer = RequestCoalescer() if settings.get_limits_config().get("coalesce", True) else None
+        self.output_budget = self._create_output_budget()
+        self._background_tasks = set()
+        self._retired_providers: List[object] = []
+    
+    def _create_response_cache(self) -> Optional[ResponseCache]:
+        """設定に従ってレスポンスキャッシュを生成"""
+        cache_config = settings.get_cache_config()
+        if not cache_config.get("enabled", True):
+            return None
+        return ResponseCache(
+            max_entries=cache_config.get("max_entries", 1000),
+            ttl_seconds=cache_config.get("ttl_seconds", 86400),
+            disk_path=cache_config.get("disk_path") or None,
+            shared=self.shared
+        )
+    
+    def _create_semantic_cache(self) -> Optional[SemanticCache]:
+        """設定に従って近似重複キャッシュを生成（numpy がなければ None）"""
+        semantic_config = settings.get_semantic_cache_config()
+        if not semantic_config.get("enabled", True):
+            return None
+        try:
+            return SemanticCache(
+                max_entries=semantic_config.get("max_entries", 20000),
+                dim=semantic_config.get("dim", 256),
+                ttl_seconds=semantic_config.get("ttl_seconds", 86400),
+                thresholds=semantic_config.get("thresholds", {}),
+                top_k=semantic_config.get("top_k", 5),
+                shared=self.shared
             )
-            print("Azure OpenAI API が利用可能です")
-        elif azure_openai_key or azure_openai_endpoint:
-            print("Warning: Azure OpenAI の設定が不完全です。APIキーとエンドポイントの両方を設定してください。")
-            
-        if not self.anthropic_client and not self.azure_openai_client:
-            print("Warning: APIキーが設定されていません。config/config.json ファイルでAPIキーを設定してください。")
+        except RuntimeError as e:
+            print(f"Semantic cache disabled: {e}")
+            return None
+    
+    def _create_session_store(self) -> SessionStore:
+        """設定に従って会話セッションストアを生成"""
+        session_config = settings.get_session_config()
+        return SessionStore(
+            max_turns=session_config.get("max_turns", 20),
+            ttl_seconds=session_config.get("ttl_seconds", 21600),
+            max_sessions=session_config.get("max_sessions", 10000),
+            db_path=session_config.get("db_path") or None,
+            shared=self.shared
+        )
+    
+    def _create_phrase_index(self) -> Optional[PhraseIndex]:
+        """設定に従ってヒント用フレーズ索引を生成"""
+        index_config = settings.get_hint_index_config()
+        if not index_config.get("enabled", True):
+            return None
+        return PhraseIndex(
+            seed_path=index_config.get("seed_path") or None,
+            db_path=index_config.get("db_path") or None,
+            min_score=index_config.get("min_score", 0.8)
+        )
+    
+    def _create_output_budget(self) -> Optional[OutputBudget]:
+        """設定に従って出力トークン予算を生成"""
+        budget_config = settings.get_output_budget_config()
+        if not budget_config.get("enabled", True):
+            return None
+        return OutputBudget(budget_config)
     
-    async def get_ai_response(self, message: str, level: str, history: List[Dict]) -> str:
-        """AI からの回答を取得"""
-        system_prompt = prompt_manager.get_system_prompt(level)
+    def resolve_provider(self, session_id: Optional[str] = None) -> str:
+        """セッションで選択されたプロバイダー（未選択ならデフォルト）を取得"""
+        if session_id:
+            session = self.session_store.get(session_id)
+            if session and session.provider:
+                return session.provider
+        return self.default_provider
+    
+    async def get_ai_response(self, message: str, level: str, history: Optional[List[Dict]] = None,
+                              session_id: Optional[str] = None, provider: Optional[str] = None) -> str:
+        """AI からの回答を取得
+        
+        session_id を指定した場合はサーバー側のセッション履歴を使い、回答後にそのターンを記録する。
+        """
+        current_level.set(level)
+        if session_id:
+            # 前のターンの後処理でまだ待っているものは打ち切る
+            current_turn.set(self.router.begin_turn(session_id))
+        system_prompt, messages, provider = await self._offload(
+            self._prepare_chat, message, level, history, session_id, provider)
         
         try:
-            if self.anthropic_client and self.current_provider == "anthropic":
-                return await self._get_anthropic_response(message, system_prompt, history)
-            elif self.azure_openai_client and self.current_provider == "azure_openai":
-                return await self._get_azure_openai_response(message, system_prompt, history)
-            else:
-                return "I'm sorry, but the AI service is not available. Please check the API configuration."
+            completion, _ = await self._create(
+                provider, "chat", MAX_OUTPUT_TOKENS["chat"], message,
+                lambda p, max_tokens, options: p.create(system_prompt, messages, max_tokens,
+                                                        **options, **CHAT_OPTIONS.get(p.name, {}))
+            )
+        except NoProviderAvailableError:
+            return "I'm sorry, but the AI service is not available. Please check the API configuration."
         except Exception as e:
             print(f"Error getting AI response: {e}")
             return "I apologize, but I'm having trouble responding right now. Please try again."
+        
+        response = completion.text
+        if session_id:
+            await self._offload(self.session_store.append_turn, session_id, message, response)
+            self._schedule_summary(session_id, level, provider)
+        return response
+    
+    @staticmethod
+    async def _offload(func: Callable[..., Any], *args: Any) -> Any:
+        """共有状態やディスクを待つ同期処理を、イベントループの外（executor）で実行"""
+        return await asyncio.get_running_loop().run_in_executor(None, func, *args)
     
-    async def _get_anthropic_response(self, message: str, system_prompt: str, history: List[Dict]) -> str:
-        """Anthropic Claude API からの回答を取得"""
+    def _prepare_chat(self, message: str, level: str, history: Optional[List[Dict]],
+                      session_id: Optional[str], provider: Optional[str]) -> Tuple[PromptParts, List[Dict], str]:
+        """システムプロンプトと、入力トークン予算に収めたメッセージ列と、使うプロバイダーを決める
+        
+        セッションの場合、予算からあふれた古いターンは要約としてシステムプロンプトに含める。
+        """
+        provider = provider or self.resolve_provider(session_id)
+        summary = ""
+        if session_id:
+            session = self.session_store.get(session_id)
+            if session:
+                history = session.get_history()
+                summary = session.summary
+        history = list(history or [])
+        
+        # クライアントが最新の発言を履歴に含めて送ってきた場合は二重に追加しない
+        if history and history[-1].get("role") == "user" and history[-1].get("content") == message:
+            history = history[:-1]
+        
+        history_config = settings.get_history_config()
+        history = history[-history_config.get("max_messages", 16):]
+        system_prompt = prompt_manager.get_system_prompt(level, summary)
+        budget = (settings.get_history_budget(provider, level)
+                  - estimate_tokens(str(system_prompt))
+                  - self.history_manager.message_tokens({"content": message}))
+        window, _ = self.history_manager.pack(history, max(budget, 0))
+        
         messages = []
-        for msg in history[-10:]:
+        for msg in window:
             messages.append({
                 "role": msg["role"],
                 "content": msg["content"]
             })
         messages.append({"role": "user", "content": message})
+        return system_prompt, messages, provider
+    
+    def _schedule_summary(self, session_id: str, level: str, provider: str) -> None:
+        """ウィンドウから外れたターンの要約更新をバックグラウンドで開始"""
+        task = asyncio.get_running_loop().create_task(self._refresh_summary(session_id, level, provider))
+        self._background_tasks.add(task)
+        task.add_done_callback(self._background_tasks.discard)
+    
+    async def _refresh_summary(self, session_id: str, level: str, provider: str) -> None:
+        """ウィンドウから外れ、まだ要約に含まれていないターンを要約に畳み込む
         
-        model = settings.get_model("anthropic")
-        response = self.anthropic_client.messages.create(
-            model=model,
-            max_tokens=1000,
-            system=system_prompt,
-            messages=messages
-        )
+        次のリクエストの発言の長さは分からないため、発言を除いた予算でウィンドウを見積もる。
+        同じセッションの要約は、他のタスクやワーカーが作っている間は作らない。
+        """
+        session = await self._offload(self.session_store.get, session_id)
+        if session is None or session.summarizing:
+            return
+        
+        history_config = settings.get_history_config()
+        turns = session.get_turns()
+        candidates = turns[-history_config.get("max_messages", 16):]
+        system_prompt = prompt_manager.get_system_prompt(level, session.summary)
+        budget = settings.get_history_budget(provider, level) - estimate_tokens(str(system_prompt))
+        _, start = self.history_manager.pack(candidates, max(budget, 0))
+        window_start = len(turns) - len(candidates) + start
+        folded = [turn for turn in turns[:window_start] if turn["seq"] > session.summary_seq]
+        if not folded:
+            return
         
-        return response.content[0].text
+        if not await self._offload(self.session_store.begin_summary, session_id):
+            return
+        try:
+            prompt = prompt_manager.get_summary_prompt(session.summary, folded)
+            summary = await self._complete(prompt, history_config.get("summary_max_tokens", 300), provider,
+                                           operation="summary", use_cache=False)
+            if summary:
+                await self._offload(self.session_store.set_summary, session_id, summary.strip(), folded[-1]["seq"])
+        except Exception as e:
+            print(f"Error updating conversation summary: {e}")
+        finally:
+            self.session_store.end_summary(session_id)
     
-    async def _get_azure_openai_response(self, message: str, system_prompt: str, history: List[Dict]) -> str:
-        """Azure OpenAI API からの回答を取得"""
-        messages = [{"role": "system", "content": system_prompt}]
+    async def stream_ai_response(self, message: str, level: str, history: Optional[List[Dict]] = None,
+                                 stats: Optional[Dict] = None, session_id: Optional[str] = None,
+                                 provider: Optional[str] = None) -> AsyncIterator[str]:
+        """AI からの回答をトークン単位でストリーミング取得
         
-        for msg in history[-10:]:
-            messages.append({
-                "role": msg["role"],
-                "content": msg["content"]
-            })
-        messages.append({"role": "user", "content": message})
+        stats に辞書を渡すと、初回トークンまでの時間（ttft_ms）と生成全体の時間（total_ms）を書き込む。
+        回答が出力予算で切れた場合は truncated を true にし、文の区切りまで切り詰めた回答を
+        trimmed_response に書き込む（送信済みのトークンは取り消せないため、画面側で置き換える）。
+        プロバイダー側のプロンプトキャッシュから読んだ入力トークン数は cache_read_tokens に書き込む。
+        session_id を指定した場合は、最後まで生成できたターンをセッションに記録する。
+        """
+        current_level.set(level)
+        if session_id:
+            current_turn.set(self.router.begin_turn(session_id))
+        system_prompt, messages, provider = await self._offload(
+            self._prepare_chat, message, level, history, session_id, provider)
+        stats = stats if stats is not None else {}
+        max_tokens, options = self._plan_output("chat", message, MAX_OUTPUT_TOKENS["chat"])
+        start = time.perf_counter()
+        chunks = []
         
-        deployment_name = settings.get_azure_openai_deployment_name()
-        if not deployment_name:
-            # フォールバックとしてモデル名を使用（互換性のため）
-            deployment_name = settings.get_model("azure_openai")
-        
-        response = self.azure_openai_client.chat.completions.create(
-            model=deployment_name,
-            messages=messages,
-            max_tokens=1000,
-            temperature=0.7,
-            top_p=0.95
+        def on_completion(completion: Completion, name: str) -> None:
+            stats["cache_read_tokens"] = completion.cache_read_tokens
+            if self._observe_output("chat", message, completion, max_tokens, name):
+                stats["truncated"] = True
+        
+        try:
+            stream = self.router.stream(
+                provider,
+                lambda p: self._watch_stream(
+                    p.stream(system_prompt, messages, max_tokens, **options, **CHAT_OPTIONS.get(p.name, {})),
+                    lambda completion: on_completion(completion, p.name)
+                ),
+                operation="chat"
+            )
+            async for chunk in stream:
+                if not chunks:
+                    stats["ttft_ms"] = (time.perf_counter() - start) * 1000
+                chunks.append(chunk)
+                yield chunk
+            
+            response = "".join(chunks)
+            if stats.get("truncated") and self.output_budget and self.output_budget.on_truncation("chat") == "trim":
+                self.output_budget.counters["chat"]["trimmed"] += 1
+                response = stats["trimmed_response"] = trim_to_sentence(response)
+            if session_id:
+                await self._offload(self.session_store.append_turn, session_id, message, response)
+                self._schedule_summary(session_id, level, provider)
+        except NoProviderAvailableError:
+            yield "I'm sorry, but the AI service is not available. Please check the API configuration."
+        except Exception as e:
+            print(f"Error streaming AI response: {e}")
+            if not chunks:
+                yield "I apologize, but I'm having trouble responding right now. Please try again."
+        finally:
+            stats["total_ms"] = (time.perf_counter() - start) * 1000
+            # トークンが1つも届かなかった場合（エラー・空の回答）は TTFT を出さない
+            ttft = f"{stats['ttft_ms']:.0f}ms" if "ttft_ms" in stats else "n/a"
+            print(f"Chat stream ({provider}): TTFT {ttft}, total {stats['total_ms']:.0f}ms")
+    
+    @staticmethod
+    async def _watch_stream(chunks: AsyncIterator[Any],
+                            on_completion: Callable[[Completion], None]) -> AsyncIterator[Any]:
+        """ストリームのチャンクをそのまま流し、最後の Completion を on_completion に渡す"""
+        async for chunk in chunks:
+            if isinstance(chunk, Completion):
+                on_completion(chunk)
+            yield chunk
+    
+    def _plan_output(self, operation: str, input_text: Optional[str], ceiling: int) -> Tuple[int, Dict]:
+        """出力予算から max_tokens と停止文字列のオプションを決める"""
+        if self.output_budget is None or input_text is None or not self.output_budget.handles(operation):
+            return ceiling, {}
+        max_tokens = self.output_budget.max_tokens(operation, current_level.get(), estimate_tokens(input_text),
+                                                   ceiling)
+        stop = self.output_budget.stop_sequences(operation)
+        return max_tokens, ({"stop": stop} if stop else {})
+    
+    def _observe_output(self, operation: str, input_text: Optional[str], completion: Completion,
+                        max_tokens: int, provider: str) -> bool:
+        """出力トークン数を出力予算に記録し、max_tokens で切れたかどうかを返す"""
+        if self.output_budget is None or input_text is None:
+            truncated = is_truncated(completion)
+        else:
+            truncated = self.output_budget.record(operation, current_level.get(), estimate_tokens(input_text),
+                                                  completion, max_tokens, provider)
+        if truncated:
+            record_truncated(provider, operation)
+        return truncated
+    
+    async def _create(self, provider: str, operation: str, ceiling: int, input_text: Optional[str],
+                      create: Callable[[Any, int, Dict], Awaitable[Completion]]) -> Tuple[Completion, str]:
+        """出力予算を適用してプロバイダーを呼び出し、(回答, 応答したプロバイダー名) を返す
+        
+        create(プロバイダー, max_tokens, 停止文字列のオプション) で1回分の呼び出しを作る。
+        input_text は予算を決める入力（学習者の発言・原文など。None なら ceiling をそのまま使う）。
+        予算で切れた回答は、呼び出しの種類の on_truncation に従って上限の予算で取り直すか、
+        文の区切りまで切り詰める。
+        """
+        max_tokens, options = self._plan_output(operation, input_text, ceiling)
+        completion, answered_by = await self.router.call(
+            provider, operation, lambda p: create(p, max_tokens, options)
         )
+        if not self._observe_output(operation, input_text, completion, max_tokens, answered_by):
+            return completion, answered_by
+        if self.output_budget is None or input_text is None:
+            return completion, answered_by
         
-        return response.choices[0].message.content
+        counters = self.output_budget.counters[operation]
+        action = self.output_budget.on_truncation(operation)
+        if action == "retry" and max_tokens < ceiling:
+            counters["retried"] += 1
+            completion, answered_by = await self.router.call(
+                provider, operation, lambda p: create(p, ceiling, options)
+            )
+            self._observe_output(operation, input_text, completion, ceiling, answered_by)
+        elif action == "trim":
+            counters["trimmed"] += 1
+            completion.text = trim_to_sentence(completion.text)
+        return completion, answered_by
     
-    async def get_translation(self, text: str, target_language: str = "japanese") -> str:
-        """テキストを翻訳"""
+    def _cache_key(self, provider: str, max_tokens: int, prompt: Union[str, PromptParts]) -> str:
+        """プロバイダーのモデルを含めたキャッシュキーを生成"""
+        return ResponseCache.make_key(provider, self.providers[provider].model, max_tokens, str(prompt))
+    
+    async def _complete(self, prompt: Union[str, PromptParts], max_tokens: int, provider: Optional[str] = None,
+                        operation: str = "complete", use_cache: bool = True,
+                        input_text: Optional[str] = None) -> Optional[str]:
+        """単一プロンプトの回答を取得（キャッシュ対応）
+        
+        prompt が PromptParts の場合は、prefix をシステムプロンプト（プロバイダー側でキャッシュする）、
+        suffix をユーザーのメッセージとして送る。
+        max_tokens は上限で、input_text を渡した場合は出力予算で決めた値で呼び出す
+        （キャッシュキーには上限を使う）。利用可能なプロバイダーがない場合は None を返す。
+        """
+        provider = provider or self.default_provider
+        candidates = self.router.candidates(provider)
+        if not candidates:
+            return None
+        
+        cache = self.response_cache if use_cache else None
+        # 優先プロバイダーのキーで引き、実際に応答したプロバイダーのキーで保存する
+        key = self._cache_key(candidates[0], max_tokens, prompt)
+        if cache:
+            cached = await cache.aget(key)
+            if cached is not None:
+                return cached
+        
+        if isinstance(prompt, PromptParts):
+            system, messages = PromptParts(prompt.prefix), [{"role": "user", "content": prompt.suffix}]
+        else:
+            system, messages = None, [{"role": "user", "content": prompt}]
+        
+        async def call() -> str:
+            completion, answered_by = await self._create(
+                provider, operation, max_tokens, input_text,
+                lambda p, budget, options: p.create(system, messages, budget, **options)
+            )
+            result = completion.text
+            if cache:
+                cache.set(self._cache_key(answered_by, max_tokens, prompt), result)
+            return result
+        
+        # 同じプロンプトの呼び出しが実行中なら、その結果を共有する
+        if self.coalescer:
+            return await self.coalescer.run(key, call)
+        return await call()
+    
+    async def get_translation(self, text: str, target_language: str = "japanese",
+                              provider: Optional[str] = None) -> str:
+        """テキストを翻訳（大文字・小文字や句読点だけが違う入力は近似重複キャッシュから返す）"""
+        namespace = f"translate:{provider or self.default_provider}:{target_language}"
+        if self.semantic_cache:
+            cached = await self.semantic_cache.aget(text, namespace, "translate")
+            if cached is not None:
+                return cached
         prompt = prompt_manager.get_translation_prompt(text, target_language)
         
         try:
-            if self.anthropic_client and self.current_provider == "anthropic":
-                model = settings.get_model("anthropic")
-                response = self.anthropic_client.messages.create(
-                    model=model,
-                    max_tokens=500,
-                    messages=[{"role": "user", "content": prompt}]
-                )
-                return response.content[0].text
-            elif self.azure_openai_client and self.current_provider == "azure_openai":
-                deployment_name = settings.get_azure_openai_deployment_name()
-                if not deployment_name:
-                    deployment_name = settings.get_model("azure_openai")
-                
-                response = self.azure_openai_client.chat.completions.create(
-                    model=deployment_name,
-                    messages=[{"role": "user", "content": prompt}],
-                    max_tokens=500
-                )
-                return response.choices[0].message.content
-            else:
+            result = await self._complete(prompt, MAX_OUTPUT_TOKENS["translate"], provider, operation="translate",
+                                          input_text=text)
+            if result is None:
                 return "Translation service not available"
+            if self.semantic_cache:
+                self.semantic_cache.set(text, namespace, result)
+            return result
+        except SupersededError:
+            # 次のターンに追い越された呼び出しは、結果ではないためエンドポイントまで伝える
+            raise
         except Exception as e:
             print(f"Error getting translation: {e}")
             return "Translation failed"
     
-    async def get_feedback(self, text: str, level: str, teacher_text: Optional[str] = None) -> str:
-        """テキストに対するフィードバックを取得"""
+    async def get_translations(self, texts: List[str], target_language: str = "japanese",
+                               provider: Optional[str] = None) -> List[str]:
+        """複数のテキストをまとめて翻訳
+        
+        キャッシュにないテキストだけを、入力トークン予算に収まるチャンクごとに
+        1回の呼び出しで翻訳する。回答を件数どおりに分解できなかったチャンクは
+        1件ずつの翻訳に切り替える。結果は1件ずつの翻訳と同じキーでキャッシュする。
+        """
+        candidates = self.router.candidates(provider or self.default_provider)
+        if not candidates:
+            return ["Translation service not available"] * len(texts)
+        
+        results: Dict[str, str] = {}
+        pending: List[str] = []
+        for text in dict.fromkeys(texts):
+            cached = None
+            if self.response_cache:
+                prompt = prompt_manager.get_translation_prompt(text, target_language)
+                cached = await self.response_cache.aget(self._cache_key(candidates[0], MAX_OUTPUT_TOKENS["translate"], prompt))
+            if cached is not None:
+                results[text] = cached
+            else:
+                pending.append(text)
+        
+        chunks = self._chunk_texts(pending)
+        translated = await asyncio.gather(
+            *[self._translate_chunk(chunk, target_language, provider, candidates[0]) for chunk in chunks]
+        )
+        for chunk, translations in zip(chunks, translated):
+            results.update(zip(chunk, translations))
+        return [results[text] for text in texts]
+    
+    def _chunk_texts(self, texts: List[str]) -> List[List[str]]:
+        """入力トークン予算と件数の上限に収まるようにテキストを分割"""
+        batch_config = settings.get_translation_batch_config()
+        max_tokens = batch_config.get("max_input_tokens", 1500)
+        max_items = batch_config.get("max_items", 20)
+        
+        chunks: List[List[str]] = []
+        chunk: List[str] = []
+        chunk_tokens = 0
+        for text in texts:
+            tokens = estimate_tokens(text)
+            if chunk and (chunk_tokens + tokens > max_tokens or len(chunk) >= max_items):
+                chunks.append(chunk)
+                chunk, chunk_tokens = [], 0
+            chunk.append(text)
+            chunk_tokens += tokens
+        if chunk:
+            chunks.append(chunk)
+        return chunks
+    
+    async def _translate_chunk(self, texts: List[str], target_language: str,
+                               provider: Optional[str], preferred: str) -> List[str]:
+        """1チャンクを1回の呼び出しで翻訳（分解できなければ1件ずつ翻訳）"""
+        if len(texts) > 1:
+            batch_config = settings.get_translation_batch_config()
+            input_tokens = sum(estimate_tokens(text) for text in texts)
+            # 和訳は英文よりトークン数が増えるため、入力の数倍を出力の上限にする
+            max_tokens = min(batch_config.get("max_output_tokens", 4000),
+                             input_tokens * batch_config.get("output_ratio", 3) + 50 * len(texts))
+            prompt = prompt_manager.get_batch_translation_prompt(texts, target_language)
+            try:
+                response = await self._complete(prompt, max_tokens, provider,
+                                                operation="translate_batch", use_cache=False)
+                translations = parse_batch_translations(response or "", len(texts))
+                if translations is not None:
+                    if self.response_cache:
+                        for text, translation in zip(texts, translations):
+                            single_prompt = prompt_manager.get_translation_prompt(text, target_language)
+                            self.response_cache.set(
+                                self._cache_key(preferred, MAX_OUTPUT_TOKENS["translate"], single_prompt), translation)
+                    return translations
+                print(f"Batch translation could not be parsed, translating {len(texts)} texts one by one")
+            except SupersededError:
+                raise
+            except Exception as e:
+                print(f"Error getting batch translation: {e}")
+        
+        return list(await asyncio.gather(
+            *[self.get_translation(text, target_language, provider) for text in texts]
+        ))
+    
+    async def get_feedback(self, text: str, level: str, teacher_text: Optional[str] = None,
+                           provider: Optional[str] = None) -> str:
+        """テキストに対するフィードバックを取得
+        
+        近似重複キャッシュはレベルと teacher_text の文脈ごとに、学習者の英文で引く。
+        """
+        current_level.set(level)
+        context = hashlib.sha256((teacher_text or "").encode("utf-8")).hexdigest()[:16]
+        namespace = f"feedback:{provider or self.default_provider}:{level}:{context}"
+        if self.semantic_cache:
+            cached = await self.semantic_cache.aget(text, namespace, "feedback")
+            if cached is not None:
+                return cached
         prompt = prompt_manager.get_feedback_prompt(text, level, teacher_text)
         
         try:
-            if self.anthropic_client and self.current_provider == "anthropic":
-                model = settings.get_model("anthropic")
-                response = self.anthropic_client.messages.create(
-                    model=model,
-                    max_tokens=800,
-                    messages=[{"role": "user", "content": prompt}]
-                )
-                return response.content[0].text
-            elif self.azure_openai_client and self.current_provider == "azure_openai":
-                deployment_name = settings.get_azure_openai_deployment_name()
-                if not deployment_name:
-                    deployment_name = settings.get_model("azure_openai")
-                
-                response = self.azure_openai_client.chat.completions.create(
-                    model=deployment_name,
-                    messages=[{"role": "user", "content": prompt}],
-                    max_tokens=800
-                )
-                return response.choices[0].message.content
-            else:
+            result = await self._complete(prompt, MAX_OUTPUT_TOKENS["feedback"], provider, operation="feedback",
+                                          input_text=text)
+            if result is None:
                 return "Feedback service not available"
+            if self.semantic_cache:
+                self.semantic_cache.set(text, namespace, result)
+            return result
+        except SupersededError:
+            raise
         except Exception as e:
             print(f"Error getting feedback: {e}")
             return "Feedback failed"
     
-    async def get_hint(self, japanese_text: str, level: str) -> str:
-        """日本語テキストから英語表現のヒントを取得"""
+    async def get_hint(self, japanese_text: str, level: str, provider: Optional[str] = None) -> str:
+        """日本語テキストから英語表現のヒントを取得
+        
+        よく使う表現はフレーズ索引から返し、索引にない場合だけ LLM に問い合わせる。
+        write_back が有効なら LLM のヒントを索引に追加する。
+        """
+        current_level.set(level)
+        if self.phrase_index is not None:
+            hint = self.phrase_index.lookup(japanese_text, level)
+            if hint is not None:
+                return hint
         prompt = prompt_manager.get_hint_prompt(japanese_text, level)
         
         try:
-            if self.anthropic_client and self.current_provider == "anthropic":
-                model = settings.get_model("anthropic")
-                response = self.anthropic_client.messages.create(
-                    model=model,
-                    max_tokens=300,
-                    messages=[{"role": "user", "content": prompt}]
-                )
-                return response.content[0].text
-            elif self.azure_openai_client and self.current_provider == "azure_openai":
-                deployment_name = settings.get_azure_openai_deployment_name()
-                if not deployment_name:
-                    deployment_name = settings.get_model("azure_openai")
-                
-                response = self.azure_openai_client.chat.completions.create(
-                    model=deployment_name,
-                    messages=[{"role": "user", "content": prompt}],
-                    max_tokens=300
-                )
-                return response.choices[0].message.content
-            else:
+            result = await self._complete(prompt, MAX_OUTPUT_TOKENS["hint"], provider, operation="hint",
+                                          input_text=japanese_text)
+            if result is None:
                 return "Hint service not available"
+            if (self.phrase_index is not None and settings.get_hint_index_config().get("write_back", False)
+                    and not result.startswith(HINT_REFUSAL_PREFIX)):
+                self.phrase_index.add(japanese_text, level, result)
+            return result
+        except SupersededError:
+            # 次のターンに追い越された呼び出しは、結果ではないためエンドポイントまで伝える
+            raise
         except Exception as e:
             print(f"Error getting hint: {e}")
             return "Hint request failed"
     
-    def switch_provider(self, provider: str) -> bool:
-        """AI プロバイダーを切り替え"""
-        if provider in ['anthropic', 'azure_openai']:
-            self.current_provider = provider
-            return True
-        return False
\ No newline at end of file
+    async def get_turn_analysis(self, user_text: str, teacher_text: str, level: str,
+                                context_text: Optional[str] = None,
+                                provider: Optional[str] = None,
+                                session_id: Optional[str] = None) -> Dict[str, str]:
+        """1ターン分の和訳（学生・先生）とフィードバックをまとめて取得
+        
+        3つの呼び出しはサーバー側で並列に実行する。まとめるのはフロントエンドからの
+        HTTP の往復だけで、プロバイダーに送るプロンプトは個別の呼び出しと同じ
+        （トークン数は減らない）。フィードバックの文脈には context_text（省略時は
+        teacher_text）を使用する。
+        session_id を指定した場合、呼び出しの枠を待っている間にそのセッションの
+        次のターンが始まると、残りの呼び出しは行わずに SupersededError を送出する。
+        """
+        current_level.set(level)
+        if session_id:
+            current_turn.set((session_id, self.router.turns.current(session_id)))
+        user_translation, teacher_translation, feedback = await asyncio.gather(
+            self.get_translation(user_text, provider=provider),
+            self.get_translation(teacher_text, provider=provider),
+            self.get_feedback(user_text, level, context_text or teacher_text, provider=provider)
+        )
+        return {
+            "user_translation": user_translation,
+            "teacher_translation": teacher_translation,
+            "feedback": feedback
+        }
+    
+    async def aclose(self) -> None:
+        """APIクライアントのコネクションを閉じる"""
+        for provider in list(self.providers.values()) + self._retired_providers:
+            await provider.aclose()
+        self._retired_providers.clear()
+        self.state.close()
+    
+    def apply_config(self, old, new) -> List[object]:
+        """再読み込みした設定を反映し、使われなくなったプロバイダーのアダプターを返す
+        
+        認証情報とエンドポイントが変わったプロバイダーだけアダプターを作り直す。
+        モデル名は呼び出しごとに設定から読むため、そのまま反映される。
+        """
+        providers = create_providers(self.providers)
+        retired = [provider for name, provider in self.providers.items() if providers.get(name) is not provider]
+        self._retired_providers.extend(retired)
+        self.providers = providers
+        self.router.providers = providers
+        # 実行中に切り替えたデフォルトは、設定ファイルの値が変わったときだけ上書きする
+        if old.get("default_provider") != new.get("default_provider"):
+            self.default_provider = settings.get_default_provider()
+        return retired
+    
+    async def close_retired(self, providers: List[object], delay: float = RETIRED_CLIENT_GRACE_SECONDS) -> None:
+        """処理中の呼び出しが終わるのを待ってから、使われなくなったクライアントを閉じる"""
+        await asyncio.sleep(delay)
+        for provider in providers:
+            if provider not in self._retired_providers:
+                continue
+            self._retired_providers.remove(provider)
+            try:
+                await provider.aclose()
+            except Exception as e:
+                print(f"Error closing retired provider client: {e}")
+    
+    def switch_provider(self, provider: str, session_id: Optional[str] = None) -> bool:
+        """AI プロバイダーを切り替え
+        
+        session_id を指定した場合はそのセッションだけ、指定しない場合はデフォルトを切り替える。
+        """
+        if provider not in PROVIDER_NAMES:
+            return False
+        if session_id:
+            self.session_store.set_provider(session_id, provider)
+        else:
+            self.default_provider = provider
+        return True
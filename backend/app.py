@@ -1,28 +1,215 @@
 """Flask アプリケーション"""
 
-from flask import Flask, request, jsonify, send_from_directory
+import asyncio
+import json
+import time
+from flask import Flask, Response, abort, g, request, jsonify, stream_with_context
 from flask_cors import CORS
 from pathlib import Path
 from config.settings import settings
 from .ai_service import AIService
+from .assets import IMMUTABLE_CACHE_CONTROL, REVALIDATE_CACHE_CONTROL, AssetPipeline
+from .deadlines import DeadlineExceededError, RequestAbortedError, disconnect_checker, with_deadline
+from .event_loop import background_loop
+from .scheduler import PRIORITY_CLASSES, SupersededError
+from .telemetry import (Counter, Gauge, SamplingProfiler, configure_json_logs, http_request_seconds, registry,
+                        requests_aborted)
+
+def _sse_event(event: str, data: dict) -> str:
+    """Server-Sent Events 形式のイベント文字列を生成"""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+def _register_gauges(ai_service: AIService) -> None:
+    """流量制御・キャッシュ・セッションの現在値をメトリクスに登録"""
+    limiters = ai_service.router.limiters
+    registry.register(Gauge(
+        'llm_limiter_in_flight', 'Provider calls currently holding a concurrency slot.', ['provider'],
+        lambda: {(name,): limiter.in_flight for name, limiter in limiters.items()}
+    ))
+    registry.register(Gauge(
+        'llm_limiter_queue_depth', 'Provider calls waiting for a concurrency slot.', ['provider'],
+        lambda: {(name,): limiter.queued for name, limiter in limiters.items()}
+    ))
+    registry.register(Gauge(
+        'llm_scheduler_in_flight', 'Provider calls holding a slot, by priority class.', ['provider', 'priority_class'],
+        lambda: {(name, priority): count for name, limiter in limiters.items()
+                 for priority, count in limiter.gate.in_use_by_class.items()}
+    ))
+    registry.register(Gauge(
+        'llm_scheduler_queue_depth', 'Provider calls waiting for a slot, by priority class.', ['provider', 'priority_class'],
+        lambda: {(name, priority): limiter.gate.queue_depth(priority) for name, limiter in limiters.items()
+                 for priority in PRIORITY_CLASSES}
+    ))
+    registry.register(Counter(
+        'llm_scheduler_dropped_total', 'Queued provider calls dropped after their deadline or a newer turn.',
+        ['provider', 'priority_class', 'reason'],
+        lambda: {(name, priority, reason): counters[reason] for name, limiter in limiters.items()
+                 for priority, counters in limiter.gate.counters.items() for reason in ('expired', 'superseded')}
+    ))
+    registry.register(Gauge(
+        'app_sessions', 'Conversation sessions held in memory.', [],
+        lambda: {(): ai_service.session_store.count()}
+    ))
+    if ai_service.response_cache:
+        cache = ai_service.response_cache
+        registry.register(Counter(
+            'app_response_cache_events_total', 'Response cache lookups and evictions.', ['event'],
+            lambda: {(event,): value for event, value in cache.get_stats().items()
+                     if event in ('hits', 'disk_hits', 'misses', 'evictions', 'expirations')}
+        ))
+    if ai_service.semantic_cache:
+        semantic = ai_service.semantic_cache
+        registry.register(Counter(
+            'app_semantic_cache_events_total', 'Near-duplicate cache lookups and evictions.', ['event'],
+            lambda: {(event,): value for event, value in semantic.get_stats().items()
+                     if event in ('hits', 'near_hits', 'misses', 'evictions', 'expirations')}
+        ))
 
 def create_app() -> Flask:
     """Flask アプリケーションを作成"""
+    # 静的ファイルは Flask の static ハンドラーではなく AssetPipeline で配信する
     app = Flask(__name__, 
-                static_folder='../frontend/static',
+                static_folder=None,
                 template_folder='../frontend')
     CORS(app)
     
-    # AI サービス初期化
+    frontend_dir = Path(__file__).resolve().parent.parent / 'frontend'
+    assets_config = settings.get_static_assets_config()
+    assets = AssetPipeline(
+        frontend_dir / 'static',
+        frontend_dir / 'index.html',
+        compress_min_bytes=assets_config.get('compress_min_bytes', 512),
+        gzip_level=assets_config.get('gzip_level', 9),
+        brotli_quality=assets_config.get('brotli_quality', 11),
+        auto_rebuild=assets_config.get('auto_rebuild', False)
+    )
+    app.extensions['assets'] = assets
+    
+    # AI サービス初期化（API 呼び出しはすべて共有イベントループ上で実行する）
     ai_service = AIService()
+    app.extensions['ai_service'] = ai_service
+    
+    observability_config = settings.get_observability_config()
+    configure_json_logs(observability_config.get('json_logs', False))
+    profiler_config = observability_config.get('profiler', {})
+    profiler = SamplingProfiler(profiler_config.get('sample_rate', 0.0),
+                                profiler_config.get('output_dir', 'data/profiles'))
+    _register_gauges(ai_service)
+    
+    def on_config_reloaded(old, new) -> None:
+        """設定ファイルの変更を AI サービスに反映"""
+        retired = ai_service.apply_config(old, new)
+        if retired:
+            background_loop.submit(ai_service.close_retired(retired))
+    
+    # プロセス内で1つだけ登録する（create_app() を呼び直すと新しいアプリのものに置き換わる）
+    settings.add_listener(on_config_reloaded, name='app')
+    reload_config = settings.get_config_reload_config()
+    if reload_config.get('enabled', True):
+        settings.start_watching(reload_config.get('interval_seconds', 2))
+    
+    @app.before_request
+    def start_request_timer():
+        """リクエストの計測を開始"""
+        g.request_start = time.perf_counter()
+        g.profile = profiler.start()
+    
+    @app.after_request
+    def record_request_metrics(response):
+        """リクエストのレイテンシを記録（ストリーミングはヘッダー送信まで）"""
+        start = g.pop('request_start', None)
+        if start is not None:
+            http_request_seconds.observe(time.perf_counter() - start, endpoint=request.endpoint or 'unknown',
+                                         method=request.method, status=response.status_code)
+        return response
+    
+    @app.teardown_request
+    def stop_request_profile(error=None):
+        """サンプリング対象のリクエストならプロファイルを保存"""
+        profile = g.pop('profile', None)
+        if profile is not None:
+            profiler.stop(profile, request.endpoint or 'unknown')
+    
+    deadlines_config = settings.get_deadlines_config()
+    poll_interval = deadlines_config.get('disconnect_check_interval_ms', 250) / 1000
+    
+    def run_ai(coro):
+        """AI サービスのコルーチンをエンドポイントの締め切り付きで実行（クライアントが切断したら中止）
+        
+        結果が返るまで呼び出し元のスレッドを占有するため、同時に処理できるリクエスト数は
+        サーバーのスレッド数で決まる。
+        """
+        return background_loop.run(with_deadline(coro, settings.get_deadline(request.endpoint)),
+                                   disconnected=disconnect_checker(request.environ),
+                                   poll_interval=poll_interval)
+    
+    @app.errorhandler(RequestAbortedError)
+    def request_aborted(error):
+        """締め切り超過（504）とクライアント切断（499）を区別できるエラーコードで返す"""
+        requests_aborted.inc(endpoint=request.endpoint or 'unknown', reason=error.code)
+        print(f"Request aborted ({request.endpoint}): {error.code}")
+        status = 504 if isinstance(error, DeadlineExceededError) else 499
+        return jsonify({'error': error.code}), status
+    
+    @app.errorhandler(SupersededError)
+    def request_superseded(error):
+        """同じセッションの次のターンに追い越された分析は 409 で返す（画面側は表示しない）"""
+        requests_aborted.inc(endpoint=request.endpoint or 'unknown', reason='superseded')
+        return jsonify({'error': 'superseded', 'superseded': True}), 409
     
     @app.route('/')
     def index():
-        """メインページを返す"""
-        return send_from_directory('../frontend', 'index.html')
+        """メインページを返す（静的ファイルの参照はハッシュ付き URL に書き換え済み）"""
+        assets.refresh()
+        return assets.index.response(request, REVALIDATE_CACHE_CONTROL)
+    
+    @app.route('/static/<path:filename>', endpoint='static')
+    def static_file(filename):
+        """静的ファイルを返す（ハッシュ付き URL は長期キャッシュさせる）"""
+        assets.refresh()
+        asset, fingerprinted = assets.lookup(filename)
+        if asset is None:
+            abort(404)
+        return asset.response(request, IMMUTABLE_CACHE_CONTROL if fingerprinted else REVALIDATE_CACHE_CONTROL)
+    
+    def _resolve_session_id(data: dict):
+        """リクエストがセッションモードならセッションIDを返す
+
+        history を送ってくる従来のクライアントには None を返し、送られた履歴をそのまま使う。
+        """
+        if data.get('session_id') or 'history' not in data:
+            return ai_service.session_store.get_or_create(data.get('session_id'))
+        return None
+    
+    @app.route('/healthz', methods=['GET'])
+    def healthz():
+        """プロセスが応答できるかどうか（liveness）"""
+        return jsonify({'status': 'ok'})
+    
+    @app.route('/readyz', methods=['GET'])
+    def readyz():
+        """リクエストを受けられるかどうか（readiness）
+        
+        プロバイダーが1つ以上設定され、イベントループが応答する場合に 200 を返す。
+        """
+        checks = {'providers': bool(ai_service.providers)}
+        try:
+            background_loop.run(asyncio.sleep(0), timeout=1)
+            checks['event_loop'] = True
+        except Exception:
+            checks['event_loop'] = False
+        ready = all(checks.values())
+        return jsonify({'status': 'ready' if ready else 'not ready', 'checks': checks}), 200 if ready else 503
+    
+    @app.route('/metrics', methods=['GET'])
+    def metrics():
+        """Prometheus 形式のメトリクスを出力"""
+        if not observability_config.get('metrics_enabled', True):
+            return jsonify({'error': 'Metrics are disabled'}), 404
+        return Response(registry.render(), mimetype='text/plain; version=0.0.4')
     
     @app.route('/api/chat', methods=['POST'])
-    async def chat():
+    def chat():
         """チャットAPIエンドポイント"""
         try:
             data = request.get_json()
@@ -33,14 +220,76 @@ def create_app() -> Flask:
             if not message:
                 return jsonify({'error': 'Message is required'}), 400
             
-            response = await ai_service.get_ai_response(message, level, history)
-            return jsonify({'response': response})
+            session_id = _resolve_session_id(data)
+            response = run_ai(ai_service.get_ai_response(message, level, history, session_id))
+            result = {'response': response}
+            if session_id:
+                result['session_id'] = session_id
+            return jsonify(result)
+        except (RequestAbortedError, SupersededError):
+            raise
         except Exception as e:
             print(f"Chat API error: {e}")
             return jsonify({'error': 'Internal server error'}), 500
     
+    @app.route('/api/chat/stream', methods=['POST'])
+    def chat_stream():
+        """チャットAPIエンドポイント（Server-Sent Events でトークンを逐次送信）"""
+        try:
+            data = request.get_json()
+            message = data.get('message', '')
+            level = data.get('level', '400')
+            history = data.get('history', [])
+            
+            if not message:
+                return jsonify({'error': 'Message is required'}), 400
+            
+            session_id = _resolve_session_id(data)
+        except Exception as e:
+            print(f"Chat stream API error: {e}")
+            return jsonify({'error': 'Internal server error'}), 500
+        
+        deadline = settings.get_deadline('chat_stream')
+        disconnected = disconnect_checker(request.environ)
+        
+        def generate():
+            stats = {}
+            chunks = []
+            try:
+                for chunk in background_loop.iterate(
+                        ai_service.stream_ai_response(message, level, history, stats, session_id),
+                        deadline=deadline, disconnected=disconnected, poll_interval=poll_interval):
+                    chunks.append(chunk)
+                    yield _sse_event('delta', {'text': chunk})
+                # 出力予算で切れた回答は、文の区切りまで切り詰めたものに置き換えさせる
+                response = stats.pop('trimmed_response', None) or ''.join(chunks)
+                done = {'response': response, **stats}
+                if session_id:
+                    done['session_id'] = session_id
+                yield _sse_event('done', done)
+            except RequestAbortedError as e:
+                requests_aborted.inc(endpoint='chat_stream', reason=e.code)
+                print(f"Chat stream aborted: {e.code}")
+                yield _sse_event('error', {'error': e.code})
+            except Exception as e:
+                print(f"Chat stream API error: {e}")
+                yield _sse_event('error', {'error': 'Internal server error'})
+        
+        return Response(stream_with_context(generate()), mimetype='text/event-stream',
+                        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+    
+    @app.route('/api/session/<session_id>', methods=['DELETE'])
+    def delete_session(session_id):
+        """会話セッションを削除する"""
+        try:
+            ai_service.session_store.delete(session_id)
+            return jsonify({'success': True})
+        except Exception as e:
+            print(f"Session delete error: {e}")
+            return jsonify({'error': 'Internal server error'}), 500
+    
     @app.route('/api/translate', methods=['POST'])
-    async def translate():
+    def translate():
         """翻訳APIエンドポイント"""
         try:
             data = request.get_json()
@@ -50,14 +299,42 @@ def create_app() -> Flask:
             if not text:
                 return jsonify({'error': 'Text is required'}), 400
             
-            translation = await ai_service.get_translation(text, target_language)
+            translation = run_ai(ai_service.get_translation(
+                text, target_language, provider=ai_service.resolve_provider(data.get('session_id'))))
             return jsonify({'translation': translation})
+        except (RequestAbortedError, SupersededError):
+            raise
         except Exception as e:
             print(f"Translation API error: {e}")
             return jsonify({'error': 'Internal server error'}), 500
     
+    @app.route('/api/translate/batch', methods=['POST'])
+    def translate_batch():
+        """一括翻訳APIエンドポイント（texts と同じ順序で translations を返す）"""
+        try:
+            data = request.get_json()
+            texts = data.get('texts')
+            target_language = data.get('target_language', 'japanese')
+            
+            if not isinstance(texts, list) or not texts:
+                return jsonify({'error': 'Texts are required'}), 400
+            if not all(isinstance(text, str) and text for text in texts):
+                return jsonify({'error': 'Each text must be a non-empty string'}), 400
+            max_texts = settings.get_translation_batch_config().get('max_texts', 200)
+            if len(texts) > max_texts:
+                return jsonify({'error': f'Too many texts (max {max_texts})'}), 400
+            
+            translations = run_ai(ai_service.get_translations(
+                texts, target_language, provider=ai_service.resolve_provider(data.get('session_id'))))
+            return jsonify({'translations': translations})
+        except (RequestAbortedError, SupersededError):
+            raise
+        except Exception as e:
+            print(f"Batch translation API error: {e}")
+            return jsonify({'error': 'Internal server error'}), 500
+    
     @app.route('/api/feedback', methods=['POST'])
-    async def feedback():
+    def feedback():
         """フィードバックAPIエンドポイント"""
         try:
             data = request.get_json()
@@ -68,14 +345,41 @@ def create_app() -> Flask:
             if not text:
                 return jsonify({'error': 'Text is required'}), 400
             
-            feedback_result = await ai_service.get_feedback(text, level, teacher_text)
+            feedback_result = run_ai(ai_service.get_feedback(
+                text, level, teacher_text, provider=ai_service.resolve_provider(data.get('session_id'))))
             return jsonify({'feedback': feedback_result})
+        except (RequestAbortedError, SupersededError):
+            raise
         except Exception as e:
             print(f"Feedback API error: {e}")
             return jsonify({'error': 'Internal server error'}), 500
     
+    @app.route('/api/turn-analysis', methods=['POST'])
+    def turn_analysis():
+        """ターン分析APIエンドポイント（和訳2件とフィードバックを1リクエストで返す）"""
+        try:
+            data = request.get_json()
+            user_text = data.get('user_text', '')
+            teacher_text = data.get('teacher_text', '')
+            context_text = data.get('context_text')
+            level = data.get('level', '400')
+            
+            if not user_text or not teacher_text:
+                return jsonify({'error': 'User text and teacher text are required'}), 400
+            
+            session_id = data.get('session_id')
+            result = run_ai(ai_service.get_turn_analysis(
+                user_text, teacher_text, level, context_text,
+                provider=ai_service.resolve_provider(session_id), session_id=session_id))
+            return jsonify(result)
+        except (RequestAbortedError, SupersededError):
+            raise
+        except Exception as e:
+            print(f"Turn analysis API error: {e}")
+            return jsonify({'error': 'Internal server error'}), 500
+    
     @app.route('/api/hint', methods=['POST'])
-    async def hint():
+    def hint():
         """ヒントAPIエンドポイント"""
         try:
             data = request.get_json()
@@ -85,8 +389,11 @@ def create_app() -> Flask:
             if not japanese_text:
                 return jsonify({'error': 'Japanese text is required'}), 400
             
-            hint_result = await ai_service.get_hint(japanese_text, level)
+            hint_result = run_ai(ai_service.get_hint(
+                japanese_text, level, provider=ai_service.resolve_provider(data.get('session_id'))))
             return jsonify({'hint': hint_result})
+        except (RequestAbortedError, SupersededError):
+            raise
         except Exception as e:
             print(f"Hint API error: {e}")
             return jsonify({'error': 'Internal server error'}), 500
@@ -98,20 +405,88 @@ def create_app() -> Flask:
             data = request.get_json()
             provider = data.get('provider', 'anthropic')
             
-            if ai_service.switch_provider(provider):
-                return jsonify({'success': True, 'provider': provider})
+            # 切り替えはセッション単位（他のユーザーには影響しない）
+            session_id = ai_service.session_store.get_or_create(data.get('session_id'))
+            if ai_service.switch_provider(provider, session_id):
+                return jsonify({'success': True, 'provider': provider, 'session_id': session_id})
             else:
                 return jsonify({'error': 'Invalid provider'}), 400
         except Exception as e:
             print(f"Provider switch error: {e}")
             return jsonify({'error': 'Internal server error'}), 500
     
+    @app.route('/api/cache/stats', methods=['GET'])
+    def cache_stats():
+        """レスポンスキャッシュの統計を取得"""
+        try:
+            semantic = ai_service.semantic_cache
+            semantic_stats = {'enabled': True, **semantic.get_stats()} if semantic else {'enabled': False}
+            if not ai_service.response_cache:
+                return jsonify({'enabled': False, 'semantic': semantic_stats})
+            return jsonify({'enabled': True, **ai_service.response_cache.get_stats(), 'semantic': semantic_stats})
+        except Exception as e:
+            print(f"Cache stats API error: {e}")
+            return jsonify({'error': 'Internal server error'}), 500
+    
+    @app.route('/api/hint-index/stats', methods=['GET'])
+    def hint_index_stats():
+        """ヒント用フレーズ索引のヒット率・検索時間の統計を取得"""
+        try:
+            if not ai_service.phrase_index:
+                return jsonify({'enabled': False})
+            return jsonify({'enabled': True, **ai_service.phrase_index.get_stats()})
+        except Exception as e:
+            print(f"Hint index stats API error: {e}")
+            return jsonify({'error': 'Internal server error'}), 500
+    
+    @app.route('/api/output-budget/stats', methods=['GET'])
+    def output_budget_stats():
+        """呼び出しの種類ごとの出力予算の学習状況と、予算で切れた回数を取得"""
+        try:
+            if not ai_service.output_budget:
+                return jsonify({'enabled': False})
+            return jsonify({'enabled': True, **ai_service.output_budget.get_stats()})
+        except Exception as e:
+            print(f"Output budget stats API error: {e}")
+            return jsonify({'error': 'Internal server error'}), 500
+    
+    @app.route('/api/shared-state/stats', methods=['GET'])
+    def shared_state_stats():
+        """ワーカー間で共有する状態の保存先と、読み書きに失敗した（時間切れを含む）回数を取得"""
+        try:
+            state = ai_service.state
+            cache_stats = ai_service.response_cache.get_stats() if ai_service.response_cache else {}
+            return jsonify({
+                'backend': state.name,
+                'shared': state.shared,
+                'write_errors': state.write_errors,
+                'session_errors': ai_service.session_store.shared_errors,
+                'cache_errors': cache_stats.get('shared_errors', 0),
+                'limiter_errors': {name: limiter.counters['shared_errors']
+                                   for name, limiter in ai_service.router.limiters.items()}
+            })
+        except Exception as e:
+            print(f"Shared state stats API error: {e}")
+            return jsonify({'error': 'Internal server error'}), 500
+    
+    @app.route('/api/router/stats', methods=['GET'])
+    def router_stats():
+        """プロバイダーごとのレイテンシ・エラー率・流量制御・フェイルオーバーの統計を取得"""
+        try:
+            stats = ai_service.router.get_stats()
+            if ai_service.coalescer:
+                stats['coalescing'] = ai_service.coalescer.get_stats()
+            return jsonify(stats)
+        except Exception as e:
+            print(f"Router stats API error: {e}")
+            return jsonify({'error': 'Internal server error'}), 500
+    
     @app.route('/api/config', methods=['GET'])
     def get_config():
         """UI設定を取得"""
         try:
             ui_config = settings.get_ui_config()
-            return jsonify(ui_config)
+            return jsonify(dict(ui_config))
         except Exception as e:
             print(f"Config API error: {e}")
             return jsonify({'error': 'Internal server error'}), 500
@@ -0,0 +1,154 @@
+"""静的ファイル配信モジュール
+
+起動時に frontend/static 以下のファイルを読み込み、内容のハッシュを含む URL
+（例: static/css/style.3f2a9c1e4b7d.css）を割り当てて index.html の参照を書き換える。
+圧縮した方が小さくなるファイルは gzip と brotli の圧縮版をメモリ上に用意しておき、
+リクエストの Accept-Encoding に合わせて返す。ハッシュ付きの URL は内容が変わらないため
+1年間キャッシュさせ（immutable）、それ以外は ETag で再検証させる（304）。
+brotli は brotli パッケージがインストールされている場合のみ使う。
+"""
+
+import gzip
+import hashlib
+import mimetypes
+import re
+import threading
+from pathlib import Path
+from typing import Dict, Optional, Tuple
+
+from flask import Response
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# ハッシュ付き URL のキャッシュ期間（1年）
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+# ハッシュなしの URL と index.html は毎回 ETag で再検証させる
+REVALIDATE_CACHE_CONTROL = "no-cache"
+# 圧縮の効果がある Content-Type
+COMPRESSIBLE_TYPES = ("text/", "application/javascript", "application/json", "image/svg+xml")
+
+# index.html 内の静的ファイルへの参照（href="static/..." / src="/static/..."）
+_STATIC_REFERENCE_PATTERN = re.compile(r'''(?P<attr>\b(?:href|src)=["'])(?P<slash>/?)static/(?P<path>[^"'?#]+)''')
+
+
+class StaticAsset:
+    """1つの静的ファイルと、その圧縮版"""
+
+    def __init__(self, body: bytes, content_type: str, compress_min_bytes: int = 512,
+                 gzip_level: int = 9, brotli_quality: int = 11):
+        self.content_type = content_type
+        self.digest = hashlib.sha256(body).hexdigest()[:12]
+        self.variants: Dict[str, bytes] = {"identity": body}
+        if len(body) >= compress_min_bytes and content_type.startswith(COMPRESSIBLE_TYPES):
+            compressed = gzip.compress(body, compresslevel=gzip_level, mtime=0)
+            if len(compressed) < len(body):
+                self.variants["gzip"] = compressed
+            if brotli is not None:
+                compressed = brotli.compress(body, quality=brotli_quality)
+                if len(compressed) < len(body):
+                    self.variants["br"] = compressed
+
+    def negotiate(self, accept_encodings) -> str:
+        """クライアントが受け付ける中で最も小さい表現の Content-Encoding を選ぶ"""
+        for encoding in ("br", "gzip"):
+            if encoding in self.variants and accept_encodings[encoding]:
+                return encoding
+        return "identity"
+
+    def response(self, request, cache_control: str) -> Response:
+        """リクエストに合わせたレスポンスを生成（If-None-Match が一致すれば 304）"""
+        encoding = self.negotiate(request.accept_encodings)
+        response = Response(self.variants[encoding], mimetype=self.content_type)
+        if encoding != "identity":
+            response.headers["Content-Encoding"] = encoding
+        response.headers["Cache-Control"] = cache_control
+        response.vary.add("Accept-Encoding")
+        # 強い ETag は表現ごとに異なる値にする
+        response.set_etag(self.digest if encoding == "identity" else f"{self.digest}-{encoding}")
+        return response.make_conditional(request)
+
+
+class AssetPipeline:
+    """静的ファイルのハッシュ付き URL と圧縮版を管理するクラス"""
+
+    def __init__(self, static_dir: Path, index_file: Path, compress_min_bytes: int = 512,
+                 gzip_level: int = 9, brotli_quality: int = 11, auto_rebuild: bool = False):
+        self.static_dir = Path(static_dir)
+        self.index_file = Path(index_file)
+        self.compress_min_bytes = compress_min_bytes
+        self.gzip_level = gzip_level
+        self.brotli_quality = brotli_quality
+        self.auto_rebuild = auto_rebuild
+        self.index: Optional[StaticAsset] = None
+        self.assets: Dict[str, StaticAsset] = {}
+        self.fingerprinted: Dict[str, StaticAsset] = {}
+        self.urls: Dict[str, str] = {}
+        self._mtimes: Dict[Path, int] = {}
+        self._lock = threading.Lock()
+        self.build()
+
+    def _make_asset(self, body: bytes, content_type: str) -> StaticAsset:
+        return StaticAsset(body, content_type, self.compress_min_bytes, self.gzip_level, self.brotli_quality)
+
+    def _source_mtimes(self) -> Dict[Path, int]:
+        files = [path for path in self.static_dir.rglob("*") if path.is_file()] + [self.index_file]
+        return {path: path.stat().st_mtime_ns for path in files}
+
+    @staticmethod
+    def fingerprint(path: str, digest: str) -> str:
+        """css/style.css → css/style.<digest>.css"""
+        stem, dot, suffix = path.rpartition(".")
+        if not dot or "/" in suffix:
+            return f"{path}.{digest}"
+        return f"{stem}.{digest}.{suffix}"
+
+    def build(self) -> None:
+        """静的ファイルを読み込み、ハッシュ付き URL・圧縮版・書き換えた index.html を作る"""
+        mtimes = self._source_mtimes()
+        assets, fingerprinted, urls = {}, {}, {}
+        for path in sorted(mtimes):
+            if path == self.index_file:
+                continue
+            relative = path.relative_to(self.static_dir).as_posix()
+            content_type = mimetypes.guess_type(relative)[0] or "application/octet-stream"
+            asset = self._make_asset(path.read_bytes(), content_type)
+            assets[relative] = asset
+            hashed = self.fingerprint(relative, asset.digest)
+            fingerprinted[hashed] = asset
+            urls[relative] = hashed
+
+        def rewrite(match: re.Match) -> str:
+            path = match.group("path")
+            return f"{match.group('attr')}{match.group('slash')}static/{urls.get(path, path)}"
+
+        html = _STATIC_REFERENCE_PATTERN.sub(rewrite, self.index_file.read_text(encoding="utf-8"))
+        index = self._make_asset(html.encode("utf-8"), "text/html; charset=utf-8")
+
+        # 辞書は書き換えずに作り直して差し替える（リクエストスレッドはロックなしで読む）
+        self.assets, self.fingerprinted, self.urls, self.index = assets, fingerprinted, urls, index
+        self._mtimes = mtimes
+
+    def refresh(self) -> None:
+        """auto_rebuild が有効なら、ファイルが変わっていれば作り直す（開発用）"""
+        if not self.auto_rebuild:
+            return
+        with self._lock:
+            if self._source_mtimes() != self._mtimes:
+                self.build()
+
+    def lookup(self, filename: str) -> Tuple[Optional[StaticAsset], bool]:
+        """URL のパスからファイルを探し、(ファイル, ハッシュ付きかどうか) を返す"""
+        asset = self.fingerprinted.get(filename)
+        if asset is not None:
+            return asset, True
+        return self.assets.get(filename), False
+
+    def get_stats(self) -> Dict[str, Dict[str, int]]:
+        """ファイルごとの表現別サイズ（バイト）"""
+        stats = {"index.html": {name: len(body) for name, body in self.index.variants.items()}}
+        for path, asset in self.assets.items():
+            stats[path] = {name: len(body) for name, body in asset.variants.items()}
+        return stats
@@ -0,0 +1,220 @@
+"""レスポンスキャッシュモジュール"""
+
+import asyncio
+import concurrent.futures
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Dict, Optional, Tuple
+
+from .shared_state import StateBackend, StateBackendError
+
+
+class ResponseCache:
+    """LLM の応答をプロンプトの内容で引くキャッシュ
+
+    メモリ上の LRU（件数上限 + TTL）を1段目とし、disk_path を指定した場合は
+    SQLite のディスクキャッシュを2段目として使う。ディスク側は再起動後も残る。
+    ディスクの読み書きはキャッシュごとに1本の専用スレッドで順番に実行し、書き込みは待たない
+    （commit の fsync でイベントループが止まらないようにする）。
+    shared（ワーカー間の共有状態）を指定した場合は、他のワーカーが保存した応答も
+    2段目から引けるよう、共有状態にも保存する。イベントループ上からは aget を使う
+    （get はディスクと共有状態の応答を呼び出し元のスレッドで待つ）。
+    """
+
+    def __init__(self, max_entries: int = 1000, ttl_seconds: float = 86400,
+                 disk_path: Optional[str] = None, shared: Optional[StateBackend] = None):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.shared = shared
+        self._entries: "OrderedDict[str, Tuple[str, float]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {
+            "hits": 0,
+            "disk_hits": 0,
+            "shared_hits": 0,
+            "misses": 0,
+            "evictions": 0,
+            "expirations": 0,
+            "shared_errors": 0,
+        }
+        self._db: Optional[sqlite3.Connection] = None
+        self._disk_executor: Optional[concurrent.futures.ThreadPoolExecutor] = None
+        self._disk_executor_pid = 0
+        if disk_path:
+            self._db = self._open_disk(disk_path)
+
+    @staticmethod
+    def make_key(provider: str, model: str, max_tokens: int, prompt: str) -> str:
+        """プロバイダー・モデル・最大トークン数・プロンプトからキャッシュキーを生成"""
+        digest = hashlib.sha256()
+        for part in (provider, model, str(max_tokens), prompt):
+            digest.update(part.encode("utf-8"))
+            digest.update(b"\0")
+        return digest.hexdigest()
+
+    def _open_disk(self, disk_path: str) -> sqlite3.Connection:
+        """ディスクキャッシュを開く"""
+        path = Path(disk_path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        db = sqlite3.connect(str(path), check_same_thread=False)
+        db.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            "key TEXT PRIMARY KEY, value TEXT NOT NULL, created_at REAL NOT NULL)"
+        )
+        # 起動時に期限切れの行を掃除する
+        db.execute("DELETE FROM responses WHERE created_at < ?", (time.time() - self.ttl_seconds,))
+        db.commit()
+        return db
+
+    def _disk(self) -> concurrent.futures.ThreadPoolExecutor:
+        """ディスクの読み書きを実行する専用スレッド（fork 後は作り直す）"""
+        with self._lock:
+            if self._disk_executor is None or self._disk_executor_pid != os.getpid():
+                self._disk_executor = concurrent.futures.ThreadPoolExecutor(
+                    max_workers=1, thread_name_prefix="response-cache-disk")
+                self._disk_executor_pid = os.getpid()
+            return self._disk_executor
+
+    def get(self, key: str) -> Optional[str]:
+        """キャッシュから値を取得（期限切れ・未登録なら None）"""
+        now = time.time()
+        value = self._get_memory(key, now)
+        if value is None and self._db is not None:
+            value = self._disk().submit(self._get_disk, key, now).result()
+        if value is not None:
+            return value
+        if self.shared is not None:
+            try:
+                value = self.shared.run(self.shared.get, f"cache:{key}")
+            except StateBackendError as e:
+                self._shared_read_failed(e)
+        return self._finish_get(key, value, now)
+
+    async def aget(self, key: str) -> Optional[str]:
+        """get と同じ（ディスクと共有状態はイベントループを止めずに引く）"""
+        now = time.time()
+        value = self._get_memory(key, now)
+        if value is None and self._db is not None:
+            value = await asyncio.wrap_future(self._disk().submit(self._get_disk, key, now))
+        if value is not None:
+            return value
+        if self.shared is not None:
+            try:
+                value = await self.shared.arun(self.shared.get, f"cache:{key}")
+            except StateBackendError as e:
+                self._shared_read_failed(e)
+        return self._finish_get(key, value, now)
+
+    def _get_memory(self, key: str, now: float) -> Optional[str]:
+        """メモリから値を取得（ヒットの統計もここで数える）"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            value, created_at = entry
+            if now - created_at <= self.ttl_seconds:
+                self._entries.move_to_end(key)
+                self._stats["hits"] += 1
+                return value
+            del self._entries[key]
+            self._stats["expirations"] += 1
+            return None
+
+    def _get_disk(self, key: str, now: float) -> Optional[str]:
+        """ディスクから値を取得し、メモリにも入れる（ディスク用のスレッドで実行する）"""
+        try:
+            row = self._db.execute("SELECT value, created_at FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is not None and now - row[1] > self.ttl_seconds:
+                self._db.execute("DELETE FROM responses WHERE key = ?", (key,))
+                self._db.commit()
+        except sqlite3.Error as e:
+            print(f"Disk cache read error: {e}")
+            return None
+        if row is None:
+            return None
+        value, created_at = row
+        with self._lock:
+            if now - created_at > self.ttl_seconds:
+                self._stats["expirations"] += 1
+                return None
+            self._store_in_memory(key, value, created_at)
+            self._stats["disk_hits"] += 1
+        return value
+
+    def _set_disk(self, key: str, value: str, created_at: float) -> None:
+        """ディスクに保存（ディスク用のスレッドで実行する）"""
+        try:
+            self._db.execute(
+                "INSERT OR REPLACE INTO responses (key, value, created_at) VALUES (?, ?, ?)",
+                (key, value, created_at),
+            )
+            self._db.commit()
+        except sqlite3.Error as e:
+            print(f"Disk cache write error: {e}")
+
+    def _clear_disk(self) -> None:
+        self._db.execute("DELETE FROM responses")
+        self._db.commit()
+
+    def _finish_get(self, key: str, value: Optional[str], now: float) -> Optional[str]:
+        """共有状態から引いた値をメモリに入れる（なければミスとして数える）"""
+        with self._lock:
+            if value is not None:
+                self._store_in_memory(key, value, now)
+                self._stats["shared_hits"] += 1
+                return value
+            self._stats["misses"] += 1
+            return None
+
+    def _shared_read_failed(self, error: StateBackendError) -> None:
+        self._stats["shared_errors"] += 1
+        print(f"Shared cache read error: {error}")
+
+    def set(self, key: str, value: str) -> None:
+        """値をキャッシュに保存（ディスクと共有状態への書き込みは待たない）"""
+        now = time.time()
+        with self._lock:
+            self._store_in_memory(key, value, now)
+        if self._db is not None:
+            self._disk().submit(self._set_disk, key, value, now)
+        if self.shared is not None:
+            # 共有状態への書き込みは待たない（失敗は共有状態の保存先で数える）
+            self.shared.submit(self.shared.set, f"cache:{key}", value, self.ttl_seconds)
+
+    def _store_in_memory(self, key: str, value: str, created_at: float) -> None:
+        """メモリ側に保存し、上限を超えた分を古い順に追い出す（ロック取得済みで呼ぶ）"""
+        self._entries[key] = (value, created_at)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self._stats["evictions"] += 1
+
+    def clear(self) -> None:
+        """キャッシュを全て削除（共有状態に保存した分は TTL で消える）"""
+        with self._lock:
+            self._entries.clear()
+        if self._db is not None:
+            self._disk().submit(self._clear_disk).result()
+
+    def flush(self) -> None:
+        """書き込み待ちの値をディスクに保存し終えるまで待つ"""
+        if self._db is not None:
+            self._disk().submit(lambda: None).result()
+
+    def get_stats(self) -> Dict[str, Any]:
+        """ヒット・ミス・追い出しの統計を取得"""
+        with self._lock:
+            stats: Dict[str, Any] = dict(self._stats)
+            stats["size"] = len(self._entries)
+            stats["max_entries"] = self.max_entries
+            stats["disk_enabled"] = self._db is not None
+            stats["shared_backend"] = self.shared.name if self.shared is not None else None
+        hits = stats["hits"] + stats["disk_hits"] + stats["shared_hits"]
+        lookups = hits + stats["misses"]
+        stats["hit_rate"] = hits / lookups if lookups else 0.0
+        return stats
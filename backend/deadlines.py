@@ -0,0 +1,86 @@
+"""リクエストの締め切りとクライアント切断の検出モジュール
+
+エンドポイントごとの締め切りまでに終わらなかった処理や、クライアントが切断した
+リクエストの処理は、イベントループ上のタスクごとキャンセルする。キャンセルは
+プロバイダー呼び出しまで伝わり、SDK の HTTP 接続が閉じられるため、上流での生成も止まる。
+"""
+
+import asyncio
+import contextvars
+import select
+import socket
+import time
+from typing import Any, Awaitable, Callable, Optional
+
+# 処理中のリクエストの締め切り（time.monotonic() の値）
+current_deadline: contextvars.ContextVar = contextvars.ContextVar("current_deadline", default=None)
+
+
+class RequestAbortedError(Exception):
+    """リクエストの処理を途中で打ち切った場合の例外"""
+
+    code = "aborted"
+
+
+class DeadlineExceededError(RequestAbortedError):
+    """締め切りまでに処理が終わらなかった場合の例外"""
+
+    code = "deadline_exceeded"
+
+
+class ClientDisconnectedError(RequestAbortedError):
+    """処理中にクライアントが切断した場合の例外"""
+
+    code = "client_disconnected"
+
+
+def remaining_time() -> Optional[float]:
+    """締め切りまでの残り秒数（締め切りがなければ None）"""
+    deadline = current_deadline.get()
+    if deadline is None:
+        return None
+    return deadline - time.monotonic()
+
+
+async def with_deadline(awaitable: Awaitable[Any], seconds: Optional[float]) -> Any:
+    """seconds 秒以内に終わらなければキャンセルして DeadlineExceededError を送出
+
+    締め切りは current_deadline に設定し、呼び出し先（再試行の待ちなど）からも参照できる。
+    seconds が 0 または None の場合は締め切りを設けない。
+    """
+    if not seconds:
+        return await awaitable
+    deadline = time.monotonic() + seconds
+    current_deadline.set(deadline)
+    try:
+        return await asyncio.wait_for(awaitable, seconds)
+    except asyncio.TimeoutError:
+        # 呼び出し先が送出した TimeoutError はそのまま伝える
+        if time.monotonic() < deadline:
+            raise
+        raise DeadlineExceededError(f"not finished within {seconds}s") from None
+
+
+def disconnect_checker(environ: dict) -> Optional[Callable[[], bool]]:
+    """WSGI 環境からクライアントの切断を調べる関数を作る（調べられなければ None）
+
+    gunicorn と Werkzeug の開発サーバーはクライアントのソケットを環境に入れている。
+    ソケットが読み込み可能で、読むと 0 バイト（相手が閉じた）なら切断とみなす。
+    """
+    sock = environ.get("gunicorn.socket") or environ.get("werkzeug.socket")
+    if sock is None:
+        return None
+
+    def is_disconnected() -> bool:
+        try:
+            readable, _, _ = select.select([sock], [], [], 0)
+            if not readable:
+                return False
+            return sock.recv(1, socket.MSG_PEEK) == b""
+        except ValueError:
+            # TLS ソケットは MSG_PEEK に対応していないため判定しない
+            return False
+        except OSError:
+            return True
+
+    return is_disconnected
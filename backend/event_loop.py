@@ -0,0 +1,143 @@
+"""バックグラウンドイベントループモジュール"""
+
+import asyncio
+import atexit
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+from typing import Any, AsyncIterator, Callable, Coroutine, Iterator, Optional
+
+from .deadlines import ClientDisconnectedError, with_deadline
+
+
+class BackgroundLoop:
+    """プロセス内で共有する常駐イベントループを管理するクラス
+
+    Flask のリクエストスレッドからコルーチンを投入し、すべての非同期 API 呼び出しを
+    1つの長寿命ループ上で実行する。これにより非同期クライアントのコネクションプールを
+    リクエスト間で共有できる。
+    """
+
+    def __init__(self):
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._thread: Optional[threading.Thread] = None
+        self._pid: Optional[int] = None
+        self._lock = threading.Lock()
+
+    @property
+    def loop(self) -> asyncio.AbstractEventLoop:
+        """実行中のイベントループを取得（未起動なら起動する）"""
+        # fork 後の子プロセスではループスレッドが存在しないため作り直す
+        if self._loop is None or self._pid != os.getpid():
+            self.start()
+        return self._loop
+
+    def start(self) -> None:
+        """ループスレッドを起動"""
+        with self._lock:
+            if self._loop is not None and self._pid == os.getpid():
+                return
+
+            loop = asyncio.new_event_loop()
+            ready = threading.Event()
+
+            def run() -> None:
+                asyncio.set_event_loop(loop)
+                loop.call_soon(ready.set)
+                loop.run_forever()
+
+            thread = threading.Thread(target=run, name="ai-event-loop", daemon=True)
+            thread.start()
+            ready.wait()
+
+            self._loop = loop
+            self._thread = thread
+            self._pid = os.getpid()
+
+    def submit(self, coro: Coroutine) -> Future:
+        """コルーチンをループに投入し、スレッドセーフな Future を返す"""
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+
+    def run(self, coro: Coroutine, timeout: Optional[float] = None,
+            disconnected: Optional[Callable[[], bool]] = None, poll_interval: float = 0.25) -> Any:
+        """コルーチンをループ上で実行し、結果を待って返す
+
+        timeout 秒以内に終わらない場合や、待っている間に disconnected() が True を返した
+        場合（クライアント切断）は、ループ上の処理をキャンセルする。
+        """
+        future = self.submit(coro)
+        try:
+            if disconnected is None:
+                return future.result(timeout)
+            deadline = None if timeout is None else time.monotonic() + timeout
+            while True:
+                wait = poll_interval if deadline is None else min(poll_interval, deadline - time.monotonic())
+                try:
+                    return future.result(max(wait, 0))
+                except FutureTimeoutError:
+                    if deadline is not None and time.monotonic() >= deadline:
+                        raise
+                    if disconnected():
+                        raise ClientDisconnectedError("client disconnected") from None
+        finally:
+            future.cancel()
+
+    def iterate(self, agen: AsyncIterator, deadline: Optional[float] = None,
+                disconnected: Optional[Callable[[], bool]] = None,
+                poll_interval: float = 0.25) -> Iterator:
+        """非同期イテレーターをループ上で回し、同期イテレーターとして要素を返す
+
+        呼び出し側が途中でイテレーションをやめた場合や、次の要素を待っている間に
+        disconnected() が True を返した場合（クライアント切断）は、ループ上の処理を
+        キャンセルする。deadline 秒で終わらない場合は DeadlineExceededError を送出する。
+        """
+        items: queue.Queue = queue.Queue()
+        future = self.submit(self._pump(agen, items, deadline))
+        try:
+            while True:
+                try:
+                    kind, value = items.get(timeout=poll_interval if disconnected else None)
+                except queue.Empty:
+                    if disconnected():
+                        raise ClientDisconnectedError("client disconnected") from None
+                    continue
+                if kind == "item":
+                    yield value
+                elif kind == "error":
+                    raise value
+                else:
+                    return
+        finally:
+            future.cancel()
+
+    @staticmethod
+    async def _pump(agen: AsyncIterator, items: queue.Queue, deadline: Optional[float] = None) -> None:
+        """非同期イテレーターの要素をキューに流し込む（deadline 秒で打ち切る）"""
+        async def drain() -> None:
+            async for item in agen:
+                items.put(("item", item))
+
+        try:
+            await with_deadline(drain(), deadline)
+        except Exception as e:
+            items.put(("error", e))
+        else:
+            items.put(("end", None))
+
+    def stop(self) -> None:
+        """ループを停止"""
+        with self._lock:
+            if self._loop is None or self._pid != os.getpid():
+                return
+            self._loop.call_soon_threadsafe(self._loop.stop)
+            if self._thread is not None:
+                self._thread.join(timeout=5)
+            self._loop = None
+            self._thread = None
+
+
+# グローバルインスタンス
+background_loop = BackgroundLoop()
+atexit.register(background_loop.stop)
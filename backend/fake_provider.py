@@ -0,0 +1,304 @@
+"""負荷試験用の疑似プロバイダーと、プロバイダー呼び出しの記録・再生モジュール
+
+実 API を呼ばずに負荷試験やプロファイリングを行うためのアダプター。どれも AnthropicProvider /
+AzureOpenAIProvider と同じインターフェース（create / stream / aclose）を持つ。
+
+- FakeProvider: 初回トークンまでの時間と出力トークン数を分布から引き、一定のトークンレートで
+  回答を生成する。エラーと 429（retry-after 付き）を指定した割合で発生させる
+- RecordingProvider: 実際のプロバイダーをラップし、やり取り（入力・回答・トークン数・
+  チャンクごとの時刻）を JSONL に追記する
+- ReplayProvider: 記録した JSONL から、同じ入力の回答を同じ順番・同じ時間間隔で返す
+
+config.json の fake_provider / recording で選ぶ（providers.create_providers を参照）。
+"""
+
+import asyncio
+import hashlib
+import json
+import random
+import re
+import threading
+import time
+from collections import deque
+from pathlib import Path
+from typing import Any, AsyncIterator, Dict, List, Mapping, Optional, Tuple, Union
+
+from .history import estimate_tokens
+from .providers import Completion, SystemPrompt
+
+# 疑似的な回答に使う単語（1単語を1トークンとして数える）
+_WORDS = (
+    "that sounds great what did you do last weekend I think it is a good idea to practice "
+    "English every day do you like travelling my favourite place is the beach near my hometown"
+).split()
+_BATCH_PATTERN = re.compile(r"JSON array of (\d+) strings")
+
+
+class FakeProviderError(Exception):
+    """疑似プロバイダーが発生させるエラー（SDK の例外と同じく status_code と response を持つ）"""
+
+    def __init__(self, status_code: int, message: str, retry_after: Optional[float] = None):
+        super().__init__(message)
+        self.status_code = status_code
+        headers = {"retry-after": str(retry_after)} if retry_after is not None else {}
+        self.response = type("FakeResponse", (), {"headers": headers})()
+
+
+class ReplayMissError(LookupError):
+    """再生する記録に同じ入力のやり取りがない"""
+
+
+def _absolute(path: str) -> Path:
+    """相対パスはプロジェクトのルートからのパスとして扱う"""
+    resolved = Path(path)
+    if not resolved.is_absolute():
+        resolved = Path(__file__).resolve().parent.parent / resolved
+    return resolved
+
+
+def exchange_key(system: SystemPrompt, messages: List[Dict], stop: Optional[List[str]] = None) -> str:
+    """やり取りの入力のキー（max_tokens は出力予算で毎回変わるため含めない）"""
+    digest = hashlib.sha256()
+    digest.update(str(system or "").encode("utf-8"))
+    digest.update(b"\0")
+    digest.update(json.dumps(messages, ensure_ascii=False, sort_keys=True).encode("utf-8"))
+    digest.update(b"\0")
+    digest.update(json.dumps(list(stop or [])).encode("utf-8"))
+    return digest.hexdigest()
+
+
+def _sample(rng: random.Random, spec: Union[float, Mapping[str, Any]]) -> float:
+    """分布の指定から値を1つ引く
+
+    数値ならその値、{"distribution": "fixed" | "uniform" | "lognormal", ...} なら
+    fixed は value、uniform は low〜high、lognormal は median と sigma から引く。
+    """
+    if not isinstance(spec, Mapping):
+        return float(spec)
+    distribution = spec.get("distribution", "lognormal")
+    if distribution == "fixed":
+        return float(spec.get("value", 0))
+    if distribution == "uniform":
+        return rng.uniform(spec.get("low", 0), spec.get("high", 0))
+    return spec.get("median", 0) * rng.lognormvariate(0, spec.get("sigma", 0.0))
+
+
+class FakeProvider:
+    """分布に従った遅延と長さで回答する疑似プロバイダー"""
+
+    name = "fake"
+
+    def __init__(self, config: Optional[Mapping[str, Any]] = None):
+        self.config = config or {}
+        self.ttft_ms = self.config.get("ttft_ms", {"distribution": "lognormal", "median": 400, "sigma": 0.35})
+        self.output_tokens = self.config.get("output_tokens",
+                                             {"distribution": "lognormal", "median": 60, "sigma": 0.5})
+        self.tokens_per_second = self.config.get("tokens_per_second", 50)
+        self.error_rate = self.config.get("error_rate", 0.0)
+        self.rate_limit_rate = self.config.get("rate_limit_rate", 0.0)
+        self.retry_after_seconds = self.config.get("retry_after_seconds", 1)
+        self._rng = random.Random(self.config.get("seed"))
+        self._rng_lock = threading.Lock()
+
+    @property
+    def credentials(self) -> tuple:
+        """設定が変わったらアダプターを作り直す"""
+        return (self.config,)
+
+    @property
+    def model(self) -> str:
+        return "fake"
+
+    def _plan(self, system: SystemPrompt, messages: List[Dict],
+              max_tokens: int) -> Tuple[float, List[str], Completion]:
+        """(初回トークンまでの秒数, 出力するチャンク, 使用量と stop_reason を持つ Completion) を決める
+
+        エラーを発生させる呼び出しでは FakeProviderError を送出する。
+        """
+        with self._rng_lock:
+            roll = self._rng.random()
+            ttft = max(_sample(self._rng, self.ttft_ms), 0.0) / 1000
+            length = max(int(_sample(self._rng, self.output_tokens)), 1)
+            words = [self._rng.choice(_WORDS) for _ in range(min(length, max_tokens))]
+        if roll < self.rate_limit_rate:
+            raise FakeProviderError(429, "Injected rate limit", retry_after=self.retry_after_seconds)
+        if roll < self.rate_limit_rate + self.error_rate:
+            raise FakeProviderError(500, "Injected server error")
+
+        prompt = "\n".join(str(message.get("content", "")) for message in messages)
+        batch = _BATCH_PATTERN.search(prompt)
+        input_tokens = estimate_tokens(str(system or "")) + estimate_tokens(prompt)
+        if batch:
+            # 一括翻訳には要求された件数の JSON 配列で答える（切らずに全件返す）
+            count = int(batch.group(1))
+            chunks = [json.dumps([" ".join(words) for _ in range(count)], ensure_ascii=False)]
+            return ttft, chunks, Completion(chunks[0], input_tokens, len(words) * count, "end_turn")
+        chunks = [word if i == 0 else " " + word for i, word in enumerate(words)]
+        stop_reason = "max_tokens" if length > max_tokens else "end_turn"
+        return ttft, chunks, Completion("".join(chunks), input_tokens, len(words), stop_reason)
+
+    async def create(self, system: SystemPrompt, messages: List[Dict], max_tokens: int,
+                     stop: Optional[List[str]] = None, **options) -> Completion:
+        """回答を一括で取得（生成にかかる時間だけ待ってから返す）"""
+        ttft, _, completion = self._plan(system, messages, max_tokens)
+        await asyncio.sleep(ttft + completion.output_tokens / self.tokens_per_second)
+        return completion
+
+    async def stream(self, system: SystemPrompt, messages: List[Dict], max_tokens: int,
+                     stop: Optional[List[str]] = None, **options) -> AsyncIterator[Union[str, Completion]]:
+        """回答をトークンレートに合わせて1トークンずつ返す（最後に Completion を1つ返す）"""
+        ttft, chunks, completion = self._plan(system, messages, max_tokens)
+        await asyncio.sleep(ttft)
+        interval = completion.output_tokens / len(chunks) / self.tokens_per_second
+        for i, chunk in enumerate(chunks):
+            if i:
+                await asyncio.sleep(interval)
+            yield chunk
+        yield completion
+
+    async def aclose(self) -> None:
+        pass
+
+
+class RecordingProvider:
+    """実際のプロバイダーのやり取りを JSONL に記録するラッパー
+
+    1行に1回の呼び出し（入力のキー、入力、回答、トークン数、stop_reason、開始からの
+    経過時間つきのチャンク）を書く。エラーになった呼び出しは記録しない。
+    """
+
+    def __init__(self, provider_class: type, credentials: tuple, path: str):
+        self.inner = provider_class(*credentials)
+        self.name = self.inner.name
+        self.path = _absolute(path)
+        self._credentials = (provider_class, credentials, path)
+        self._lock = threading.Lock()
+
+    @property
+    def credentials(self) -> tuple:
+        return self._credentials
+
+    @property
+    def model(self) -> str:
+        return self.inner.model
+
+    def _append(self, system: SystemPrompt, messages: List[Dict], stop: Optional[List[str]],
+                completion: Completion, chunks: List[Tuple[float, str]]) -> None:
+        entry = {
+            "provider": self.name,
+            "key": exchange_key(system, messages, stop),
+            "system": str(system or ""),
+            "messages": messages,
+            "text": completion.text,
+            "input_tokens": completion.input_tokens,
+            "output_tokens": completion.output_tokens,
+            "stop_reason": completion.stop_reason,
+            "chunks": [[round(offset, 4), text] for offset, text in chunks],
+            "recorded_at": time.time(),
+        }
+        try:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            with self._lock, open(self.path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+        except OSError as e:
+            print(f"Error recording provider exchange: {e}")
+
+    async def create(self, system: SystemPrompt, messages: List[Dict], max_tokens: int,
+                     stop: Optional[List[str]] = None, **options) -> Completion:
+        start = time.perf_counter()
+        completion = await self.inner.create(system, messages, max_tokens, stop=stop, **options)
+        self._append(system, messages, stop, completion, [(time.perf_counter() - start, completion.text)])
+        return completion
+
+    async def stream(self, system: SystemPrompt, messages: List[Dict], max_tokens: int,
+                     stop: Optional[List[str]] = None, **options) -> AsyncIterator[Union[str, Completion]]:
+        start = time.perf_counter()
+        chunks = []
+        async for chunk in self.inner.stream(system, messages, max_tokens, stop=stop, **options):
+            if isinstance(chunk, Completion):
+                self._append(system, messages, stop, chunk, chunks)
+            else:
+                chunks.append((time.perf_counter() - start, chunk))
+            yield chunk
+
+    async def aclose(self) -> None:
+        await self.inner.aclose()
+
+
+class ReplayProvider:
+    """記録した JSONL のやり取りを再生するプロバイダー
+
+    同じ入力のやり取りが複数ある場合は、記録した順に1つずつ返す（最後まで使ったら先頭に戻る）。
+    replay_timing が true なら、記録したチャンクの時刻に合わせて返す。
+    記録にない入力は ReplayMissError になる。
+    """
+
+    def __init__(self, name: str, path: str, replay_timing: bool = True):
+        self.name = name
+        self.path = path
+        self.replay_timing = replay_timing
+        self._exchanges: Dict[str, deque] = {}
+        self._lock = threading.Lock()
+        self.misses = 0
+        for entry in load_recording(path):
+            if entry.get("provider") == name:
+                self._exchanges.setdefault(entry["key"], deque()).append(entry)
+
+    @property
+    def credentials(self) -> tuple:
+        return (self.name, self.path, self.replay_timing)
+
+    @property
+    def model(self) -> str:
+        return "replay"
+
+    def _next(self, system: SystemPrompt, messages: List[Dict], stop: Optional[List[str]]) -> Dict[str, Any]:
+        key = exchange_key(system, messages, stop)
+        with self._lock:
+            entries = self._exchanges.get(key)
+            if not entries:
+                self.misses += 1
+                raise ReplayMissError(f"No recorded {self.name} exchange for this input")
+            entry = entries[0]
+            entries.rotate(-1)
+        return entry
+
+    @staticmethod
+    def _completion(entry: Dict[str, Any]) -> Completion:
+        return Completion(entry["text"], entry.get("input_tokens", 0), entry.get("output_tokens", 0),
+                          entry.get("stop_reason"))
+
+    async def create(self, system: SystemPrompt, messages: List[Dict], max_tokens: int,
+                     stop: Optional[List[str]] = None, **options) -> Completion:
+        entry = self._next(system, messages, stop)
+        if self.replay_timing and entry.get("chunks"):
+            await asyncio.sleep(entry["chunks"][-1][0])
+        return self._completion(entry)
+
+    async def stream(self, system: SystemPrompt, messages: List[Dict], max_tokens: int,
+                     stop: Optional[List[str]] = None, **options) -> AsyncIterator[Union[str, Completion]]:
+        entry = self._next(system, messages, stop)
+        start = time.perf_counter()
+        for offset, text in entry.get("chunks") or [[0.0, entry["text"]]]:
+            if self.replay_timing:
+                delay = offset - (time.perf_counter() - start)
+                if delay > 0:
+                    await asyncio.sleep(delay)
+            yield text
+        yield self._completion(entry)
+
+    async def aclose(self) -> None:
+        pass
+
+
+def load_recording(path: str) -> List[Dict[str, Any]]:
+    """記録した JSONL を読み込む（ファイルがなければ空）"""
+    entries = []
+    try:
+        with open(_absolute(path), "r", encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    entries.append(json.loads(line))
+    except OSError as e:
+        print(f"Error loading provider recording: {e}")
+    return entries
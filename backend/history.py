@@ -0,0 +1,55 @@
+"""会話履歴ウィンドウ管理モジュール"""
+
+import unicodedata
+from typing import Dict, List, Tuple
+
+# メッセージ1件ごとにかかる役割・区切りのオーバーヘッド（トークン）
+MESSAGE_OVERHEAD_TOKENS = 4
+
+
+def estimate_tokens(text: str) -> int:
+    """テキストのトークン数を概算
+
+    プロバイダーごとのトークナイザーには依存せず、英数字などは約4文字で1トークン、
+    日本語などの全角文字は1文字で約1トークンとして数える。
+    """
+    wide = 0
+    narrow = 0
+    for char in text:
+        if unicodedata.east_asian_width(char) in ("W", "F"):
+            wide += 1
+        else:
+            narrow += 1
+    return wide + (narrow + 3) // 4
+
+
+class HistoryManager:
+    """入力トークン予算に収まるよう直近の会話履歴を切り出すクラス"""
+
+    def __init__(self, min_recent_messages: int = 2):
+        self.min_recent_messages = min_recent_messages
+
+    def message_tokens(self, message: Dict) -> int:
+        """メッセージ1件のトークン数を概算"""
+        return estimate_tokens(message["content"]) + MESSAGE_OVERHEAD_TOKENS
+
+    def pack(self, history: List[Dict], budget: int) -> Tuple[List[Dict], int]:
+        """予算内に収まる直近の履歴を切り出す
+
+        新しいものから順に詰め、(ウィンドウ, ウィンドウ先頭の history 上のインデックス) を返す。
+        予算に関係なく直近 min_recent_messages 件は残す。ウィンドウは必ず
+        学生（user）の発言から始まるようにする。
+        """
+        used = 0
+        start = len(history)
+        for index in range(len(history) - 1, -1, -1):
+            cost = self.message_tokens(history[index])
+            kept = len(history) - index - 1
+            if used + cost > budget and kept >= self.min_recent_messages:
+                break
+            used += cost
+            start = index
+
+        while start < len(history) and history[start]["role"] != "user":
+            start += 1
+        return history[start:], start
@@ -0,0 +1,318 @@
+"""外部 API 呼び出しの流量制御モジュール"""
+
+import asyncio
+import email.utils
+import random
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Hashable, Optional
+
+from .scheduler import PriorityGate, TurnTracker
+from .shared_state import StateBackend, StateBackendError
+from .telemetry import record_queue_wait
+
+# 再試行してよい HTTP ステータス（429 はレート制限、529 は Anthropic の過負荷）
+RETRYABLE_STATUS_CODES = {408, 409, 429, 500, 502, 503, 504, 529}
+# 接続エラー・タイムアウトの例外クラス名（どちらの SDK も同じ名前。SDK を import しないよう名前で判定する）
+CONNECTION_ERROR_NAMES = {"APIConnectionError", "APITimeoutError"}
+
+
+class LimiterBusyError(Exception):
+    """待ち行列が上限に達した、または待ち時間が上限を超えた場合の例外"""
+
+
+def _percentile(samples, pct: float) -> float:
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+
+def get_status_code(error: BaseException) -> Optional[int]:
+    """SDK の例外から HTTP ステータスを取得"""
+    return getattr(error, "status_code", None)
+
+
+def get_retry_after(error: BaseException) -> Optional[float]:
+    """SDK の例外のレスポンスヘッダーから retry-after（秒）を取得"""
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None)
+    if not headers:
+        return None
+
+    retry_after_ms = headers.get("retry-after-ms")
+    if retry_after_ms:
+        try:
+            return float(retry_after_ms) / 1000
+        except ValueError:
+            pass
+
+    retry_after = headers.get("retry-after")
+    if not retry_after:
+        return None
+    try:
+        return float(retry_after)
+    except ValueError:
+        pass
+    retry_date = email.utils.parsedate_to_datetime(retry_after)
+    if retry_date is None:
+        return None
+    return max(retry_date.timestamp() - time.time(), 0.0)
+
+
+class RetryPolicy:
+    """一時的なエラーを、ジッター付き指数バックオフで再試行する方針
+
+    レスポンスに retry-after があればその値を優先する。ただし max_retry_after を
+    超える待ちを要求された場合は再試行せず、別のプロバイダーへの切り替えに任せる。
+    """
+
+    def __init__(self, config: Optional[Dict[str, Any]] = None):
+        config = config or {}
+        self.max_retries = config.get("max_retries", 2)
+        self.base_delay = config.get("base_delay_ms", 500) / 1000
+        self.max_delay = config.get("max_delay_ms", 8000) / 1000
+        self.max_retry_after = config.get("max_retry_after_seconds", 20)
+
+    def is_retryable(self, error: BaseException) -> bool:
+        """再試行で回復する見込みのあるエラーかどうか"""
+        if any(cls.__name__ in CONNECTION_ERROR_NAMES for cls in type(error).__mro__):
+            return True
+        return get_status_code(error) in RETRYABLE_STATUS_CODES
+
+    def get_delay(self, error: BaseException, attempt: int) -> Optional[float]:
+        """attempt 回目（0 始まり）の失敗後に待つ秒数。再試行しない場合は None"""
+        if attempt >= self.max_retries or not self.is_retryable(error):
+            return None
+        retry_after = get_retry_after(error)
+        if retry_after is not None:
+            if retry_after > self.max_retry_after:
+                return None
+            return retry_after
+        # フルジッター: 0 〜 base * 2^attempt の一様乱数
+        return random.uniform(0, min(self.max_delay, self.base_delay * (2 ** attempt)))
+
+
+class ProviderLimiter:
+    """1つのプロバイダーへの同時実行数と呼び出しレートを制限するクラス
+
+    同時実行数は優先度クラスごとの待ち行列を持つ PriorityGate で、レートはトークンバケット
+    （requests_per_minute を上限に burst 回までまとめて許可）で制限する。429 の retry-after を
+    受けた場合は pause() でその時刻まで新しい呼び出しを止める。
+    待ち行列の長さと待ち時間は統計として記録する。
+
+    shared（ワーカー間の共有状態）を指定した場合、レートは全ワーカーの合計で数える。
+    burst / レート 秒の固定窓ごとに共有のカウンターを加算し、burst 回を超えたら次の窓まで
+    待つ。pause() も共有状態に書き、他のワーカーの呼び出しも止める。同時実行数は
+    ワーカーごとのまま。共有状態に読み書きできない場合（応答が遅い場合を含む）は
+    このワーカーのバケットで続ける。
+    """
+
+    def __init__(self, config: Optional[Dict[str, Any]] = None, max_queue: int = 1000,
+                 queue_timeout: float = 30, window_size: int = 1000, name: str = "",
+                 class_config: Optional[Dict[str, Any]] = None, turns: Optional[TurnTracker] = None,
+                 shared: Optional[StateBackend] = None):
+        config = config or {}
+        self.name = name
+        self.shared = shared
+        self.max_concurrency = config.get("max_concurrency", 64)
+        self.rate = config.get("requests_per_minute", 0) / 60
+        self.burst = max(config.get("burst", 5), 1)
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.tokens = float(self.burst)
+        self.paused_until = 0.0
+        self._refilled_at = time.monotonic()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        # interactive クラスの待ち時間の上限は、指定がなければ queue_timeout にする
+        class_config = {priority: dict(value) for priority, value in (class_config or {}).items()}
+        class_config.setdefault("interactive", {}).setdefault("max_wait_seconds", queue_timeout)
+        self.gate = PriorityGate(self.max_concurrency, class_config, turns)
+        self._bucket_lock: Optional[asyncio.Lock] = None
+
+        self.in_flight = 0
+        self.queued = 0
+        self.max_queued = 0
+        self.wait_times: deque = deque(maxlen=window_size)
+        self.counters = {"acquired": 0, "rejected": 0, "timeouts": 0, "retries": 0, "rate_limited": 0,
+                         "shared_errors": 0}
+
+    def _bind(self) -> None:
+        """実行中のイベントループ用の同期プリミティブを用意（フォーク後は作り直す）"""
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            self._loop = loop
+            self.gate.reset()
+            self._bucket_lock = asyncio.Lock()
+            self.in_flight = 0
+            self.queued = 0
+
+    def pause(self, seconds: float) -> None:
+        """指定秒数、新しい呼び出しを止める（retry-after を受けた場合）"""
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+        if self.shared is not None and seconds > 0:
+            # ワーカー間ではモノトニック時刻を比べられないため、壁時計の時刻で共有する（書き込みは待たない）
+            self.shared.submit(self.shared.set, f"pause:{self.name}", str(time.time() + seconds), seconds)
+
+    async def _sync_pause(self) -> None:
+        """他のワーカーが pause() した時刻を取り込む"""
+        try:
+            value = await self.shared.arun(self.shared.get, f"pause:{self.name}")
+        except StateBackendError as e:
+            self.counters["shared_errors"] += 1
+            print(f"Shared limiter pause error ({self.name}): {e}")
+            return
+        if value is not None:
+            remaining = float(value) - time.time()
+            self.paused_until = max(self.paused_until, time.monotonic() + remaining)
+
+    async def _take_shared_token(self) -> bool:
+        """全ワーカー共有の固定窓から1つ取り出す（共有状態を使えなければ False）"""
+        window = self.burst / self.rate
+        while True:
+            now = time.time()
+            index = int(now // window)
+            try:
+                count = await self.shared.arun(self.shared.incr, f"rate:{self.name}:{index}", 1, window * 2)
+            except StateBackendError as e:
+                self.counters["shared_errors"] += 1
+                print(f"Shared limiter rate error ({self.name}): {e}")
+                return False
+            if count <= self.burst:
+                return True
+            await asyncio.sleep((index + 1) * window - now)
+
+    async def _take_token(self) -> None:
+        """トークンバケットから1つ取り出す（足りなければ補充まで待つ）"""
+        async with self._bucket_lock:
+            if self.shared is not None:
+                await self._sync_pause()
+            while True:
+                now = time.monotonic()
+                wait = self.paused_until - now
+                if wait <= 0:
+                    if not self.rate:
+                        return
+                    if self.shared is not None and await self._take_shared_token():
+                        return
+                    self.tokens = min(self.burst, self.tokens + (now - self._refilled_at) * self.rate)
+                    self._refilled_at = now
+                    if self.tokens >= 1:
+                        self.tokens -= 1
+                        return
+                    wait = (1 - self.tokens) / self.rate
+                await asyncio.sleep(wait)
+
+    async def enter(self, priority: str = "interactive") -> None:
+        """priority クラスの呼び出し枠を確保（確保できたら必ず同じクラスで exit() を呼ぶ）
+
+        クラスの待ち時間の上限を超えた場合は LimiterBusyError、新しいターンに
+        追い越された場合は SupersededError を送出する。
+        """
+        self._bind()
+        if self.queued >= self.max_queue:
+            self.counters["rejected"] += 1
+            raise LimiterBusyError(f"queue is full ({self.queued} waiting)")
+
+        start = time.perf_counter()
+        self.queued += 1
+        self.max_queued = max(self.max_queued, self.queued)
+        acquired = False
+        try:
+            await self.gate.acquire(priority)
+            acquired = True
+            await self._take_token()
+        except asyncio.TimeoutError:
+            self.counters["timeouts"] += 1
+            raise LimiterBusyError(
+                f"waited more than {self.gate.max_waits[priority]}s for a {priority} slot") from None
+        except BaseException:
+            if acquired:
+                self.gate.release(priority)
+            raise
+        finally:
+            self.queued -= 1
+        wait_time = time.perf_counter() - start
+        self.wait_times.append(wait_time)
+        record_queue_wait(self.name, priority, wait_time)
+        self.in_flight += 1
+        self.counters["acquired"] += 1
+
+    def exit(self, priority: str = "interactive") -> None:
+        """呼び出し枠を返却"""
+        self.in_flight -= 1
+        self.gate.release(priority)
+
+    @asynccontextmanager
+    async def acquire(self, priority: str = "interactive") -> AsyncIterator[None]:
+        """async with で呼び出し枠を確保する"""
+        await self.enter(priority)
+        try:
+            yield
+        finally:
+            self.exit(priority)
+
+    def to_dict(self) -> Dict[str, Any]:
+        """統計を辞書で取得"""
+        return {
+            "max_concurrency": self.max_concurrency,
+            "requests_per_minute": round(self.rate * 60, 1),
+            "in_flight": self.in_flight,
+            "queue_depth": self.queued,
+            "max_queue_depth": self.max_queued,
+            "wait_p50_ms": round(_percentile(self.wait_times, 50) * 1000, 1),
+            "wait_p95_ms": round(_percentile(self.wait_times, 95) * 1000, 1),
+            "paused": time.monotonic() < self.paused_until,
+            **self.counters,
+            "classes": self.gate.to_dict(),
+        }
+
+
+class RequestCoalescer:
+    """同じキーの呼び出しが実行中なら、新たに呼び出さずにその結果を共有するクラス
+
+    先に来た呼び出しの待ち手がキャンセルされても、他に待ち手がいれば共有している
+    呼び出し自体は最後まで実行する。待ち手が全員キャンセルされた場合は、結果を
+    使う人がいないため呼び出しも取り消す。
+    """
+
+    def __init__(self):
+        self._inflight: Dict[Hashable, asyncio.Future] = {}
+        self._waiters: Dict[asyncio.Future, int] = {}
+        self.counters = {"leaders": 0, "coalesced": 0, "cancelled": 0}
+
+    async def run(self, key: Hashable, factory: Callable[[], Awaitable[Any]]) -> Any:
+        """key の呼び出しを実行（実行中なら相乗り）"""
+        task = self._inflight.get(key)
+        if task is None or task.get_loop() is not asyncio.get_running_loop():
+            task = asyncio.ensure_future(factory())
+            self._inflight[key] = task
+            task.add_done_callback(lambda done: self._finish(key, done))
+            self.counters["leaders"] += 1
+        else:
+            self.counters["coalesced"] += 1
+
+        self._waiters[task] = self._waiters.get(task, 0) + 1
+        try:
+            return await asyncio.shield(task)
+        except asyncio.CancelledError:
+            if self._waiters[task] == 1 and not task.done():
+                task.cancel()
+                self.counters["cancelled"] += 1
+            raise
+        finally:
+            self._waiters[task] -= 1
+            if not self._waiters[task]:
+                del self._waiters[task]
+
+    def _finish(self, key: Hashable, task: asyncio.Future) -> None:
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+        # 待ち手が全員キャンセルされた場合に未取得の例外として警告されないようにする
+        if not task.cancelled():
+            task.exception()
+
+    def get_stats(self) -> Dict[str, int]:
+        """統計を取得"""
+        return {"in_flight": len(self._inflight), **self.counters}
@@ -0,0 +1,163 @@
+"""出力トークン予算モジュール
+
+生成時間は出力トークン数にほぼ比例するため、max_tokens が大きすぎると、話が長くなった
+回答の分だけ待ち時間が延びる。ここでは呼び出しの種類（operation）と英語レベルごとに
+実際の出力トークン数を記録し、その分布から次の呼び出しの max_tokens を決める。
+
+- チャットと和訳は入力（学習者の発言・原文）の長さに比例させる（出力 / 入力 の比を学習する）
+- フィードバックとヒントは入力の長さによらない（出力トークン数そのものを学習する）
+
+記録が min_samples 件に満たない間は設定の初期値を使う。予算は呼び出し元が渡す上限
+（従来の固定値）を超えない。stop_reason が max_tokens（Anthropic）/ length（Azure OpenAI）の
+回答は予算で切れたものとして数え、予算を広げる方向に学習する。切れた回答は、和訳は上限の
+予算で取り直し、それ以外は最後の文の区切りまでに切り詰める（文の途中で終わらないようにする）。
+"""
+
+import json
+import math
+import re
+import threading
+from collections import deque
+from typing import Any, Dict, List, Optional
+
+# 予算で切れたことを表す stop_reason（Anthropic / Azure OpenAI）
+TRUNCATION_STOP_REASONS = {"max_tokens", "length"}
+
+DEFAULT_ENDPOINT_CONFIG = {
+    "chat": {"scale_with_input": True, "ratio": 4.0, "base": 80, "min_tokens": 150,
+             "on_truncation": "trim", "stop_sequences": ["\nStudent:"]},
+    "translate": {"scale_with_input": True, "ratio": 3.0, "base": 40, "min_tokens": 80,
+                  "on_truncation": "retry", "stop_sequences": []},
+    "feedback": {"scale_with_input": False, "base": 400, "min_tokens": 250,
+                 "on_truncation": "trim", "stop_sequences": []},
+    "hint": {"scale_with_input": False, "base": 250, "min_tokens": 150,
+             "on_truncation": "trim", "stop_sequences": []},
+}
+
+# 切り詰めに使う文の区切り（英語・日本語の文末と改行）
+_SENTENCE_END_PATTERN = re.compile(r"[.!?](?=\s|$)|[。！？\n]")
+
+
+def is_truncated(completion: Any) -> bool:
+    """回答が max_tokens で切れたかどうか"""
+    return getattr(completion, "stop_reason", None) in TRUNCATION_STOP_REASONS
+
+
+def trim_to_sentence(text: str) -> str:
+    """最後の文の区切りまでに切り詰める（区切りがなければそのまま）"""
+    ends = [match.end() for match in _SENTENCE_END_PATTERN.finditer(text)]
+    if not ends:
+        return text
+    return text[:ends[-1]].rstrip()
+
+
+class OutputBudget:
+    """呼び出しの種類とレベルごとに出力トークン数を学習し、max_tokens を決めるクラス"""
+
+    def __init__(self, config: Optional[Dict[str, Any]] = None):
+        config = config or {}
+        self.percentile = config.get("percentile", 99)
+        self.headroom = config.get("headroom", 1.25)
+        self.min_samples = config.get("min_samples", 20)
+        self.window_size = config.get("window_size", 500)
+        self.record_path = config.get("record_path") or None
+        endpoints = config.get("endpoints", {})
+        self.endpoints = {
+            name: dict(DEFAULT_ENDPOINT_CONFIG.get(name, {}), **endpoints.get(name, {}))
+            for name in set(DEFAULT_ENDPOINT_CONFIG) | set(endpoints)
+        }
+        self._samples: Dict[tuple, deque] = {}
+        self._record_lock = threading.Lock()
+        self.counters: Dict[str, Dict[str, int]] = {
+            name: {"calls": 0, "truncated": 0, "retried": 0, "trimmed": 0} for name in self.endpoints
+        }
+
+    def handles(self, operation: str) -> bool:
+        """予算を調整する呼び出しの種類かどうか"""
+        return operation in self.endpoints
+
+    def stop_sequences(self, operation: str) -> List[str]:
+        """呼び出しの種類の停止文字列"""
+        return list(self.endpoints.get(operation, {}).get("stop_sequences", []))
+
+    def on_truncation(self, operation: str) -> str:
+        """予算で切れた回答の扱い（retry: 上限の予算で取り直す / trim: 文の区切りまで切り詰める）"""
+        return self.endpoints.get(operation, {}).get("on_truncation", "retry")
+
+    def _size(self, config: Dict[str, Any], input_tokens: int, output_tokens: float) -> float:
+        """学習する値（入力に比例させる場合は 出力 / 入力 の比）"""
+        if config.get("scale_with_input"):
+            return output_tokens / max(input_tokens, 1)
+        return output_tokens
+
+    def max_tokens(self, operation: str, level: str, input_tokens: int, ceiling: int) -> int:
+        """次の呼び出しの max_tokens（ceiling を超えない）"""
+        config = self.endpoints.get(operation)
+        if config is None:
+            return ceiling
+        samples = self._samples.get((operation, level))
+        if samples is not None and len(samples) >= self.min_samples:
+            ordered = sorted(samples)
+            size = ordered[min(len(ordered) - 1, int(math.ceil(self.percentile / 100 * len(ordered))) - 1)]
+            predicted = size * max(input_tokens, 1) if config.get("scale_with_input") else size
+            budget = math.ceil(predicted * self.headroom)
+        elif config.get("scale_with_input"):
+            budget = config.get("base", 0) + math.ceil(config.get("ratio", 1.0) * input_tokens)
+        else:
+            budget = config.get("base", ceiling)
+        return max(min(budget, ceiling), min(config.get("min_tokens", 0), ceiling))
+
+    def record(self, operation: str, level: str, input_tokens: int, completion: Any, max_tokens: int,
+               provider: str = "") -> bool:
+        """実際の出力トークン数を記録し、予算で切れたかどうかを返す
+
+        切れた回答の本当の長さは分からないため、予算の2倍の長さだったものとして学習する。
+        """
+        config = self.endpoints.get(operation)
+        if config is None:
+            return False
+        truncated = is_truncated(completion)
+        output_tokens = getattr(completion, "output_tokens", 0)
+        counters = self.counters[operation]
+        counters["calls"] += 1
+        if truncated:
+            counters["truncated"] += 1
+        if output_tokens:
+            observed = max_tokens * 2 if truncated else output_tokens
+            samples = self._samples.get((operation, level))
+            if samples is None:
+                samples = self._samples[(operation, level)] = deque(maxlen=self.window_size)
+            samples.append(self._size(config, input_tokens, observed))
+        if self.record_path:
+            self._append_record({
+                "operation": operation,
+                "level": level,
+                "provider": provider,
+                "input_tokens": input_tokens,
+                "output_tokens": output_tokens,
+                "max_tokens": max_tokens,
+                "stop_reason": getattr(completion, "stop_reason", None),
+            })
+        return truncated
+
+    def _append_record(self, entry: Dict[str, Any]) -> None:
+        """ベンチマーク用のコーパスに1行追記"""
+        try:
+            with self._record_lock, open(self.record_path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+        except OSError as e:
+            print(f"Error recording output length: {e}")
+
+    def get_stats(self) -> Dict[str, Any]:
+        """呼び出しの種類ごとの切れた回数と、レベルごとの学習の状況を取得"""
+        stats: Dict[str, Any] = {}
+        for operation, counters in self.counters.items():
+            levels = {}
+            for (name, level), samples in list(self._samples.items()):
+                if name == operation:
+                    levels[level or "-"] = {
+                        "samples": len(samples),
+                        "learned": len(samples) >= self.min_samples,
+                    }
+            stats[operation] = {**counters, "levels": levels}
+        return stats
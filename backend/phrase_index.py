@@ -0,0 +1,223 @@
+"""ヒント用フレーズ索引モジュール
+
+「お腹が空いた」「〜が不安だ」のようによく聞かれる表現は、英語レベル（400/600/800）
+ごとに決まったヒントを返せばよいため、LLM を呼ばずに索引から返す。
+入力は正規化（NFKC・小文字化・空白と記号の除去）してから、完全一致、文字 bigram の
+Dice 係数による近似一致の順に引く。索引はメモリ上に持ち、1回の検索は数十マイクロ秒以内で終わる。
+db_path を指定した場合は SQLite に保存し、LLM から得たヒントの書き戻しも再起動後に残る。
+SQLite への書き込みは専用スレッドで行い、呼び出し元（イベントループ）は待たない。
+"""
+
+import concurrent.futures
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+from collections import deque
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+from .limiter import _percentile
+from .telemetry import record_hint_lookup
+
+# 正規化で取り除く文字（文字・数字以外の句読点・記号・空白）
+_NON_WORD_PATTERN = re.compile(r"[\W_]+")
+
+
+def normalize(text: str) -> str:
+    """照合用に入力を正規化（全角・半角の統一、小文字化、空白と記号の除去）"""
+    return _NON_WORD_PATTERN.sub("", unicodedata.normalize("NFKC", text).lower())
+
+
+def bigrams(key: str) -> Set[str]:
+    """文字 bigram の集合（1文字の場合はその文字だけ）"""
+    if len(key) < 2:
+        return {key} if key else set()
+    return {key[i:i + 2] for i in range(len(key) - 1)}
+
+
+class _LevelIndex:
+    """1つの英語レベルの索引（正規化したキー → ヒント と bigram の転置索引）"""
+
+    def __init__(self):
+        self.hints: Dict[str, str] = {}
+        self.grams: Dict[str, Set[str]] = {}
+        self.postings: Dict[str, Set[str]] = {}
+
+    def add(self, key: str, hint: str) -> None:
+        if key not in self.hints:
+            grams = bigrams(key)
+            self.grams[key] = grams
+            for gram in grams:
+                self.postings.setdefault(gram, set()).add(key)
+        self.hints[key] = hint
+
+    def search(self, key: str, min_score: float) -> Tuple[Optional[str], float]:
+        """最も似ているキーを探し、(キー, スコア) を返す（min_score 未満なら (None, スコア)）"""
+        if key in self.hints:
+            return key, 1.0
+        query = bigrams(key)
+        if not query:
+            return None, 0.0
+        overlaps: Dict[str, int] = {}
+        for gram in query:
+            for candidate in self.postings.get(gram, ()):
+                overlaps[candidate] = overlaps.get(candidate, 0) + 1
+        best, best_score = None, 0.0
+        for candidate, overlap in overlaps.items():
+            score = 2 * overlap / (len(query) + len(self.grams[candidate]))
+            if score > best_score:
+                best, best_score = candidate, score
+        if best_score < min_score:
+            return None, best_score
+        return best, best_score
+
+
+class PhraseIndex:
+    """よく使う表現のヒントを英語レベルごとに引く索引
+
+    seed_path の JSON（{"phrases": [{"ja": [言い回し...], "hints": {"400": ...}}]}）を
+    読み込んで索引を作る。lookup() は確信度（類似度）が min_score 以上の場合だけヒントを返し、
+    それ以外は None を返して LLM に任せる。
+    """
+
+    def __init__(self, seed_path: Optional[str] = None, db_path: Optional[str] = None,
+                 min_score: float = 0.8, window_size: int = 1000):
+        self.min_score = min_score
+        self._levels: Dict[str, _LevelIndex] = {}
+        self._lock = threading.Lock()
+        self._lookup_times: deque = deque(maxlen=window_size)
+        self._stats = {"hits": 0, "exact_hits": 0, "misses": 0, "added": 0}
+        self._db: Optional[sqlite3.Connection] = None
+        self._writer: Optional[concurrent.futures.ThreadPoolExecutor] = None
+        self._writer_pid = 0
+
+        seeds = self._load_seeds(seed_path) if seed_path else []
+        if db_path:
+            self._db = self._open_db(db_path, seeds)
+            rows = self._db.execute("SELECT level, key, hint FROM phrases").fetchall()
+        else:
+            rows = seeds
+        for level, key, hint in rows:
+            self._index(level).add(key, hint)
+
+    @staticmethod
+    def _load_seeds(seed_path: str) -> List[Tuple[str, str, str]]:
+        """初期データの JSON を (レベル, 正規化したキー, ヒント) のリストにする"""
+        path = Path(seed_path)
+        if not path.is_absolute():
+            path = Path(__file__).resolve().parent.parent / path
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                phrases = json.load(f).get("phrases", [])
+        except (IOError, ValueError) as e:
+            print(f"Error loading hint phrases: {e}")
+            return []
+        rows = []
+        for phrase in phrases:
+            for text in phrase.get("ja", []):
+                key = normalize(text)
+                if not key:
+                    continue
+                for level, hint in phrase.get("hints", {}).items():
+                    rows.append((str(level), key, hint))
+        return rows
+
+    @staticmethod
+    def _open_db(db_path: str, seeds: List[Tuple[str, str, str]]) -> sqlite3.Connection:
+        """索引のデータベースを開き、初期データのうち未登録のものを追加する"""
+        path = Path(db_path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        db = sqlite3.connect(str(path), check_same_thread=False)
+        db.execute(
+            "CREATE TABLE IF NOT EXISTS phrases ("
+            "level TEXT NOT NULL, key TEXT NOT NULL, hint TEXT NOT NULL, source TEXT NOT NULL, "
+            "created_at REAL NOT NULL, PRIMARY KEY (level, key))"
+        )
+        now = time.time()
+        db.executemany(
+            "INSERT OR IGNORE INTO phrases (level, key, hint, source, created_at) VALUES (?, ?, ?, 'seed', ?)",
+            [(level, key, hint, now) for level, key, hint in seeds],
+        )
+        db.commit()
+        return db
+
+    def _index(self, level: str) -> _LevelIndex:
+        index = self._levels.get(level)
+        if index is None:
+            index = self._levels[level] = _LevelIndex()
+        return index
+
+    def lookup(self, text: str, level: str) -> Optional[str]:
+        """入力に対応するヒントを取得（確信度の高い一致がなければ None）"""
+        start = time.perf_counter()
+        key = normalize(text)
+        with self._lock:
+            index = self._levels.get(level)
+            match, score = index.search(key, self.min_score) if index and key else (None, 0.0)
+            hint = index.hints[match] if match is not None else None
+            if hint is None:
+                self._stats["misses"] += 1
+            else:
+                self._stats["hits"] += 1
+                if score == 1.0:
+                    self._stats["exact_hits"] += 1
+            duration = time.perf_counter() - start
+            self._lookup_times.append(duration)
+        record_hint_lookup(hint is not None, duration)
+        return hint
+
+    def add(self, text: str, level: str, hint: str) -> None:
+        """LLM から得たヒントを索引に追加（データベースへの書き込みは待たない）"""
+        key = normalize(text)
+        if not key:
+            return
+        with self._lock:
+            self._index(level).add(key, hint)
+            self._stats["added"] += 1
+            if self._db is not None:
+                self._writer_executor().submit(self._write, level, key, hint, time.time())
+
+    def _writer_executor(self) -> concurrent.futures.ThreadPoolExecutor:
+        """データベースに書き込む専用スレッド（fork 後は作り直す。ロック取得済みで呼ぶ）"""
+        if self._writer is None or self._writer_pid != os.getpid():
+            self._writer = concurrent.futures.ThreadPoolExecutor(
+                max_workers=1, thread_name_prefix="phrase-index-writer")
+            self._writer_pid = os.getpid()
+        return self._writer
+
+    def _write(self, level: str, key: str, hint: str, created_at: float) -> None:
+        """ヒントをデータベースに保存（書き込み用のスレッドで実行する）"""
+        try:
+            self._db.execute(
+                "INSERT OR REPLACE INTO phrases (level, key, hint, source, created_at) "
+                "VALUES (?, ?, ?, 'llm', ?)",
+                (level, key, hint, created_at),
+            )
+            self._db.commit()
+        except sqlite3.Error as e:
+            print(f"Error saving hint phrase: {e}")
+
+    def flush(self) -> None:
+        """書き込み待ちのヒントをデータベースに保存し終えるまで待つ"""
+        with self._lock:
+            writer = self._writer if self._writer_pid == os.getpid() else None
+        if writer is not None:
+            writer.submit(lambda: None).result()
+
+    def get_stats(self) -> Dict[str, Any]:
+        """ヒット率・検索時間（マイクロ秒）・件数の統計を取得"""
+        with self._lock:
+            stats: Dict[str, Any] = dict(self._stats)
+            stats["entries"] = {level: len(index.hints) for level, index in self._levels.items()}
+            lookup_times = list(self._lookup_times)
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = stats["hits"] / lookups if lookups else 0.0
+        stats["lookup_p50_us"] = round(_percentile(lookup_times, 50) * 1e6, 1)
+        stats["lookup_p99_us"] = round(_percentile(lookup_times, 99) * 1e6, 1)
+        stats["min_score"] = self.min_score
+        stats["db_enabled"] = self._db is not None
+        return stats
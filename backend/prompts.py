@@ -1,6 +1,23 @@
-"""プロンプト管理モジュール"""
+"""プロンプト管理モジュール
 
-from typing import Dict, Optional
+チャットのシステムプロンプトと、フィードバック・ヒントの指示は、レベルごとに変わらない
+前半（prefix）と呼び出しごとに変わる後半（suffix）に分けて組み立てる。prefix はレベルごとに
+一度だけ生成して使い回すため、毎回バイト単位で同じ文字列になり、プロバイダー側の
+プロンプトキャッシュ（Anthropic の cache_control、Azure OpenAI の自動キャッシュ）に載る。
+"""
+
+from typing import Dict, List, Optional, Tuple
+
+
+class PromptParts:
+    """キャッシュできる前半（prefix）と、呼び出しごとに変わる後半（suffix）に分けたプロンプト"""
+
+    def __init__(self, prefix: str, suffix: str = ""):
+        self.prefix = prefix
+        self.suffix = suffix
+
+    def __str__(self) -> str:
+        return self.prefix + self.suffix
 
 
 class PromptManager:
@@ -20,10 +37,29 @@ class PromptManager:
             "生徒の投稿が長いならあなたの英文も長く、生徒の投稿が短いなら、あなたの投稿も短くしてください。"
         )
 
-    def get_system_prompt(self, level: str) -> str:
-        """指定されたレベルに応じたシステムプロンプトを生成"""
-        level_desc = self.level_descriptions.get(level, self.level_descriptions["400"])
-        return self.system_prompt_template.format(level=level_desc)
+        # (プロンプトの種類, レベル) → 生成済みの prefix
+        self._prefixes: Dict[Tuple[str, str], str] = {}
+
+    def _prefix(self, kind: str, level: str) -> str:
+        """レベルごとの prefix を生成（生成済みならそれを返す）"""
+        if level not in self.level_descriptions:
+            level = "400"
+        prefix = self._prefixes.get((kind, level))
+        if prefix is None:
+            level_desc = self.level_descriptions[level]
+            if kind == "system":
+                prefix = self.system_prompt_template.format(level=level_desc)
+            elif kind == "feedback":
+                prefix = self._feedback_instructions(level_desc)
+            else:
+                prefix = self._hint_instructions(level_desc)
+            self._prefixes[(kind, level)] = prefix
+        return prefix
+
+    def get_system_prompt(self, level: str, summary: str = "") -> PromptParts:
+        """指定されたレベルに応じたシステムプロンプトを生成（要約があれば suffix として末尾に付与）"""
+        suffix = f"\n\n# これまでの会話の要約\n{summary}" if summary else ""
+        return PromptParts(self._prefix("system", level), suffix)
 
     def get_translation_prompt(
         self, text: str, target_language: str = "japanese"
@@ -33,41 +69,73 @@ class PromptManager:
         target = language_map.get(target_language.lower(), "Japanese")
         return f"Translate the following English text to {target}. Provide only the translation:\n\n{text}"
 
-    def get_feedback_prompt(
-        self, text: str, level: str, teacher_text: Optional[str] = None
+    def get_batch_translation_prompt(
+        self, texts: List[str], target_language: str = "japanese"
     ) -> str:
-        """フィードバック用プロンプトを生成"""
-        level_desc = self.level_descriptions.get(level, self.level_descriptions["400"])
+        """複数テキストの一括翻訳用プロンプトを生成（結果は JSON 配列で返させる）"""
+        language_map = {"japanese": "Japanese", "english": "English"}
+        target = language_map.get(target_language.lower(), "Japanese")
+        numbered = "\n\n".join(f"[{i}]\n{text}" for i, text in enumerate(texts, 1))
+        return (
+            f"Translate each of the following {len(texts)} numbered English texts to {target}.\n"
+            f"Reply with only a JSON array of {len(texts)} strings, where the n-th string is the translation "
+            f"of text [n]. Do not merge, split or skip texts, and do not include the numbers.\n\n{numbered}"
+        )
 
+    def get_feedback_prompt(
+        self, text: str, level: str, teacher_text: Optional[str] = None
+    ) -> PromptParts:
+        """フィードバック用プロンプトを生成（prefix は指示、suffix は文脈と学習者の英文）"""
         context_part = ""
         if teacher_text:
-            context_part = (
-                f"\n\n# 直前の先生からのメッセージ（文脈参考用）\n{teacher_text}"
-            )
+            context_part = f"# 直前の先生からのメッセージ（文脈参考用）\n{teacher_text}\n\n"
+
+        return PromptParts(self._prefix("feedback", level), f"{context_part}# 私の英文\n{text}")
 
-        return f"""私の以下の英文をネイティブスピーカーの目線で評価してください。
+    @staticmethod
+    def _feedback_instructions(level_desc: str) -> str:
+        return f"""私が送る英文をネイティブスピーカーの目線で評価してください。
 私は英語の練習中で、英会話の先生とチャットで会話をしています。
 この英文は、そのチャットの一部を抜粋したものです。
-文法や単語の誤りを指摘したり、より自然な表現があれば提案してください。{context_part}
+文法や単語の誤りを指摘したり、より自然な表現があれば提案してください。
+直前の先生からのメッセージが添えられている場合は、文脈の参考にしてください。
 
 # Note
 - 私の英語は{level_desc}レベルを目標にしていると想定してください。
 - フィードバックは日本語でお願いします。
 - "わかりました"のような返事やあいさつなどは不要です。本題から始めてください。
-- フィードバックは短く簡潔な内容にしてください。長くても200文字程度が上限です。例えば誤りが多い場合は全て指摘する必要はなく、より基本的なものを1〜2つピックすればよいです。
+- フィードバックは短く簡潔な内容にしてください。長くても200文字程度が上限です。例えば誤りが多い場合は全て指摘する必要はなく、より基本的なものを1〜2つピックすればよいです。"""
 
-# 私の英文
-{text}"""
+    def get_summary_prompt(self, previous_summary: str, turns: List[Dict]) -> str:
+        """会話要約用プロンプトを生成（既存の要約に新しいターンを畳み込む）"""
+        role_names = {"user": "Student", "assistant": "Teacher"}
+        conversation = "\n".join(
+            f"{role_names.get(turn['role'], turn['role'])}: {turn['content']}" for turn in turns
+        )
+        previous = previous_summary or "（まだ要約はありません）"
 
-    def get_hint_prompt(self, japanese_text: str, level: str) -> str:
-        """ヒント機能用プロンプトを生成"""
-        level_desc = self.level_descriptions.get(level, self.level_descriptions["400"])
+        return f"""以下は英会話の先生と生徒のチャットの要約と、その続きの会話です。
+これらをまとめて、会話を続けるために先生が覚えておくべき内容の要約を作成してください。
 
-        return f"""私は英語学習者で、英会話の先生とチャットで会話をしています。
-以下の内容を英語で伝えたいのですが、適切な英語表現を教えてください。
+# 要求事項
+- 要約は英語で、5文以内にしてください。
+- 話題、生徒について分かったこと（趣味・予定など）、話の流れを残してください。
+- 要約だけを出力してください。
+
+# これまでの要約
+{previous}
+
+# 続きの会話
+{conversation}"""
 
-# 伝えたい内容（日本語）
-{japanese_text}
+    def get_hint_prompt(self, japanese_text: str, level: str) -> PromptParts:
+        """ヒント機能用プロンプトを生成（prefix は指示、suffix は伝えたい内容）"""
+        return PromptParts(self._prefix("hint", level), f"# 伝えたい内容（日本語）\n{japanese_text}")
+
+    @staticmethod
+    def _hint_instructions(level_desc: str) -> str:
+        return f"""私は英語学習者で、英会話の先生とチャットで会話をしています。
+私が送る日本語の内容を英語で伝えたいのですが、適切な英語表現を教えてください。
 
 # 要求事項
 - 私の英語レベルは{level_desc}です。このレベルに適した語彙と文法を使用してください。
@@ -0,0 +1,361 @@
+"""AI プロバイダーアダプターモジュール
+
+SDK（anthropic / openai）の読み込みには時間がかかるため、各アダプターは
+最初に API を呼び出すときに SDK を import してクライアントを生成する。
+設定されていないプロバイダーの SDK は読み込まない。
+"""
+
+import itertools
+from typing import AsyncIterator, Callable, Dict, List, Optional, Union
+
+from config.settings import settings
+
+from .prompts import PromptParts
+
+# システムプロンプトは文字列か、キャッシュできる前半を分けた PromptParts
+SystemPrompt = Union[str, PromptParts, None]
+
+
+class Completion:
+    """プロバイダーの回答とトークン使用量
+
+    input_tokens はキャッシュから読んだ分・キャッシュに書いた分を含む入力トークン数の合計。
+    """
+
+    def __init__(self, text: str, input_tokens: int = 0, output_tokens: int = 0,
+                 stop_reason: Optional[str] = None, cache_read_tokens: int = 0,
+                 cache_write_tokens: int = 0):
+        self.text = text
+        self.input_tokens = input_tokens
+        self.output_tokens = output_tokens
+        self.stop_reason = stop_reason
+        self.cache_read_tokens = cache_read_tokens
+        self.cache_write_tokens = cache_write_tokens
+
+
+class ClientShards:
+    """同じ設定の API クライアントを複数持ち、呼び出しごとに順番に使うクラス
+
+    SDK が使う httpx（httpcore）の非同期コネクションプールは、リクエストの開始・終了の
+    たびにプール内の全コネクションを走査し（待機中のコネクションごとにソケットの状態を
+    確認する）、その手間はコネクション数の2乗に比例する。同時に数十以上の呼び出しを
+    1つのイベントループで処理すると、この走査がループのスレッドを占有するため、
+    コネクションを shards 個のプールに分けて1回の走査を小さくする。
+    """
+
+    def __init__(self, factory: Callable[[], object], shards: int = 1):
+        self.clients = [factory() for _ in range(max(shards, 1))]
+        self._cycle = itertools.cycle(self.clients)
+
+    def next(self):
+        """次に使うクライアント"""
+        return next(self._cycle)
+
+    async def close(self) -> None:
+        for client in self.clients:
+            await client.close()
+
+
+def _client_shards() -> int:
+    return settings.get_limits_config().get("client_shards", 8)
+
+
+class AnthropicProvider:
+    """Anthropic Claude API を共通インターフェースで扱うクラス"""
+
+    name = "anthropic"
+
+    def __init__(self, api_key: str):
+        self.api_key = api_key
+        self._client = None
+
+    @property
+    def credentials(self) -> tuple:
+        """クライアントの生成に使う設定（変わったらアダプターを作り直す）"""
+        return (self.api_key,)
+
+    @property
+    def client(self):
+        """API クライアント（初回利用時に生成。呼び出しごとに ClientShards から順番に使う）"""
+        if self._client is None:
+            import anthropic
+            # 再試行は router 側で流量制限と合わせて行うため、SDK の再試行は無効にする
+            self._client = ClientShards(
+                lambda: anthropic.AsyncAnthropic(api_key=self.api_key, max_retries=0), _client_shards()
+            )
+        return self._client.next()
+
+    @property
+    def model(self) -> str:
+        """使用するモデル名"""
+        return settings.get_model("anthropic")
+
+    @staticmethod
+    def _system(system: SystemPrompt) -> Union[str, List[Dict]]:
+        """PromptParts の prefix にキャッシュの区切り（cache_control）を付けたシステムプロンプト"""
+        if not isinstance(system, PromptParts) or not settings.get_prompt_cache_config().get("enabled", True):
+            return str(system)
+        blocks = [{"type": "text", "text": system.prefix, "cache_control": {"type": "ephemeral"}}]
+        if system.suffix:
+            blocks.append({"type": "text", "text": system.suffix})
+        return blocks
+
+    @staticmethod
+    def _messages(messages: List[Dict]) -> List[Dict]:
+        """直前までの履歴の最後にキャッシュの区切りを付けたメッセージ列
+
+        履歴は次のターンでもそのまま先頭に残るため、システムプロンプトの prefix と合わせて
+        キャッシュから読める（最新の発言だけが新しい入力になる）。
+        """
+        if len(messages) < 2 or not settings.get_prompt_cache_config().get("enabled", True):
+            return messages
+        last = messages[-2]
+        if not isinstance(last.get("content"), str):
+            return messages
+        block = {"type": "text", "text": last["content"], "cache_control": {"type": "ephemeral"}}
+        cached = dict(last, content=[block])
+        return messages[:-2] + [cached, messages[-1]]
+
+    @staticmethod
+    def _completion(text: str, message) -> Completion:
+        usage = message.usage
+        cache_read = getattr(usage, "cache_read_input_tokens", None) or 0
+        cache_write = getattr(usage, "cache_creation_input_tokens", None) or 0
+        # Anthropic の input_tokens はキャッシュの区切りより後ろの分だけなので、合計に直す
+        return Completion(
+            text,
+            usage.input_tokens + cache_read + cache_write,
+            usage.output_tokens,
+            message.stop_reason,
+            cache_read,
+            cache_write
+        )
+
+    async def create(self, system: SystemPrompt, messages: List[Dict], max_tokens: int,
+                     stop: Optional[List[str]] = None, **options) -> Completion:
+        """回答を一括で取得（stop の文字列が出力されたら生成を止める）"""
+        if system:
+            options["system"] = self._system(system)
+        if stop:
+            options["stop_sequences"] = stop
+        response = await self.client.messages.create(
+            model=self.model,
+            max_tokens=max_tokens,
+            messages=self._messages(messages),
+            **options
+        )
+        return self._completion(response.content[0].text, response)
+
+    async def stream(self, system: SystemPrompt, messages: List[Dict], max_tokens: int,
+                     stop: Optional[List[str]] = None, **options) -> AsyncIterator[Union[str, Completion]]:
+        """回答をトークン単位で取得（最後に使用量を含む Completion を1つ返す）"""
+        if system:
+            options["system"] = self._system(system)
+        if stop:
+            options["stop_sequences"] = stop
+        async with self.client.messages.stream(
+            model=self.model,
+            max_tokens=max_tokens,
+            messages=self._messages(messages),
+            **options
+        ) as stream:
+            async for text in stream.text_stream:
+                yield text
+            message = await stream.get_final_message()
+        yield self._completion("".join(block.text for block in message.content if block.type == "text"), message)
+
+    async def aclose(self) -> None:
+        """コネクションを閉じる（クライアント未生成なら何もしない）"""
+        if self._client is not None:
+            await self._client.close()
+
+
+class AzureOpenAIProvider:
+    """Azure OpenAI API を共通インターフェースで扱うクラス"""
+
+    name = "azure_openai"
+
+    def __init__(self, api_key: str, endpoint: str, api_version: str):
+        self.api_key = api_key
+        self.endpoint = endpoint
+        self.api_version = api_version
+        self._client = None
+
+    @property
+    def credentials(self) -> tuple:
+        """クライアントの生成に使う設定（変わったらアダプターを作り直す）"""
+        return (self.api_key, self.endpoint, self.api_version)
+
+    @property
+    def client(self):
+        """API クライアント（初回利用時に生成。呼び出しごとに ClientShards から順番に使う）"""
+        if self._client is None:
+            from openai import AsyncAzureOpenAI
+            self._client = ClientShards(
+                lambda: AsyncAzureOpenAI(
+                    api_key=self.api_key,
+                    azure_endpoint=self.endpoint,
+                    api_version=self.api_version,
+                    max_retries=0
+                ),
+                _client_shards()
+            )
+        return self._client.next()
+
+    @property
+    def model(self) -> str:
+        """使用するデプロイメント名"""
+        deployment_name = settings.get_azure_openai_deployment_name()
+        if not deployment_name:
+            # フォールバックとしてモデル名を使用（互換性のため）
+            deployment_name = settings.get_model("azure_openai")
+        return deployment_name
+
+    def _with_system(self, system: SystemPrompt, messages: List[Dict]) -> List[Dict]:
+        # Azure OpenAI は先頭から一致する部分を自動でキャッシュするため、prefix を先頭に置いたまま
+        # 1つの文字列にする（prefix は PromptManager が使い回すのでバイト単位で同じになる）
+        if not system:
+            return messages
+        return [{"role": "system", "content": str(system)}] + messages
+
+    @staticmethod
+    def _cached_tokens(usage) -> int:
+        """キャッシュから読んだ入力トークン数（prompt_tokens に含まれる）"""
+        details = getattr(usage, "prompt_tokens_details", None)
+        return (getattr(details, "cached_tokens", None) or 0) if details else 0
+
+    async def create(self, system: SystemPrompt, messages: List[Dict], max_tokens: int,
+                     stop: Optional[List[str]] = None, **options) -> Completion:
+        """回答を一括で取得（stop の文字列が出力されたら生成を止める）"""
+        if stop:
+            options["stop"] = stop
+        response = await self.client.chat.completions.create(
+            model=self.model,
+            messages=self._with_system(system, messages),
+            max_tokens=max_tokens,
+            **options
+        )
+        usage = response.usage
+        return Completion(
+            response.choices[0].message.content,
+            usage.prompt_tokens if usage else 0,
+            usage.completion_tokens if usage else 0,
+            response.choices[0].finish_reason,
+            self._cached_tokens(usage) if usage else 0
+        )
+
+    async def stream(self, system: SystemPrompt, messages: List[Dict], max_tokens: int,
+                     stop: Optional[List[str]] = None, **options) -> AsyncIterator[Union[str, Completion]]:
+        """回答をトークン単位で取得（最後に使用量を含む Completion を1つ返す）"""
+        if stop:
+            options["stop"] = stop
+        stream = await self.client.chat.completions.create(
+            model=self.model,
+            messages=self._with_system(system, messages),
+            max_tokens=max_tokens,
+            stream=True,
+            # 最後のチャンクでトークン使用量を受け取る
+            stream_options={"include_usage": True},
+            **options
+        )
+        chunks = []
+        usage = None
+        finish_reason = None
+        async for chunk in stream:
+            if chunk.usage:
+                usage = chunk.usage
+            if not chunk.choices:
+                continue
+            if chunk.choices[0].finish_reason:
+                finish_reason = chunk.choices[0].finish_reason
+            if chunk.choices[0].delta.content:
+                chunks.append(chunk.choices[0].delta.content)
+                yield chunk.choices[0].delta.content
+        yield Completion(
+            "".join(chunks),
+            usage.prompt_tokens if usage else 0,
+            usage.completion_tokens if usage else 0,
+            finish_reason,
+            self._cached_tokens(usage) if usage else 0
+        )
+
+    async def aclose(self) -> None:
+        """コネクションを閉じる（クライアント未生成なら何もしない）"""
+        if self._client is not None:
+            await self._client.close()
+
+
+def create_providers(current: Optional[Dict[str, object]] = None) -> Dict[str, object]:
+    """設定済みのプロバイダーのアダプターを生成（クライアントは初回利用時に生成）
+
+    current を渡した場合は、認証情報とエンドポイントが変わっていないアダプターを
+    そのまま使い回す（設定の再読み込み時にコネクションプールを保つため）。
+    """
+    current = current or {}
+    configured = {}
+
+    anthropic_key = settings.get_api_key('anthropic')
+    azure_openai_key = settings.get_api_key('azure_openai')
+    azure_openai_endpoint = settings.get_azure_openai_endpoint()
+
+    if anthropic_key:
+        configured["anthropic"] = (AnthropicProvider, (anthropic_key,))
+
+    if azure_openai_key and azure_openai_endpoint:
+        configured["azure_openai"] = (
+            AzureOpenAIProvider,
+            (azure_openai_key, azure_openai_endpoint, settings.get_azure_openai_api_version())
+        )
+    elif azure_openai_key or azure_openai_endpoint:
+        print("Warning: Azure OpenAI の設定が不完全です。APIキーとエンドポイントの両方を設定してください。")
+
+    configured.update(_load_test_providers(configured))
+
+    providers = {}
+    for name, (provider_class, credentials) in configured.items():
+        existing = current.get(name)
+        if existing is not None and existing.credentials == credentials:
+            providers[name] = existing
+            continue
+        providers[name] = provider_class(*credentials)
+        if existing is not None:
+            print(f"{name} の接続設定が変わったため、クライアントを作り直します")
+        elif name == "anthropic":
+            print("Anthropic Claude API が利用可能です")
+        elif name == "azure_openai":
+            print("Azure OpenAI API が利用可能です")
+        else:
+            print(f"{name} の疑似プロバイダーが利用可能です")
+
+    if not providers:
+        print("Warning: APIキーが設定されていません。config/config.json ファイルでAPIキーを設定してください。")
+
+    return providers
+
+
+def _load_test_providers(configured: Dict[str, tuple]) -> Dict[str, tuple]:
+    """負荷試験用の設定（fake_provider / recording）に従って、追加・置き換えるアダプターを返す
+
+    recording.mode が record なら設定済みのプロバイダーを記録用のラッパーに、replay なら
+    記録に含まれるプロバイダーを再生用のアダプターに置き換える。
+    """
+    fake_config = settings.get_fake_provider_config()
+    recording = settings.get_recording_config()
+    mode = recording.get("mode", "off")
+    if not fake_config.get("enabled", False) and mode not in ("record", "replay"):
+        return {}
+
+    # 負荷試験用のアダプターは使うときだけ読み込む
+    from .fake_provider import FakeProvider, RecordingProvider, ReplayProvider, load_recording
+
+    test_providers = {}
+    path = recording.get("path", "data/recordings/provider_calls.jsonl")
+    if mode == "record":
+        for name, (provider_class, credentials) in configured.items():
+            test_providers[name] = (RecordingProvider, (provider_class, credentials, path))
+    elif mode == "replay":
+        for name in sorted({entry.get("provider") for entry in load_recording(path)} - {None}):
+            test_providers[name] = (ReplayProvider, (name, path, recording.get("replay_timing", True)))
+    if fake_config.get("enabled", False):
+        test_providers["fake"] = (FakeProvider, (fake_config,))
+    return test_providers
@@ -0,0 +1,399 @@
+"""プロバイダールーティングモジュール"""
+
+import asyncio
+import time
+from collections import deque
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from .deadlines import RequestAbortedError, remaining_time
+from .limiter import LimiterBusyError, ProviderLimiter, RetryPolicy, get_retry_after, get_status_code
+from .providers import Completion
+from .scheduler import SupersededError, TurnTracker, get_priority_class
+from .shared_state import StateBackend
+from .telemetry import record_call, record_cancelled, record_error, record_first_token, record_retry
+
+# ルーティング対象のプロバイダー名（優先順。fake は負荷試験用の疑似プロバイダー）
+PROVIDER_NAMES = ["anthropic", "azure_openai", "fake"]
+
+
+class NoProviderAvailableError(Exception):
+    """利用可能なプロバイダーがない場合の例外"""
+
+
+class ProviderStats:
+    """プロバイダーごとのレイテンシとエラー率を直近の呼び出しから集計するクラス"""
+
+    def __init__(self, window_size: int = 100):
+        self.window_size = window_size
+        self.latencies: Dict[str, deque] = {}
+        self.outcomes: deque = deque(maxlen=window_size)
+        self.consecutive_failures = 0
+        self.open_until = 0.0
+
+    def record_success(self, operation: Optional[str] = None, latency: Optional[float] = None) -> None:
+        """成功を記録（latency は秒）"""
+        self.outcomes.append(True)
+        self.consecutive_failures = 0
+        if operation and latency is not None:
+            self.latencies.setdefault(operation, deque(maxlen=self.window_size)).append(latency)
+
+    def record_failure(self) -> None:
+        """失敗を記録"""
+        self.outcomes.append(False)
+        self.consecutive_failures += 1
+
+    def percentile(self, operation: str, pct: float) -> Optional[float]:
+        """指定した処理のレイテンシのパーセンタイル（秒）を取得"""
+        samples = self.latencies.get(operation)
+        if not samples:
+            return None
+        ordered = sorted(samples)
+        index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+        return ordered[index]
+
+    def sample_count(self, operation: str) -> int:
+        """指定した処理のレイテンシのサンプル数を取得"""
+        return len(self.latencies.get(operation, ()))
+
+    @property
+    def error_rate(self) -> float:
+        """直近の呼び出しのエラー率"""
+        if not self.outcomes:
+            return 0.0
+        return self.outcomes.count(False) / len(self.outcomes)
+
+    def to_dict(self) -> Dict[str, Any]:
+        """統計を辞書で取得"""
+        latency = {}
+        for operation in self.latencies:
+            latency[operation] = {
+                "p50_ms": round(self.percentile(operation, 50) * 1000, 1),
+                "p95_ms": round(self.percentile(operation, 95) * 1000, 1),
+                "samples": self.sample_count(operation),
+            }
+        return {
+            "error_rate": round(self.error_rate, 3),
+            "consecutive_failures": self.consecutive_failures,
+            "healthy": time.monotonic() >= self.open_until,
+            "latency": latency,
+        }
+
+
+class ProviderRouter:
+    """プロバイダーの選択・フェイルオーバー・ヘッジリクエストを行うクラス
+
+    各プロバイダーの直近のレイテンシとエラー率を記録し、失敗が続いたプロバイダーは
+    一定時間（cooldown_seconds）後回しにする。ヘッジを有効にした場合、1つ目の
+    プロバイダーが過去の p95 レイテンシを超えても応答しなければ、もう一方にも
+    同じリクエストを送り、先に返ってきた方を採用する。
+    """
+
+    def __init__(self, providers: Dict[str, Any], config: Optional[Dict[str, Any]] = None,
+                 limits_config: Optional[Dict[str, Any]] = None, shared: Optional[StateBackend] = None):
+        config = config or {}
+        limits_config = limits_config or {}
+        hedge_config = config.get("hedge", {})
+        self.providers = providers
+        self.failover = config.get("failover", True)
+        self.error_threshold = config.get("error_threshold", 0.5)
+        self.failure_threshold = config.get("failure_threshold", 3)
+        self.min_samples = config.get("min_samples", 10)
+        self.cooldown_seconds = config.get("cooldown_seconds", 30)
+        self.hedge_enabled = hedge_config.get("enabled", False)
+        self.hedge_percentile = hedge_config.get("percentile", 95)
+        self.hedge_min_samples = hedge_config.get("min_samples", 20)
+        self.hedge_min_delay = hedge_config.get("min_delay_ms", 300) / 1000
+        window_size = config.get("window_size", 100)
+        self.stats = {name: ProviderStats(window_size) for name in PROVIDER_NAMES}
+        self.counters = {"failovers": 0, "hedges": 0, "hedge_wins": 0}
+        self.retry_policy = RetryPolicy(limits_config.get("retry"))
+        self.turns = TurnTracker()
+        self.limiters = {
+            name: ProviderLimiter(
+                limits_config.get("providers", {}).get(name),
+                max_queue=limits_config.get("max_queue", 1000),
+                queue_timeout=limits_config.get("queue_timeout_seconds", 30),
+                name=name,
+                class_config=limits_config.get("priority_classes"),
+                turns=self.turns,
+                shared=shared
+            )
+            for name in PROVIDER_NAMES
+        }
+
+    def is_available(self, name: str) -> bool:
+        """プロバイダーが設定済みかどうか"""
+        return name in self.providers
+
+    def is_healthy(self, name: str) -> bool:
+        """プロバイダーが後回し期間中でないかどうか"""
+        return time.monotonic() >= self.stats[name].open_until
+
+    def candidates(self, preferred: str) -> List[str]:
+        """試行するプロバイダーを順番に返す（優先プロバイダー → 健全な他 → 不調なもの）"""
+        ordered = [preferred] + [name for name in PROVIDER_NAMES if name != preferred]
+        available = [name for name in ordered if self.is_available(name)]
+        if not self.failover:
+            return available[:1] if available and available[0] == preferred else []
+        healthy = [name for name in available if self.is_healthy(name)]
+        unhealthy = [name for name in available if not self.is_healthy(name)]
+        return healthy + unhealthy
+
+    def record_success(self, name: str, operation: Optional[str] = None,
+                       latency: Optional[float] = None) -> None:
+        """成功を記録"""
+        self.stats[name].record_success(operation, latency)
+
+    def record_failure(self, name: str) -> None:
+        """失敗を記録し、しきい値を超えたら一定時間後回しにする"""
+        stats = self.stats[name]
+        stats.record_failure()
+        too_many_errors = len(stats.outcomes) >= self.min_samples and stats.error_rate >= self.error_threshold
+        if stats.consecutive_failures >= self.failure_threshold or too_many_errors:
+            stats.open_until = time.monotonic() + self.cooldown_seconds
+
+    def hedge_delay(self, name: str, operation: str) -> Optional[float]:
+        """ヘッジリクエストを送るまでの待ち時間（秒）。十分なサンプルがなければ None"""
+        stats = self.stats[name]
+        if stats.sample_count(operation) < self.hedge_min_samples:
+            return None
+        return max(stats.percentile(operation, self.hedge_percentile), self.hedge_min_delay)
+
+    async def _backoff(self, name: str, operation: str, error: Exception, attempt: int) -> bool:
+        """再試行できるエラーなら待ってから True を返す。再試行しない場合は失敗を記録して False"""
+        limiter = self.limiters[name]
+        if get_status_code(error) == 429:
+            limiter.counters["rate_limited"] += 1
+            retry_after = get_retry_after(error)
+            if retry_after is not None:
+                # 他の呼び出しも同じ時刻まで送らない
+                limiter.pause(min(retry_after, self.retry_policy.max_retry_after))
+
+        delay = self.retry_policy.get_delay(error, attempt)
+        if delay is None:
+            self.record_failure(name)
+            return False
+        remaining = remaining_time()
+        if remaining is not None and delay >= remaining:
+            # 待っている間に締め切りを過ぎるため再試行しない（失敗として統計に数える）
+            self.record_failure(name)
+            return False
+        limiter.counters["retries"] += 1
+        record_retry(name, operation)
+        print(f"Provider {name} error ({operation}), retrying in {delay:.2f}s: {error}")
+        await asyncio.sleep(delay)
+        return True
+
+    async def _attempt(self, name: str, operation: str, call: Callable[[Any], Awaitable[Any]]) -> Any:
+        """1つのプロバイダーで呼び出し、結果を統計に記録
+
+        流量制限の枠内で呼び出し、一時的なエラーは枠を返してから待って再試行する。
+        すべてのプロバイダー呼び出しはここを通り、1回ごとにメトリクスを記録する。
+        """
+        limiter = self.limiters[name]
+        priority = get_priority_class(operation)
+        attempt = 0
+        while True:
+            async with limiter.acquire(priority):
+                start = time.perf_counter()
+                try:
+                    result = await call(self.providers[name])
+                except asyncio.CancelledError:
+                    record_cancelled(name, operation, time.perf_counter() - start)
+                    raise
+                except (SupersededError, RequestAbortedError):
+                    # プロバイダーの失敗ではないため、記録も再試行もしない
+                    raise
+                except Exception as e:
+                    error = e
+                    record_call(name, operation, time.perf_counter() - start, error=e)
+                else:
+                    latency = time.perf_counter() - start
+                    self.record_success(name, operation, latency)
+                    record_call(name, operation, latency, result)
+                    return result
+            if not await self._backoff(name, operation, error, attempt):
+                raise error
+            attempt += 1
+
+    async def _open_stream(self, name: str, operation: str,
+                           stream: Callable[[Any], AsyncIterator[Any]]) -> Tuple[AsyncIterator[Any], Any, float]:
+        """ストリームを開いて最初のチャンクまで読む（初回トークン前のエラーは再試行）
+
+        (チャンクの残り, 最初のチャンク, 開始時刻) を返す。成功した場合は呼び出し枠を
+        確保したまま返すので、呼び出し側で同じ優先度クラスの exit() を呼ぶ。
+        空のストリームだった場合は StopAsyncIteration を送出する。
+        """
+        limiter = self.limiters[name]
+        priority = get_priority_class(operation)
+        attempt = 0
+        while True:
+            await limiter.enter(priority)
+            start = time.perf_counter()
+            chunks = stream(self.providers[name]).__aiter__()
+            try:
+                return chunks, await chunks.__anext__(), start
+            except StopAsyncIteration:
+                limiter.exit(priority)
+                self.record_success(name)
+                raise
+            except Exception as e:
+                limiter.exit(priority)
+                error = e
+                record_call(name, operation, time.perf_counter() - start, error=e)
+            except BaseException as e:
+                limiter.exit(priority)
+                if isinstance(e, asyncio.CancelledError):
+                    record_cancelled(name, operation, time.perf_counter() - start)
+                raise
+            if not await self._backoff(name, operation, error, attempt):
+                raise error
+            attempt += 1
+
+    async def call(self, preferred: str, operation: str,
+                   call: Callable[[Any], Awaitable[Any]]) -> Tuple[Any, str]:
+        """プロバイダーを選んで呼び出し、(結果, 応答したプロバイダー名) を返す"""
+        candidates = self.candidates(preferred)
+        if not candidates:
+            raise NoProviderAvailableError(preferred)
+
+        if self.hedge_enabled and len(candidates) > 1:
+            delay = self.hedge_delay(candidates[0], operation)
+            if delay is not None:
+                return await self._hedged_call(candidates[0], candidates[1], operation, call, delay)
+
+        last_error: Optional[Exception] = None
+        for index, name in enumerate(candidates):
+            if index > 0:
+                self.counters["failovers"] += 1
+            try:
+                return await self._attempt(name, operation, call), name
+            except (SupersededError, RequestAbortedError):
+                raise
+            except LimiterBusyError as e:
+                record_error(name, operation, e)
+                print(f"Provider {name} busy ({operation}): {e}")
+                last_error = e
+            except Exception as e:
+                print(f"Provider {name} failed ({operation}): {e}")
+                last_error = e
+        raise last_error
+
+    async def _hedged_call(self, primary: str, secondary: str, operation: str,
+                           call: Callable[[Any], Awaitable[Any]], delay: float) -> Tuple[Any, str]:
+        """1つ目が delay 秒以内に応答しなければ2つ目にも送り、先に成功した方を返す"""
+        tasks = {asyncio.ensure_future(self._attempt(primary, operation, call)): primary}
+        last_error: Optional[BaseException] = None
+        try:
+            done, _ = await asyncio.wait(tasks, timeout=delay)
+            if not done:
+                self.counters["hedges"] += 1
+                tasks[asyncio.ensure_future(self._attempt(secondary, operation, call))] = secondary
+
+            pending = set(tasks)
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    # ヘッジしない呼び出しと同じく、取り消し・追い越し・打ち切りはプロバイダーの失敗として
+                    # 数えず、もう1つのプロバイダーも試さずに伝える（残りの試行は finally で取り消す）
+                    if task.cancelled():
+                        raise asyncio.CancelledError()
+                    error = task.exception()
+                    if error is None:
+                        if tasks[task] == secondary:
+                            self.counters["hedge_wins"] += 1
+                        return task.result(), tasks[task]
+                    if isinstance(error, (SupersededError, RequestAbortedError)):
+                        raise error
+                    last_error = error
+                    print(f"Provider {tasks[task]} failed ({operation}): {last_error}")
+
+                # ヘッジを送る前に1つ目が失敗した場合は、2つ目にフェイルオーバー
+                if not pending and secondary not in tasks.values():
+                    self.counters["failovers"] += 1
+                    task = asyncio.ensure_future(self._attempt(secondary, operation, call))
+                    tasks[task] = secondary
+                    pending = {task}
+            raise last_error
+        finally:
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+
+    async def stream(self, preferred: str, stream: Callable[[Any], AsyncIterator[Any]],
+                     operation: str = "chat") -> AsyncIterator[str]:
+        """ストリーミング呼び出し（最初のトークンが届く前の失敗のみフェイルオーバー）
+
+        プロバイダーが最後に返す Completion（トークン使用量）はメトリクスに記録し、
+        呼び出し側にはテキストだけを返す。
+        """
+        candidates = self.candidates(preferred)
+        if not candidates:
+            raise NoProviderAvailableError(preferred)
+
+        last_error: Optional[Exception] = None
+        for index, name in enumerate(candidates):
+            if index > 0:
+                self.counters["failovers"] += 1
+            try:
+                chunks, first, start = await self._open_stream(name, operation, stream)
+            except StopAsyncIteration:
+                return
+            except SupersededError:
+                raise
+            except LimiterBusyError as e:
+                record_error(name, operation, e)
+                print(f"Provider {name} busy ({operation}): {e}")
+                last_error = e
+                continue
+            except Exception as e:
+                print(f"Provider {name} failed ({operation}): {e}")
+                last_error = e
+                continue
+
+            ttft = time.perf_counter() - start
+            record_first_token(name, operation, ttft)
+            completion = first if isinstance(first, Completion) else None
+            try:
+                if completion is None:
+                    yield first
+                async for chunk in chunks:
+                    if isinstance(chunk, Completion):
+                        completion = chunk
+                    else:
+                        yield chunk
+            except asyncio.CancelledError:
+                record_cancelled(name, operation, time.perf_counter() - start)
+                raise
+            except Exception as e:
+                self.record_failure(name)
+                record_call(name, operation, time.perf_counter() - start, error=e)
+                raise
+            finally:
+                self.limiters[name].exit(get_priority_class(operation))
+            # ストリーミングは初回トークンまでの時間を記録する
+            self.record_success(name, "stream_ttft", ttft)
+            record_call(name, operation, time.perf_counter() - start, completion)
+            return
+        raise last_error
+
+    def begin_turn(self, session_id: str) -> Tuple[str, int]:
+        """セッションの新しいターンを開始し、前のターンのために待っている呼び出しを打ち切る"""
+        turn = self.turns.begin(session_id)
+        for limiter in self.limiters.values():
+            limiter.gate.drop_stale()
+        return session_id, turn
+
+    def get_stats(self) -> Dict[str, Any]:
+        """ルーティング統計を取得"""
+        return {
+            "providers": {
+                name: {
+                    "available": self.is_available(name),
+                    **self.stats[name].to_dict(),
+                    "limiter": self.limiters[name].to_dict(),
+                }
+                for name in PROVIDER_NAMES
+            },
+            **self.counters,
+        }
@@ -0,0 +1,171 @@
+"""プロバイダー呼び出しの優先度スケジューリングモジュール
+
+1ターンごとに、利用者が待っているチャットの回答と、その後の和訳・フィードバックの
+呼び出しが同じプロバイダーの同時実行枠を取り合う。ここでは呼び出しを優先度クラスに
+分け、空いた枠を優先度の高いクラスから割り当てる。
+
+- interactive: チャット・ヒント（利用者が回答を待っている）
+- analysis: ターン後の和訳・フィードバック
+- background: 会話の要約
+
+クラスごとに同時実行枠の上限（share: 全体に対する割合）と待ち時間の上限を設ける。
+同じセッションで新しいターンが始まった場合、前のターンのために待っている呼び出しは
+もう表示されないため、枠を割り当てずに SupersededError で打ち切る。
+"""
+
+import asyncio
+import contextvars
+import math
+from collections import OrderedDict, deque
+from typing import Any, Dict, Optional, Tuple
+
+# 優先度の高い順
+PRIORITY_CLASSES = ("interactive", "analysis", "background")
+# 呼び出しの種類（operation）ごとの優先度クラス（ここにないものは analysis）
+OPERATION_CLASSES = {
+    "chat": "interactive",
+    "hint": "interactive",
+    "summary": "background",
+}
+DEFAULT_CLASS_CONFIG = {
+    "interactive": {"share": 1.0, "max_wait_seconds": 30},
+    "analysis": {"share": 0.75, "max_wait_seconds": 20},
+    "background": {"share": 0.25, "max_wait_seconds": 60},
+}
+
+# 呼び出し元のターン（セッションID, ターン番号）。前のターンの呼び出しを見分けるために使う
+current_turn: contextvars.ContextVar = contextvars.ContextVar("current_turn", default=None)
+
+
+def get_priority_class(operation: str) -> str:
+    """呼び出しの種類から優先度クラスを取得"""
+    return OPERATION_CLASSES.get(operation, "analysis")
+
+
+class SupersededError(Exception):
+    """同じセッションで新しいターンが始まり、待っていた呼び出しが不要になった場合の例外"""
+
+
+class TurnTracker:
+    """セッションごとの最新のターン番号を管理するクラス"""
+
+    def __init__(self, max_sessions: int = 10000):
+        self.max_sessions = max_sessions
+        self._turns: "OrderedDict[str, int]" = OrderedDict()
+
+    def begin(self, session_id: str) -> int:
+        """新しいターンを開始し、そのターン番号を返す"""
+        turn = self._turns.pop(session_id, 0) + 1
+        self._turns[session_id] = turn
+        while len(self._turns) > self.max_sessions:
+            self._turns.popitem(last=False)
+        return turn
+
+    def current(self, session_id: str) -> int:
+        """セッションの最新のターン番号"""
+        return self._turns.get(session_id, 0)
+
+    def is_stale(self, turn: Optional[Tuple[str, int]]) -> bool:
+        """turn より新しいターンが始まっているかどうか"""
+        return turn is not None and self._turns.get(turn[0], 0) > turn[1]
+
+
+class PriorityGate:
+    """優先度クラスごとの待ち行列を持つ同時実行枠
+
+    asyncio.Semaphore の代わりに使う。枠が空くと、優先度の高いクラスの待ち行列から
+    順に（クラス内では到着順に）割り当てる。ただし各クラスが同時に使える枠は
+    max_concurrency * share までに制限する。
+    """
+
+    def __init__(self, max_concurrency: int, class_config: Optional[Dict[str, Any]] = None,
+                 turns: Optional[TurnTracker] = None):
+        class_config = class_config or {}
+        self.max_concurrency = max_concurrency
+        self.turns = turns
+        self.limits = {}
+        self.max_waits = {}
+        for name in PRIORITY_CLASSES:
+            config = dict(DEFAULT_CLASS_CONFIG[name], **class_config.get(name, {}))
+            self.limits[name] = max(1, math.ceil(max_concurrency * config["share"]))
+            self.max_waits[name] = config["max_wait_seconds"]
+        self.counters = {name: {"granted": 0, "expired": 0, "superseded": 0} for name in PRIORITY_CLASSES}
+        self.reset()
+
+    def reset(self) -> None:
+        """待ち行列と使用中の枠をリセット（イベントループが変わった場合）"""
+        self.in_use = 0
+        self.in_use_by_class = {name: 0 for name in PRIORITY_CLASSES}
+        self.waiters: Dict[str, deque] = {name: deque() for name in PRIORITY_CLASSES}
+
+    def queue_depth(self, priority: str) -> int:
+        """クラスの待ち行列の長さ"""
+        return sum(1 for future, _ in self.waiters[priority] if not future.done())
+
+    def _supersede(self, priority: str, future: asyncio.Future) -> None:
+        self.counters[priority]["superseded"] += 1
+        future.set_exception(SupersededError("a newer turn started in this session"))
+
+    def _dispatch(self) -> None:
+        """空いている枠を優先度の高いクラスの待ち手から割り当てる"""
+        for priority in PRIORITY_CLASSES:
+            queue = self.waiters[priority]
+            while (queue and self.in_use < self.max_concurrency
+                   and self.in_use_by_class[priority] < self.limits[priority]):
+                future, turn = queue.popleft()
+                if future.done():
+                    continue
+                if self.turns is not None and self.turns.is_stale(turn):
+                    self._supersede(priority, future)
+                    continue
+                self.in_use += 1
+                self.in_use_by_class[priority] += 1
+                self.counters[priority]["granted"] += 1
+                future.set_result(None)
+
+    def drop_stale(self) -> None:
+        """新しいターンに追い越された待ち手を打ち切る"""
+        if self.turns is None:
+            return
+        for priority in PRIORITY_CLASSES:
+            for future, turn in self.waiters[priority]:
+                if not future.done() and self.turns.is_stale(turn):
+                    self._supersede(priority, future)
+
+    async def acquire(self, priority: str = "interactive") -> None:
+        """枠を確保（確保できたら必ず release() を呼ぶ）
+
+        クラスの待ち時間の上限を超えた場合は asyncio.TimeoutError を送出する。
+        """
+        turn = current_turn.get()
+        future = asyncio.get_running_loop().create_future()
+        self.waiters[priority].append((future, turn))
+        self._dispatch()
+        try:
+            await asyncio.wait_for(future, self.max_waits[priority])
+        except BaseException as e:
+            if future.done() and not future.cancelled() and future.exception() is None:
+                # 枠を割り当てられた直後にキャンセルされた
+                self.release(priority)
+            elif isinstance(e, asyncio.TimeoutError):
+                self.counters[priority]["expired"] += 1
+            raise
+
+    def release(self, priority: str = "interactive") -> None:
+        """枠を返却"""
+        self.in_use -= 1
+        self.in_use_by_class[priority] -= 1
+        self._dispatch()
+
+    def to_dict(self) -> Dict[str, Dict[str, Any]]:
+        """クラスごとの統計を辞書で取得"""
+        return {
+            name: {
+                "limit": self.limits[name],
+                "max_wait_seconds": self.max_waits[name],
+                "in_flight": self.in_use_by_class[name],
+                "queue_depth": self.queue_depth(name),
+                **self.counters[name],
+            }
+            for name in PRIORITY_CLASSES
+        }
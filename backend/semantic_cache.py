@@ -0,0 +1,341 @@
+"""近似重複キャッシュモジュール
+
+学習者の入力は "i am fine thank you" と "I'm fine, thank you." のように、大文字・小文字や
+句読点、短縮形だけが違うものが多く、プロンプトの完全一致では引けない。ここでは入力を
+正規化（小文字化・短縮形の展開・記号の除去・空白の統一）したものをキーにして、辞書から
+完全一致で引く。
+
+近似一致は、しきい値を 1.0 未満に設定した呼び出しの種類だけで使う。入力の文字 n-gram を
+ハッシュ特徴（feature hashing）のベクトルにし、保存済みのベクトルの行列とのコサイン類似度を
+NumPy でまとめて計算して、上位 top_k 件を候補にする。ただし文字 n-gram の類似度だけでは、
+"Tokyo" と "Kyoto"、"3 hours" と "5 hours" のように1語違いで意味が変わる入力まで一致してしまう。
+そのため候補は、冠詞・言いよどみ（_FILLER_WORDS）を除いた語が（順番を問わず）同じものに限る。
+語が同じ入力が1件も保存されていなければ（ミスの大半）、行列の計算はせずにミスとする。
+特徴はローカルで計算するため、外部の埋め込み API は使わない。
+NumPy は numpy パッケージがインストールされている場合のみ使う（ない場合は無効になる）。
+"""
+
+import asyncio
+import hashlib
+import re
+import threading
+import time
+import unicodedata
+import zlib
+from collections import OrderedDict, deque
+from typing import Any, Dict, List, Optional, Tuple
+
+from .limiter import _percentile
+from .shared_state import StateBackend, StateBackendError
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# 短縮形は展開してから比べる（"I'm" と "I am" を同じキーにする）
+_CONTRACTIONS = (
+    (re.compile(r"\b(can)'t\b"), r"\1 not"),
+    (re.compile(r"\bwon't\b"), "will not"),
+    (re.compile(r"n't\b"), " not"),
+    (re.compile(r"\bi'm\b"), "i am"),
+    (re.compile(r"'re\b"), " are"),
+    (re.compile(r"'ve\b"), " have"),
+    (re.compile(r"'ll\b"), " will"),
+    (re.compile(r"\b(it|that|what|there|he|she)'s\b"), r"\1 is"),
+)
+_NON_WORD_PATTERN = re.compile(r"[\W_]+")
+# 近似一致で違っていてもよい語（冠詞と言いよどみ）。これ以外の語が1つでも違えば一致させない
+_FILLER_WORDS = frozenset({"a", "an", "the", "um", "uh", "er", "erm", "ah"})
+
+
+def normalize(text: str) -> str:
+    """キャッシュのキーにする正規化（小文字化・短縮形の展開・記号の除去・空白の統一）"""
+    text = unicodedata.normalize("NFKC", text).lower().replace("’", "'")
+    for pattern, replacement in _CONTRACTIONS:
+        text = pattern.sub(replacement, text)
+    return " ".join(_NON_WORD_PATTERN.sub(" ", text).split())
+
+
+def content_words(normalized: str) -> Tuple[str, ...]:
+    """正規化済みの入力から冠詞・言いよどみを除いた語（順番は問わないため並べ替える）"""
+    return tuple(sorted(word for word in normalized.split() if word not in _FILLER_WORDS))
+
+
+def hash_features(normalized: str, dim: int, ngram_sizes: Tuple[int, ...] = (3, 4)) -> Optional["np.ndarray"]:
+    """正規化済みの入力の文字 n-gram を dim 次元に符号付きで畳み込み、L2 正規化したベクトル
+    （特徴がなければ None）"""
+    padded = f" {normalized} "
+    grams = [padded[i:i + n] for n in ngram_sizes for i in range(len(padded) - n + 1)]
+    if not grams:
+        return None
+    hashes = np.fromiter((zlib.crc32(gram.encode("utf-8")) for gram in grams), dtype=np.uint32, count=len(grams))
+    signs = np.where(hashes & 0x80000000, -1.0, 1.0).astype(np.float32)
+    vector = np.bincount(hashes % dim, weights=signs, minlength=dim).astype(np.float32)
+    norm = float(np.linalg.norm(vector))
+    if norm == 0.0:
+        return None
+    return vector / norm
+
+
+class SemanticCache:
+    """正規化後の入力の一致（と、設定した呼び出しの種類では近似一致）で回答を引くキャッシュ
+
+    ベクトルは (max_entries, dim) の float32 行列に固定領域で持つ（np.zeros で確保するため、
+    実際にメモリを使うのは書き込んだ行だけ）。満杯になると最後に使われたのが最も古いものから
+    追い出す。namespace（呼び出しの種類・プロバイダー・レベル・文脈など）が一致するものだけを
+    候補にする。正規化後の入力が一致するもの（大文字・小文字、句読点、短縮形だけの違い）は
+    辞書から引いて常に返し、近似一致は呼び出しの種類のしきい値が 1.0 未満の場合だけ、
+    行列全体との類似度の上位 top_k 件から、冠詞・言いよどみを除いた語が同じものを選ぶ。
+    shared（ワーカー間の共有状態）を指定した場合は、正規化後の入力が一致する回答を
+    他のワーカーとも共有する（近似一致はワーカーごと）。
+    """
+
+    def __init__(self, max_entries: int = 20000, dim: int = 256, ttl_seconds: float = 86400,
+                 thresholds: Optional[Dict[str, float]] = None, top_k: int = 5, window_size: int = 1000,
+                 shared: Optional[StateBackend] = None):
+        if np is None:
+            raise RuntimeError("numpy is not installed")
+        self.shared = shared
+        self.max_entries = max_entries
+        self.dim = dim
+        self.ttl_seconds = ttl_seconds
+        self.thresholds = dict(thresholds or {})
+        self.top_k = top_k
+        self._vectors = np.zeros((max_entries, dim), dtype=np.float32)
+        # 空き領域の namespace は -1
+        self._namespaces = np.full(max_entries, -1, dtype=np.int32)
+        self._created_at = np.zeros(max_entries, dtype=np.float64)
+        self._values: List[Optional[str]] = [None] * max_entries
+        # 領域ごとの (namespace の番号, 正規化後の入力) と、その逆引き
+        self._keys: List[Optional[Tuple[int, str]]] = [None] * max_entries
+        self._slots: Dict[Tuple[int, str], int] = {}
+        # (namespace の番号, 冠詞・言いよどみを除いた語) → 保存している件数
+        self._bags: Dict[Tuple[int, Tuple[str, ...]], int] = {}
+        # 使用中の領域（最後に使われた順）
+        self._lru: "OrderedDict[int, None]" = OrderedDict()
+        self._free: List[int] = []
+        self._namespace_ids: Dict[str, int] = {}
+        self._size = 0
+        self._lock = threading.Lock()
+        self._lookup_times: deque = deque(maxlen=window_size)
+        self._stats = {"hits": 0, "exact_hits": 0, "near_hits": 0, "shared_hits": 0, "misses": 0,
+                       "evictions": 0, "expirations": 0}
+
+    def _namespace_id(self, namespace: str) -> int:
+        namespace_id = self._namespace_ids.get(namespace)
+        if namespace_id is None:
+            namespace_id = self._namespace_ids[namespace] = len(self._namespace_ids)
+        return namespace_id
+
+    def threshold(self, endpoint: str) -> float:
+        """呼び出しの種類のしきい値（未設定なら 1.0 = 正規化後の一致のみ）"""
+        return self.thresholds.get(endpoint, 1.0)
+
+    def _is_live(self, slot: int, now: float) -> bool:
+        """領域が期限内かどうか（期限切れなら空きにする。ロック取得済みで呼ぶ）"""
+        if now - self._created_at[slot] <= self.ttl_seconds:
+            return True
+        self._release(slot)
+        self._free.append(slot)
+        self._stats["expirations"] += 1
+        return False
+
+    def _release(self, slot: int) -> None:
+        """領域の回答と逆引きを消す（ロック取得済みで呼ぶ）"""
+        key = self._keys[slot]
+        if key is not None:
+            if self._slots.get(key) == slot:
+                del self._slots[key]
+            bag = (key[0], content_words(key[1]))
+            if self._bags.get(bag, 0) > 1:
+                self._bags[bag] -= 1
+            else:
+                self._bags.pop(bag, None)
+        self._lru.pop(slot, None)
+        self._namespaces[slot] = -1
+        self._keys[slot] = self._values[slot] = None
+
+    def _hit(self, slot: int, exact: bool, start: float) -> str:
+        """ヒットを数えて回答を返す（ロック取得済みで呼ぶ）"""
+        self._stats["hits"] += 1
+        self._stats["exact_hits" if exact else "near_hits"] += 1
+        self._lru.move_to_end(slot)
+        self._lookup_times.append(time.perf_counter() - start)
+        return self._values[slot]
+
+    def _candidates(self, vector: "np.ndarray", namespace_id: int, threshold: float) -> List[int]:
+        """類似度がしきい値以上の上位 top_k 件の領域（類似度の高い順）
+
+        行列全体との内積をまとめて計算する。ロックは取らないため、書き込み中の行の値が
+        混ざることがある。返した候補は _get_near がロックを取ってから確かめ直す。
+        """
+        size = self._size
+        if size == 0:
+            return []
+        scores = self._vectors[:size] @ vector
+        scores[self._namespaces[:size] != namespace_id] = -1.0
+        k = min(self.top_k, size)
+        top = np.argpartition(scores, size - k)[size - k:]
+        top = top[np.argsort(scores[top])[::-1]]
+        return [int(slot) for slot in top if scores[slot] >= threshold]
+
+    def _get_exact(self, normalized: str, namespace: str, start: float) -> Optional[str]:
+        """正規化後の入力が一致する回答を取得"""
+        now = time.time()
+        with self._lock:
+            namespace_id = self._namespace_ids.get(namespace)
+            if namespace_id is None:
+                return None
+            slot = self._slots.get((namespace_id, normalized))
+            if slot is None or not self._is_live(slot, now):
+                return None
+            return self._hit(slot, True, start)
+
+    def _get_near(self, normalized: str, namespace: str, endpoint: str, start: float) -> Optional[str]:
+        """しきい値以上の近似一致のうち、冠詞・言いよどみを除いた語が同じ回答を取得"""
+        threshold = self.threshold(endpoint)
+        if not self._may_have_near(normalized, namespace, endpoint):
+            return None
+        namespace_id = self._namespace_ids[namespace]
+        words = content_words(normalized)
+        vector = hash_features(normalized, self.dim)
+        if vector is None:
+            return None
+        candidates = self._candidates(vector, namespace_id, threshold)
+        now = time.time()
+        with self._lock:
+            for slot in candidates:
+                key = self._keys[slot]
+                if (key is None or key[0] != namespace_id or content_words(key[1]) != words
+                        or float(self._vectors[slot] @ vector) < threshold or not self._is_live(slot, now)):
+                    continue
+                return self._hit(slot, False, start)
+        return None
+
+    def _may_have_near(self, normalized: str, namespace: str, endpoint: str) -> bool:
+        """近似一致の候補（冠詞・言いよどみを除いた語が同じ入力）が保存されているかどうか"""
+        namespace_id = self._namespace_ids.get(namespace)
+        return (self.threshold(endpoint) < 1.0 and namespace_id is not None
+                and (namespace_id, content_words(normalized)) in self._bags)
+
+    def get(self, text: str, namespace: str, endpoint: str) -> Optional[str]:
+        """正規化後の入力が一致する回答、なければ endpoint のしきい値以上の近似一致の回答を取得
+        （なければ None）"""
+        start = time.perf_counter()
+        normalized = normalize(text)
+        if not normalized:
+            return self._finish_get(text, namespace, None, start)
+        value = self._get_exact(normalized, namespace, start)
+        if value is None:
+            value = self._get_near(normalized, namespace, endpoint, start)
+        if value is not None:
+            return value
+        if self.shared is not None:
+            try:
+                value = self.shared.run(self.shared.get, self._shared_key(normalized, namespace))
+            except StateBackendError as e:
+                print(f"Shared semantic cache read error: {e}")
+        return self._finish_get(text, namespace, value, start)
+
+    async def aget(self, text: str, namespace: str, endpoint: str) -> Optional[str]:
+        """get と同じ（近似一致の検索と共有状態の読み込みはイベントループの外で行う）"""
+        start = time.perf_counter()
+        normalized = normalize(text)
+        if not normalized:
+            return self._finish_get(text, namespace, None, start)
+        value = self._get_exact(normalized, namespace, start)
+        if value is None and self._may_have_near(normalized, namespace, endpoint):
+            value = await asyncio.get_running_loop().run_in_executor(
+                None, self._get_near, normalized, namespace, endpoint, start)
+        if value is not None:
+            return value
+        if self.shared is not None:
+            try:
+                value = await self.shared.arun(self.shared.get, self._shared_key(normalized, namespace))
+            except StateBackendError as e:
+                print(f"Shared semantic cache read error: {e}")
+        return self._finish_get(text, namespace, value, start)
+
+    def _finish_get(self, text: str, namespace: str, value: Optional[str], start: float) -> Optional[str]:
+        """共有状態から引いた回答をこのワーカーにも保存する（なければミスとして数える）"""
+        if value is not None:
+            self.set(text, namespace, value, share=False)
+        with self._lock:
+            if value is None:
+                self._stats["misses"] += 1
+            else:
+                self._stats["hits"] += 1
+                self._stats["shared_hits"] += 1
+            self._lookup_times.append(time.perf_counter() - start)
+        return value
+
+    @staticmethod
+    def _shared_key(normalized: str, namespace: str) -> str:
+        digest = hashlib.sha256(f"{namespace}\0{normalized}".encode("utf-8")).hexdigest()
+        return f"semantic:{digest}"
+
+    def set(self, text: str, namespace: str, value: str, share: bool = True) -> None:
+        """回答を保存（満杯なら最後に使われたのが最も古いものを追い出す）
+
+        share が True で shared を指定している場合は、共有状態にも保存する（書き込みは待たない）。
+        """
+        normalized = normalize(text)
+        vector = hash_features(normalized, self.dim)
+        if vector is None:
+            return
+        if share and self.shared is not None:
+            self.shared.submit(self.shared.set, self._shared_key(normalized, namespace), value, self.ttl_seconds)
+        now = time.time()
+        with self._lock:
+            key = (self._namespace_id(namespace), normalized)
+            slot = self._slots.get(key)
+            if slot is None:
+                if self._free:
+                    slot = self._free.pop()
+                elif self._size < self.max_entries:
+                    slot = self._size
+                    self._size += 1
+                else:
+                    slot = next(iter(self._lru))
+                    self._release(slot)
+                    self._stats["evictions"] += 1
+            self._vectors[slot] = vector
+            self._namespaces[slot] = key[0]
+            self._created_at[slot] = now
+            self._values[slot] = value
+            self._keys[slot] = key
+            if self._slots.get(key) != slot:
+                bag = (key[0], content_words(normalized))
+                self._bags[bag] = self._bags.get(bag, 0) + 1
+            self._slots[key] = slot
+            self._lru[slot] = None
+            self._lru.move_to_end(slot)
+
+    def clear(self) -> None:
+        """キャッシュを全て削除"""
+        with self._lock:
+            self._namespaces[:] = -1
+            self._values = [None] * self.max_entries
+            self._keys = [None] * self.max_entries
+            self._slots.clear()
+            self._bags.clear()
+            self._lru.clear()
+            self._free.clear()
+            self._size = 0
+
+    def get_stats(self) -> Dict[str, Any]:
+        """ヒット・ミス・追い出しの統計と検索時間（ミリ秒）を取得"""
+        with self._lock:
+            stats: Dict[str, Any] = dict(self._stats)
+            stats["size"] = len(self._slots)
+            lookup_times = list(self._lookup_times)
+        stats["max_entries"] = self.max_entries
+        stats["dim"] = self.dim
+        stats["top_k"] = self.top_k
+        stats["thresholds"] = dict(self.thresholds)
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = stats["hits"] / lookups if lookups else 0.0
+        stats["lookup_p50_ms"] = round(_percentile(lookup_times, 50) * 1000, 3)
+        stats["lookup_p99_ms"] = round(_percentile(lookup_times, 99) * 1000, 3)
+        return stats
@@ -0,0 +1,391 @@
+"""会話セッション管理モジュール"""
+
+import json
+import sqlite3
+import threading
+import time
+import uuid
+from collections import OrderedDict, deque
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional
+
+from .shared_state import StateBackend, StateBackendError
+
+# 要約を作っているワーカーが落ちても、この秒数が過ぎれば他のワーカーが要約を作り直せる
+SUMMARY_LOCK_SECONDS = 120
+
+
+class ConversationSession:
+    """1つの会話セッションの状態を保持するクラス"""
+
+    def __init__(self, session_id: str, max_turns: int):
+        self.session_id = session_id
+        self.turns: deque = deque(maxlen=max_turns)
+        self.next_seq = 0
+        self.updated_at = time.time()
+        # 古いターンを畳み込んだ要約と、要約に含めた最後のターン番号
+        self.summary = ""
+        self.summary_seq = -1
+        self.summarizing = False
+        # セッションで選択されたプロバイダー（None ならデフォルト）
+        self.provider: Optional[str] = None
+
+    def add_turn(self, role: str, content: str) -> Dict:
+        """ターンを追加（上限を超えた古いターンはリングバッファから落ちる）"""
+        turn = {"seq": self.next_seq, "role": role, "content": content}
+        self.turns.append(turn)
+        self.next_seq += 1
+        self.updated_at = time.time()
+        return turn
+
+    def get_history(self) -> List[Dict]:
+        """プロバイダーに渡せる形式の履歴を取得"""
+        return [{"role": turn["role"], "content": turn["content"]} for turn in self.turns]
+
+    def get_turns(self) -> List[Dict]:
+        """ターン番号付きの履歴を取得"""
+        return list(self.turns)
+
+    def to_dict(self) -> Dict[str, Any]:
+        """共有状態に保存する形式に変換（summarizing はワーカーごとの状態なので含めない）"""
+        return {
+            "turns": list(self.turns),
+            "next_seq": self.next_seq,
+            "updated_at": self.updated_at,
+            "summary": self.summary,
+            "summary_seq": self.summary_seq,
+            "provider": self.provider,
+        }
+
+    def update_from(self, data: Dict[str, Any]) -> None:
+        """共有状態に保存された内容で置き換える"""
+        self.turns.clear()
+        self.turns.extend(data.get("turns", []))
+        self.next_seq = data.get("next_seq", 0)
+        self.updated_at = data.get("updated_at", time.time())
+        self.summary = data.get("summary", "")
+        self.summary_seq = data.get("summary_seq", -1)
+        self.provider = data.get("provider")
+
+
+class SessionStore:
+    """会話セッションをサーバー側で保持するストア
+
+    セッションごとに直近 max_turns 件のターンをリングバッファで保持する。
+    db_path を指定した場合は SQLite にも書き込み、再起動後やメモリから
+    追い出された後でも履歴を復元できる。shared（ワーカー間の共有状態）を指定した場合は
+    セッションを JSON で共有状態にも書き込み、取得のたびに共有状態の内容を正とする。
+    これにより、同じセッションの次の要求が別のワーカーに届いても続きから会話できる。
+    共有状態のセッションの更新は保存先の update で読み出しから書き込みまでをアトミックに行い、
+    複数のワーカーが同じセッションに同時に書き込んでもターンを失わない。
+    共有状態は呼び出し元のスレッドで待つため、イベントループ上からは executor 経由で呼ぶ。
+    """
+
+    def __init__(self, max_turns: int = 20, ttl_seconds: float = 21600,
+                 max_sessions: int = 10000, db_path: Optional[str] = None,
+                 shared: Optional[StateBackend] = None):
+        self.shared = shared
+        self.shared_errors = 0
+        self.max_turns = max_turns
+        self.ttl_seconds = ttl_seconds
+        self.max_sessions = max_sessions
+        self._sessions: "OrderedDict[str, ConversationSession]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._db: Optional[sqlite3.Connection] = None
+        if db_path:
+            self._db = self._open_db(db_path)
+
+    def _open_db(self, db_path: str) -> sqlite3.Connection:
+        """セッション保存用のデータベースを開く"""
+        path = Path(db_path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        db = sqlite3.connect(str(path), check_same_thread=False)
+        db.execute(
+            "CREATE TABLE IF NOT EXISTS session_turns ("
+            "session_id TEXT NOT NULL, seq INTEGER NOT NULL, role TEXT NOT NULL, "
+            "content TEXT NOT NULL, created_at REAL NOT NULL, PRIMARY KEY (session_id, seq))"
+        )
+        db.execute(
+            "CREATE TABLE IF NOT EXISTS session_summaries ("
+            "session_id TEXT PRIMARY KEY, summary TEXT NOT NULL, summary_seq INTEGER NOT NULL)"
+        )
+        # ターンのないセッションも復元できるよう、作成時に1行書く（選択中のプロバイダーもここに持つ）
+        db.execute(
+            "CREATE TABLE IF NOT EXISTS sessions ("
+            "session_id TEXT PRIMARY KEY, provider TEXT, updated_at REAL NOT NULL)"
+        )
+        db.execute("DELETE FROM session_turns WHERE created_at < ?", (time.time() - self.ttl_seconds,))
+        db.execute("DELETE FROM sessions WHERE updated_at < ?", (time.time() - self.ttl_seconds,))
+        db.execute("DELETE FROM session_summaries WHERE session_id NOT IN (SELECT session_id FROM session_turns)")
+        db.commit()
+        return db
+
+    def create(self) -> str:
+        """新しいセッションを作成し、セッションIDを返す"""
+        session_id = uuid.uuid4().hex
+        session = ConversationSession(session_id, self.max_turns)
+        with self._lock:
+            self._store(session)
+            if self._db is not None:
+                self._save_row(session)
+                self._db.commit()
+        self._save(session)
+        return session_id
+
+    def get(self, session_id: str) -> Optional[ConversationSession]:
+        """セッションを取得（存在しない・期限切れなら None）"""
+        data = self._get_shared(session_id)
+        with self._lock:
+            if data is not None:
+                return self._refresh(session_id, data)
+            session = self._sessions.get(session_id)
+            if session is not None:
+                if time.time() - session.updated_at <= self.ttl_seconds:
+                    self._sessions.move_to_end(session_id)
+                    return session
+                del self._sessions[session_id]
+            session = self._load(session_id)
+            if session is not None:
+                self._store(session)
+            return session
+
+    def get_or_create(self, session_id: Optional[str]) -> str:
+        """セッションIDが有効ならそのまま、無効なら新規作成して返す"""
+        if session_id and self.get(session_id) is not None:
+            return session_id
+        return self.create()
+
+    def get_history(self, session_id: str) -> List[Dict]:
+        """セッションの会話履歴を取得"""
+        session = self.get(session_id)
+        return session.get_history() if session else []
+
+    def append_turn(self, session_id: str, user_message: str, assistant_message: str) -> None:
+        """学生のメッセージと先生の回答を1往復分として記録"""
+        def change(session: ConversationSession) -> None:
+            session.add_turn("user", user_message)
+            session.add_turn("assistant", assistant_message)
+
+        data = self._update_shared(session_id, change)
+        with self._lock:
+            session = self._apply(session_id, change, data)
+            turns = session.get_turns()[-2:]
+            if self._db is not None:
+                self._db.executemany(
+                    "INSERT OR REPLACE INTO session_turns (session_id, seq, role, content, created_at) "
+                    "VALUES (?, ?, ?, ?, ?)",
+                    [(session_id, t["seq"], t["role"], t["content"], session.updated_at) for t in turns],
+                )
+                # リングバッファから落ちたターンは保存しない
+                self._db.execute(
+                    "DELETE FROM session_turns WHERE session_id = ? AND seq < ?",
+                    (session_id, session.next_seq - self.max_turns),
+                )
+                self._save_row(session)
+                self._db.commit()
+
+    def set_provider(self, session_id: str, provider: str) -> None:
+        """セッションで使うプロバイダーを設定"""
+        def change(session: ConversationSession) -> None:
+            session.provider = provider
+            session.updated_at = time.time()
+
+        data = self._update_shared(session_id, change)
+        with self._lock:
+            session = self._apply(session_id, change, data)
+            if self._db is not None:
+                self._save_row(session)
+                self._db.commit()
+
+    def set_summary(self, session_id: str, summary: str, summary_seq: int) -> None:
+        """セッションの要約を更新（より新しいターンまで畳み込んだ要約が既にあれば何もしない）"""
+        def change(session: ConversationSession) -> None:
+            if summary_seq > session.summary_seq:
+                session.summary = summary
+                session.summary_seq = summary_seq
+
+        with self._lock:
+            if session_id not in self._sessions:
+                return
+        data = self._update_shared(session_id, change)
+        with self._lock:
+            session = self._apply(session_id, change, data)
+            if self._db is not None and session.summary_seq == summary_seq:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO session_summaries (session_id, summary, summary_seq) VALUES (?, ?, ?)",
+                    (session_id, session.summary, summary_seq),
+                )
+                self._db.commit()
+
+    def begin_summary(self, session_id: str) -> bool:
+        """セッションの要約の更新を始めてよければ True を返す
+
+        同じセッションの要約を、このワーカーの別のタスクや他のワーカーが作っている間は False。
+        共有状態では incr で最初に数えたワーカーだけが作る（落ちても SUMMARY_LOCK_SECONDS で外れる）。
+        True を返した場合は、終わったら end_summary を呼ぶ。
+        """
+        with self._lock:
+            session = self._sessions.get(session_id)
+            if session is None or session.summarizing:
+                return False
+            session.summarizing = True
+        if self.shared is None:
+            return True
+        try:
+            if self.shared.run(self.shared.incr, f"summarizing:{session_id}", 1, SUMMARY_LOCK_SECONDS) == 1:
+                return True
+        except StateBackendError as e:
+            # 共有状態が使えなければ、このワーカーの中だけで重複を防いで続ける
+            self.shared_errors += 1
+            print(f"Shared summary lock error: {e}")
+            return True
+        with self._lock:
+            session.summarizing = False
+        return False
+
+    def end_summary(self, session_id: str) -> None:
+        """begin_summary で始めた要約の更新を終える"""
+        with self._lock:
+            session = self._sessions.get(session_id)
+            if session is not None:
+                session.summarizing = False
+        if self.shared is not None:
+            self.shared.submit(self.shared.delete, f"summarizing:{session_id}")
+
+    def count(self) -> int:
+        """メモリ上のセッション数を取得"""
+        with self._lock:
+            return len(self._sessions)
+
+    def delete(self, session_id: str) -> None:
+        """セッションを削除"""
+        with self._lock:
+            self._sessions.pop(session_id, None)
+            if self._db is not None:
+                self._db.execute("DELETE FROM session_turns WHERE session_id = ?", (session_id,))
+                self._db.execute("DELETE FROM session_summaries WHERE session_id = ?", (session_id,))
+                self._db.execute("DELETE FROM sessions WHERE session_id = ?", (session_id,))
+                self._db.commit()
+        if self.shared is not None:
+            self.shared.submit(self.shared.delete, f"session:{session_id}")
+
+    def _get_shared(self, session_id: str) -> Optional[Dict[str, Any]]:
+        """共有状態に保存されたセッション（共有しない・存在しない・読めない場合は None）"""
+        if self.shared is None:
+            return None
+        try:
+            value = self.shared.run(self.shared.get, f"session:{session_id}")
+            return json.loads(value) if value is not None else None
+        except (StateBackendError, ValueError) as e:
+            self.shared_errors += 1
+            print(f"Shared session read error: {e}")
+            return None
+
+    def _update_shared(self, session_id: str,
+                       change: Callable[[ConversationSession], None]) -> Optional[Dict[str, Any]]:
+        """共有状態のセッションに change をアトミックに適用し、適用後の内容を返す
+
+        読んでから書くまでの間に他のワーカーが書き込んでも失われないよう、保存先の update
+        （SQLite は BEGIN IMMEDIATE、Redis は WATCH / MULTI）の中で適用する。
+        共有しない・書き込めない場合は None を返す。
+        """
+        if self.shared is None:
+            return None
+        with self._lock:
+            # 共有状態にない（期限切れ・書き込めなかった）セッションは、このワーカーの内容から始める
+            base = self._current(session_id).to_dict()
+
+        def update(value: Optional[str]) -> str:
+            session = ConversationSession(session_id, self.max_turns)
+            session.update_from(json.loads(value) if value is not None else base)
+            change(session)
+            return json.dumps(session.to_dict(), ensure_ascii=False)
+
+        try:
+            return json.loads(self.shared.run(self.shared.update, f"session:{session_id}", update,
+                                              self.ttl_seconds))
+        except (StateBackendError, ValueError) as e:
+            self.shared_errors += 1
+            print(f"Shared session write error: {e}")
+            return None
+
+    def _apply(self, session_id: str, change: Callable[[ConversationSession], None],
+               data: Optional[Dict[str, Any]]) -> ConversationSession:
+        """共有状態に適用した内容があればそれに合わせ、なければメモリ上のセッションに change を適用する（ロック取得済みで呼ぶ）"""
+        if data is not None:
+            return self._refresh(session_id, data)
+        session = self._current(session_id)
+        change(session)
+        return session
+
+    def _save(self, session: ConversationSession) -> None:
+        """セッションを共有状態に書き込む（待たない。書き込めなくてもこのワーカーでは続けられる）"""
+        if self.shared is None:
+            return
+        self.shared.submit(self.shared.set, f"session:{session.session_id}",
+                           json.dumps(session.to_dict(), ensure_ascii=False), self.ttl_seconds)
+
+    def _refresh(self, session_id: str, data: Dict[str, Any]) -> ConversationSession:
+        """メモリ上のセッションを共有状態の内容に合わせる（ロック取得済みで呼ぶ）"""
+        session = self._sessions.get(session_id)
+        if session is None:
+            session = ConversationSession(session_id, self.max_turns)
+        session.update_from(data)
+        self._store(session)
+        return session
+
+    def _current(self, session_id: str) -> ConversationSession:
+        """更新対象のセッション（なければ復元または新規作成。ロック取得済みで呼ぶ）"""
+        session = self._sessions.get(session_id)
+        if session is None:
+            session = self._load(session_id) or ConversationSession(session_id, self.max_turns)
+            self._store(session)
+        return session
+
+    def _store(self, session: ConversationSession) -> None:
+        """メモリにセッションを置き、上限を超えたら古いものから追い出す（ロック取得済みで呼ぶ）"""
+        self._sessions[session.session_id] = session
+        self._sessions.move_to_end(session.session_id)
+        while len(self._sessions) > self.max_sessions:
+            self._sessions.popitem(last=False)
+
+    def _save_row(self, session: ConversationSession) -> None:
+        """セッションの行（選択中のプロバイダーと最終更新時刻）を書く（ロック取得済みで呼ぶ。commit は呼び出し側）"""
+        self._db.execute(
+            "INSERT OR REPLACE INTO sessions (session_id, provider, updated_at) VALUES (?, ?, ?)",
+            (session.session_id, session.provider, session.updated_at),
+        )
+
+    def _load(self, session_id: str) -> Optional[ConversationSession]:
+        """データベースからセッションを復元（ロック取得済みで呼ぶ）"""
+        if self._db is None:
+            return None
+        cutoff = time.time() - self.ttl_seconds
+        session_row = self._db.execute(
+            "SELECT provider, updated_at FROM sessions WHERE session_id = ? AND updated_at >= ?",
+            (session_id, cutoff),
+        ).fetchone()
+        rows = self._db.execute(
+            "SELECT seq, role, content, created_at FROM session_turns "
+            "WHERE session_id = ? AND created_at >= ? ORDER BY seq",
+            (session_id, cutoff),
+        ).fetchall()
+        if not rows and session_row is None:
+            return None
+        session = ConversationSession(session_id, self.max_turns)
+        for seq, role, content, created_at in rows:
+            session.turns.append({"seq": seq, "role": role, "content": content})
+        # 最終更新時刻は、最後のターンとセッションの行のうち新しい方
+        updated = [rows[-1][3]] if rows else []
+        if session_row is not None:
+            session.provider = session_row[0]
+            updated.append(session_row[1])
+        session.updated_at = max(updated)
+        if rows:
+            session.next_seq = rows[-1][0] + 1
+        summary_row = self._db.execute(
+            "SELECT summary, summary_seq FROM session_summaries WHERE session_id = ?", (session_id,)
+        ).fetchone()
+        if summary_row is not None:
+            session.summary, session.summary_seq = summary_row
+        return session
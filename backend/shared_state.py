@@ -0,0 +1,480 @@
+"""ワーカー間で共有する状態の保存先モジュール
+
+本番モードではワーカーごとに別プロセスになるため、キャッシュ・セッション・流量制限の
+状態をプロセス内に持つと、キャッシュのヒット率はワーカー数分の1に下がり、プロバイダーの
+呼び出しレートはワーカー数倍に増える。ここではキーと文字列の値を TTL 付きで保存する
+共通のインターフェース（StateBackend）と、その3つの実装を提供する。
+
+- MemoryBackend: プロセス内の辞書（共有しない。開発モード・ワーカー1つの場合）
+- SQLiteBackend: 同じホストのワーカーで1つの SQLite ファイルを WAL モードで共有する
+- RedisBackend: Redis プロトコル（RESP）で話す最小限のクライアント（複数ホストで共有する）
+
+get / set などは保存先と同期的に通信する。呼び出し側は run（同期）/ arun（イベントループ上）/
+submit（書き込みを待たない）を通して保存先ごとの専用スレッドで実行し、1回の操作を
+call_timeout 秒までしか待たない。これにより SQLite のロック待ちや Redis の応答遅れで
+イベントループが止まることはない。保存先の障害と時間切れは StateBackendError として送出し、
+呼び出し側はプロセス内の状態だけで処理を続ける。
+"""
+
+import asyncio
+import concurrent.futures
+import os
+import random
+import socket
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Mapping, Optional
+
+
+class StateBackendError(Exception):
+    """共有状態の保存先に読み書きできない"""
+
+
+class StateBackend:
+    """共有状態の保存先のインターフェース
+
+    値は文字列で、ttl_seconds を指定したキーはその秒数で消える。incr は整数として
+    アトミックに加算する（キーがなければ 0 から）。update は値の読み出しから書き込みまでを
+    アトミックに行う（他のワーカーの書き込みと交互にならない）。shared が False の実装は
+    プロセス内だけで使われ、キャッシュやセッションの2段目には使わない。
+
+    操作は保存先ごとに1本の専用スレッドで順番に実行する（待たずに書き込んだ値も、
+    その後に読めば反映されている）。実行待ちが max_pending 件を超えた場合は、
+    保存先が詰まっているとみなして新しい操作をすぐに失敗させる。
+    """
+
+    name = ""
+    shared = True
+    max_pending = 64
+
+    def __init__(self, call_timeout: float = 0.05):
+        self.call_timeout = call_timeout
+        self.write_errors = 0
+        self._executor: Optional[concurrent.futures.ThreadPoolExecutor] = None
+        self._executor_pid = 0
+        self._pending = 0
+        self._pending_lock = threading.Lock()
+
+    def _submit(self, func: Callable, *args: Any) -> concurrent.futures.Future:
+        """func(*args) を専用スレッドで開始（実行待ちが多すぎれば StateBackendError）"""
+        with self._pending_lock:
+            # fork 後は親プロセスのスレッドがないため作り直す
+            if self._executor is None or self._executor_pid != os.getpid():
+                self._executor = concurrent.futures.ThreadPoolExecutor(
+                    max_workers=1, thread_name_prefix=f"shared-state-{self.name}")
+                self._executor_pid = os.getpid()
+                self._pending = 0
+            if self._pending >= self.max_pending:
+                raise StateBackendError(f"{self.name}: {self._pending} operations pending")
+            self._pending += 1
+            future = self._executor.submit(func, *args)
+        future.add_done_callback(self._finished)
+        return future
+
+    def _finished(self, future: concurrent.futures.Future) -> None:
+        with self._pending_lock:
+            self._pending -= 1
+
+    def _timeout_error(self) -> StateBackendError:
+        return StateBackendError(f"{self.name}: no reply within {self.call_timeout * 1000:.0f}ms")
+
+    def run(self, func: Callable, *args: Any) -> Any:
+        """保存先の操作 func(*args) を call_timeout 秒まで待って実行（同期的な呼び出し元用）"""
+        if not self.shared:
+            return func(*args)
+        try:
+            return self._submit(func, *args).result(self.call_timeout)
+        except concurrent.futures.TimeoutError:
+            raise self._timeout_error() from None
+
+    async def arun(self, func: Callable, *args: Any) -> Any:
+        """保存先の操作 func(*args) を、イベントループを止めずに call_timeout 秒まで待って実行"""
+        if not self.shared:
+            return func(*args)
+        try:
+            return await asyncio.wait_for(asyncio.wrap_future(self._submit(func, *args)), self.call_timeout)
+        except asyncio.TimeoutError:
+            raise self._timeout_error() from None
+
+    def submit(self, func: Callable, *args: Any) -> None:
+        """保存先への書き込み func(*args) を待たずに実行（失敗は write_errors に数えて記録する）"""
+        if not self.shared:
+            func(*args)
+            return
+        try:
+            self._submit(func, *args).add_done_callback(self._check_write)
+        except StateBackendError as e:
+            self._write_failed(e)
+
+    def _check_write(self, future: concurrent.futures.Future) -> None:
+        if not future.cancelled() and isinstance(future.exception(), StateBackendError):
+            self._write_failed(future.exception())
+
+    def _write_failed(self, error: StateBackendError) -> None:
+        self.write_errors += 1
+        print(f"Shared state write error ({self.name}): {error}")
+
+    def get(self, key: str) -> Optional[str]:
+        raise NotImplementedError
+
+    def set(self, key: str, value: str, ttl_seconds: Optional[float] = None) -> None:
+        raise NotImplementedError
+
+    def delete(self, key: str) -> None:
+        raise NotImplementedError
+
+    def incr(self, key: str, amount: int = 1, ttl_seconds: Optional[float] = None) -> int:
+        """加算後の値を返す（ttl_seconds はキーを新しく作ったときだけ設定する）"""
+        raise NotImplementedError
+
+    def update(self, key: str, func: Callable[[Optional[str]], str], ttl_seconds: Optional[float] = None) -> str:
+        """今の値（なければ None）を func で書き換えて保存し、新しい値を返す
+
+        func が例外を送出した場合は何も書かずにその例外を送出する。
+        """
+        raise NotImplementedError
+
+    def close(self) -> None:
+        """実行待ちの操作を終えてから専用スレッドを止める"""
+        if self._executor is not None and self._executor_pid == os.getpid():
+            self._executor.shutdown(wait=True)
+            self._executor = None
+
+
+class MemoryBackend(StateBackend):
+    """プロセス内の辞書に保存する実装"""
+
+    name = "memory"
+    shared = False
+
+    def __init__(self):
+        super().__init__()
+        # キー → (値, 期限の時刻。None なら無期限)
+        self._entries: Dict[str, tuple] = {}
+        self._lock = threading.Lock()
+
+    def _live(self, key: str, now: float) -> Optional[tuple]:
+        """期限内のエントリ（ロック取得済みで呼ぶ）"""
+        entry = self._entries.get(key)
+        if entry is not None and entry[1] is not None and entry[1] <= now:
+            del self._entries[key]
+            return None
+        return entry
+
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            entry = self._live(key, time.time())
+        return entry[0] if entry else None
+
+    def set(self, key: str, value: str, ttl_seconds: Optional[float] = None) -> None:
+        with self._lock:
+            self._entries[key] = (value, time.time() + ttl_seconds if ttl_seconds else None)
+
+    def delete(self, key: str) -> None:
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def incr(self, key: str, amount: int = 1, ttl_seconds: Optional[float] = None) -> int:
+        now = time.time()
+        with self._lock:
+            entry = self._live(key, now)
+            if entry is None:
+                entry = ("0", now + ttl_seconds if ttl_seconds else None)
+            value = int(entry[0]) + amount
+            self._entries[key] = (str(value), entry[1])
+        return value
+
+    def update(self, key: str, func: Callable[[Optional[str]], str], ttl_seconds: Optional[float] = None) -> str:
+        with self._lock:
+            now = time.time()
+            entry = self._live(key, now)
+            value = func(entry[0] if entry else None)
+            self._entries[key] = (value, now + ttl_seconds if ttl_seconds else None)
+        return value
+
+
+class SQLiteBackend(StateBackend):
+    """1つの SQLite ファイルを同じホストのワーカーで共有する実装
+
+    WAL モードで開くため、読み出しは他のワーカーの書き込みを待たない。
+    期限切れの行は読み出し時に無視し、書き込み時にまとめて消す。
+    """
+
+    name = "sqlite"
+
+    def __init__(self, path: str, busy_timeout_ms: int = 5000, cleanup_interval: float = 60,
+                 call_timeout: float = 0.05):
+        super().__init__(call_timeout)
+        db_path = Path(path)
+        if not db_path.is_absolute():
+            db_path = Path(__file__).resolve().parent.parent / db_path
+        self.path = str(db_path)
+        self.cleanup_interval = cleanup_interval
+        self._cleaned_at = 0.0
+        self._lock = threading.Lock()
+        try:
+            db_path.parent.mkdir(parents=True, exist_ok=True)
+            self._db = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None,
+                                       timeout=busy_timeout_ms / 1000)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("PRAGMA synchronous=NORMAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS shared_state ("
+                "key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL)"
+            )
+        except (OSError, sqlite3.Error) as e:
+            raise StateBackendError(f"cannot open {self.path}: {e}") from e
+
+    def _execute(self, sql: str, params: tuple = ()) -> List[tuple]:
+        try:
+            with self._lock:
+                return self._db.execute(sql, params).fetchall()
+        except sqlite3.Error as e:
+            raise StateBackendError(str(e)) from e
+
+    def _cleanup(self, now: float) -> None:
+        if now - self._cleaned_at >= self.cleanup_interval:
+            self._cleaned_at = now
+            self._execute("DELETE FROM shared_state WHERE expires_at <= ?", (now,))
+
+    def get(self, key: str) -> Optional[str]:
+        rows = self._execute(
+            "SELECT value FROM shared_state WHERE key = ? AND (expires_at IS NULL OR expires_at > ?)",
+            (key, time.time()),
+        )
+        return rows[0][0] if rows else None
+
+    def set(self, key: str, value: str, ttl_seconds: Optional[float] = None) -> None:
+        now = time.time()
+        self._execute(
+            "INSERT OR REPLACE INTO shared_state (key, value, expires_at) VALUES (?, ?, ?)",
+            (key, value, now + ttl_seconds if ttl_seconds else None),
+        )
+        self._cleanup(now)
+
+    def delete(self, key: str) -> None:
+        self._execute("DELETE FROM shared_state WHERE key = ?", (key,))
+
+    def incr(self, key: str, amount: int = 1, ttl_seconds: Optional[float] = None) -> int:
+        now = time.time()
+        expires_at = now + ttl_seconds if ttl_seconds else None
+        # 期限切れの行は 0 からやり直す（1文で行うため、他のワーカーと競合しない）
+        rows = self._execute(
+            "INSERT INTO shared_state (key, value, expires_at) VALUES (?, ?, ?) "
+            "ON CONFLICT(key) DO UPDATE SET "
+            "value = CASE WHEN expires_at IS NOT NULL AND expires_at <= ? THEN excluded.value "
+            "ELSE CAST(value AS INTEGER) + ? END, "
+            "expires_at = CASE WHEN expires_at IS NOT NULL AND expires_at <= ? THEN excluded.expires_at "
+            "ELSE expires_at END "
+            "RETURNING value",
+            (key, str(amount), expires_at, now, amount, now),
+        )
+        return int(rows[0][0])
+
+    def update(self, key: str, func: Callable[[Optional[str]], str], ttl_seconds: Optional[float] = None) -> str:
+        # BEGIN IMMEDIATE で書き込みロックを先に取り、他のワーカーの update と交互にならないようにする
+        now = time.time()
+        try:
+            with self._lock:
+                self._db.execute("BEGIN IMMEDIATE")
+                try:
+                    rows = self._db.execute(
+                        "SELECT value FROM shared_state WHERE key = ? AND (expires_at IS NULL OR expires_at > ?)",
+                        (key, now),
+                    ).fetchall()
+                    value = func(rows[0][0] if rows else None)
+                    self._db.execute(
+                        "INSERT OR REPLACE INTO shared_state (key, value, expires_at) VALUES (?, ?, ?)",
+                        (key, value, now + ttl_seconds if ttl_seconds else None),
+                    )
+                    self._db.execute("COMMIT")
+                except BaseException:
+                    self._db.execute("ROLLBACK")
+                    raise
+        except sqlite3.Error as e:
+            raise StateBackendError(str(e)) from e
+        return value
+
+    def close(self) -> None:
+        super().close()
+        with self._lock:
+            self._db.close()
+
+
+class RedisBackend(StateBackend):
+    """Redis プロトコル（RESP2）で話す最小限のクライアント
+
+    使うコマンドは GET / SET（PX 付き）/ DEL / INCRBY / PEXPIRE（NX 付き）/ AUTH / SELECT と、
+    update 用の WATCH / UNWATCH / MULTI / EXEC だけで、1本の接続をロックで順番に使う。
+    fork 後や接続が切れた後は次の操作で接続し直す。
+    """
+
+    name = "redis"
+    # update で、WATCH したキーを他のワーカーに書き換えられたときにやり直す回数
+    max_update_attempts = 10
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 6379, db: int = 0,
+                 password: str = "", timeout_seconds: float = 1.0, call_timeout: float = 0.05):
+        super().__init__(call_timeout)
+        self.host = host
+        self.port = port
+        self.db = db
+        self.password = password
+        self.timeout_seconds = timeout_seconds
+        self._sock: Optional[socket.socket] = None
+        self._reader = None
+        self._pid = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _encode(args: tuple) -> bytes:
+        parts = [b"*%d\r\n" % len(args)]
+        for arg in args:
+            data = arg if isinstance(arg, bytes) else str(arg).encode("utf-8")
+            parts.append(b"$%d\r\n%s\r\n" % (len(data), data))
+        return b"".join(parts)
+
+    def _read_reply(self) -> Any:
+        line = self._reader.readline()
+        if not line.endswith(b"\r\n"):
+            raise ConnectionError("connection closed")
+        kind, body = line[:1], line[1:-2]
+        if kind == b"+":
+            return body.decode("utf-8")
+        if kind == b"-":
+            # パイプラインの残りの応答を読み終えてから送出する
+            return StateBackendError(body.decode("utf-8"))
+        if kind == b":":
+            return int(body)
+        if kind == b"$":
+            length = int(body)
+            if length < 0:
+                return None
+            data = self._reader.read(length + 2)
+            return data[:-2].decode("utf-8")
+        if kind == b"*":
+            count = int(body)
+            return None if count < 0 else [self._read_reply() for _ in range(count)]
+        raise StateBackendError(f"unexpected reply: {line!r}")
+
+    def _connect(self) -> None:
+        self._disconnect()
+        self._sock = socket.create_connection((self.host, self.port), timeout=self.timeout_seconds)
+        self._sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self._reader = self._sock.makefile("rb")
+        self._pid = os.getpid()
+        if self.password:
+            self._send(("AUTH", self.password))
+        if self.db:
+            self._send(("SELECT", self.db))
+
+    def _disconnect(self) -> None:
+        if self._sock is not None:
+            try:
+                self._reader.close()
+                self._sock.close()
+            except OSError:
+                pass
+        self._sock = self._reader = None
+
+    def _send(self, *commands: tuple) -> List[Any]:
+        """コマンドをまとめて送り（パイプライン）、応答を順に返す（ロック取得済みで呼ぶ）"""
+        self._sock.sendall(b"".join(self._encode(command) for command in commands))
+        replies = [self._read_reply() for _ in commands]
+        for reply in replies:
+            if isinstance(reply, StateBackendError):
+                raise reply
+        return replies
+
+    def execute(self, *commands: tuple) -> List[Any]:
+        """コマンドを実行（切れていれば1回だけ接続し直して送り直す）"""
+        return self._call(lambda: self._send(*commands))
+
+    def _call(self, action: Callable[[], Any]) -> Any:
+        """接続した状態で action() を実行（切れていれば1回だけ接続し直してやり直す）"""
+        with self._lock:
+            for attempt in range(2):
+                try:
+                    if self._sock is None or self._pid != os.getpid():
+                        self._connect()
+                    return action()
+                except StateBackendError:
+                    raise
+                except OSError as e:
+                    self._disconnect()
+                    if attempt:
+                        raise StateBackendError(f"redis {self.host}:{self.port}: {e}") from e
+        return None
+
+    def get(self, key: str) -> Optional[str]:
+        return self.execute(("GET", key))[0]
+
+    def set(self, key: str, value: str, ttl_seconds: Optional[float] = None) -> None:
+        if ttl_seconds:
+            self.execute(("SET", key, value, "PX", max(int(ttl_seconds * 1000), 1)))
+        else:
+            self.execute(("SET", key, value))
+
+    def delete(self, key: str) -> None:
+        self.execute(("DEL", key))
+
+    def incr(self, key: str, amount: int = 1, ttl_seconds: Optional[float] = None) -> int:
+        if not ttl_seconds:
+            return self.execute(("INCRBY", key, amount))[0]
+        # 期限のないキー（新しく作ったキー）にだけ期限を付ける（PEXPIRE の NX は Redis 7.0 以降）
+        value, _ = self.execute(("INCRBY", key, amount), ("PEXPIRE", key, max(int(ttl_seconds * 1000), 1), "NX"))
+        return value
+
+    def update(self, key: str, func: Callable[[Optional[str]], str], ttl_seconds: Optional[float] = None) -> str:
+        set_options = ("PX", max(int(ttl_seconds * 1000), 1)) if ttl_seconds else ()
+
+        def transaction() -> str:
+            for attempt in range(self.max_update_attempts):
+                if attempt:
+                    # 同時に書き換えているワーカーと同じ間隔でやり直し続けないよう、少しずらす
+                    time.sleep(random.uniform(0, 0.002 * attempt))
+                self._send(("WATCH", key))
+                try:
+                    value = func(self._send(("GET", key))[0])
+                except BaseException:
+                    self._send(("UNWATCH",))
+                    raise
+                # WATCH の後に他の接続がキーを書き換えていれば EXEC は何もせず nil を返す
+                if self._send(("MULTI",), ("SET", key, value) + set_options, ("EXEC",))[-1] is not None:
+                    return value
+            raise StateBackendError(f"redis: {key} kept changing during update")
+
+        return self._call(transaction)
+
+    def close(self) -> None:
+        super().close()
+        with self._lock:
+            self._disconnect()
+
+
+def create_state_backend(config: Optional[Mapping[str, Any]] = None) -> StateBackend:
+    """設定（backend: memory / sqlite / redis）に従って共有状態の保存先を生成
+
+    SQLite や Redis を開けない場合は、プロセス内の MemoryBackend で続ける。
+    """
+    config = config or {}
+    backend = config.get("backend", "memory")
+    call_timeout = config.get("call_timeout_ms", 50) / 1000
+    try:
+        if backend == "sqlite":
+            return SQLiteBackend(config.get("sqlite_path", "data/shared_state.db"), call_timeout=call_timeout)
+        if backend == "redis":
+            redis_config = config.get("redis", {})
+            return RedisBackend(
+                host=redis_config.get("host", "127.0.0.1"),
+                port=redis_config.get("port", 6379),
+                db=redis_config.get("db", 0),
+                password=redis_config.get("password", ""),
+                timeout_seconds=redis_config.get("timeout_seconds", 1.0),
+                call_timeout=call_timeout,
+            )
+    except StateBackendError as e:
+        print(f"Error opening shared state backend ({backend}), using in-process state: {e}")
+    return MemoryBackend()
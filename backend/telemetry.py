@@ -0,0 +1,362 @@
+"""計測モジュール
+
+プロバイダー呼び出しと HTTP リクエストのメトリクスを集計し、Prometheus の
+テキスト形式で出力する。あわせて、呼び出しごとの JSON ログと、
+リクエストを一定の割合でプロファイルするサンプリングプロファイラーを提供する。
+メトリクスはプロセスごとに集計する（本番モードではワーカーごとの値になる）。
+"""
+
+import contextvars
+import cProfile
+import json
+import logging
+import random
+import threading
+import time
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+# 呼び出し元のリクエストの英語レベル（メトリクスのラベルに使う）
+current_level: contextvars.ContextVar = contextvars.ContextVar("current_level", default="")
+
+# レイテンシのヒストグラムの区切り（秒）
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+# メモリ上の索引の検索時間のヒストグラムの区切り（秒）
+FAST_LOOKUP_BUCKETS = (0.000005, 0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.001, 0.01)
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str]) -> str:
+    if not names:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in zip(names, values)) + "}"
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class Counter:
+    """単調増加するカウンター（callback を渡すと出力時に値を取得する）"""
+
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 callback: Optional[Callable[[], Dict[Tuple[str, ...], float]]] = None):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.callback = callback
+        self._values: Dict[Tuple[str, ...], float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1, **labels: str) -> None:
+        """値を増やす"""
+        key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def collect(self) -> List[str]:
+        if self.callback:
+            values = list(self.callback().items())
+        else:
+            with self._lock:
+                values = list(self._values.items())
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"
+                for key, value in values]
+
+
+class Gauge:
+    """現在値を表すゲージ（callback を渡すと出力時に値を取得する）"""
+
+    kind = "gauge"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 callback: Optional[Callable[[], Dict[Tuple[str, ...], float]]] = None):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.callback = callback
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def set(self, value: float, **labels: str) -> None:
+        """値を設定"""
+        self._values[tuple(str(labels.get(name, "")) for name in self.labelnames)] = value
+
+    def collect(self) -> List[str]:
+        values = self.callback() if self.callback else dict(self._values)
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"
+                for key, value in values.items()]
+
+
+class Histogram:
+    """値の分布を累積バケットで集計するヒストグラム"""
+
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+        self._values: Dict[Tuple[str, ...], List[float]] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels: str) -> None:
+        """値を記録"""
+        key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+        with self._lock:
+            # バケットごとの件数、合計、件数
+            state = self._values.setdefault(key, [0] * len(self.buckets) + [0.0, 0])
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[i] += 1
+            state[-2] += value
+            state[-1] += 1
+
+    def collect(self) -> List[str]:
+        with self._lock:
+            values = [(key, list(state)) for key, state in self._values.items()]
+        lines = []
+        names = self.labelnames + ("le",)
+        for key, state in values:
+            for bound, count in zip(self.buckets, state):
+                lines.append(f"{self.name}_bucket{_format_labels(names, key + (_format_value(bound),))} {count}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(state[-2])}")
+            lines.append(f"{self.name}_count{labels} {state[-1]}")
+        return lines
+
+
+class MetricsRegistry:
+    """メトリクスを登録し、Prometheus のテキスト形式でまとめて出力するクラス"""
+
+    def __init__(self):
+        self._metrics: Dict[str, Any] = {}
+
+    def register(self, metric):
+        """メトリクスを登録（同じ名前のものは置き換える）"""
+        self._metrics[metric.name] = metric
+        return metric
+
+    def render(self) -> str:
+        """Prometheus のテキスト形式で出力"""
+        lines = []
+        for metric in self._metrics.values():
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.collect())
+        return "\n".join(lines) + "\n"
+
+
+# グローバルインスタンス
+registry = MetricsRegistry()
+
+llm_request_seconds = registry.register(Histogram(
+    "llm_request_duration_seconds", "Latency of a single provider call (a streamed call until the last token).",
+    ["provider", "operation", "level", "outcome"]
+))
+llm_first_token_seconds = registry.register(Histogram(
+    "llm_stream_first_token_seconds", "Time until the first streamed token.",
+    ["provider", "operation", "level"]
+))
+llm_tokens = registry.register(Counter(
+    "llm_tokens_total", "Tokens reported by the provider.",
+    ["provider", "operation", "level", "direction"]
+))
+llm_errors = registry.register(Counter(
+    "llm_errors_total", "Failed provider calls by error class.",
+    ["provider", "operation", "error_class"]
+))
+llm_retries = registry.register(Counter(
+    "llm_retries_total", "Provider calls retried after a transient error.",
+    ["provider", "operation"]
+))
+llm_truncated = registry.register(Counter(
+    "llm_truncated_total", "Provider answers cut off by max_tokens.",
+    ["provider", "operation"]
+))
+llm_queue_wait_seconds = registry.register(Histogram(
+    "llm_queue_wait_seconds", "Time a provider call waited for a concurrency slot, by priority class.",
+    ["provider", "priority_class"]
+))
+llm_cancelled = registry.register(Counter(
+    "llm_cancelled_total", "Provider calls cancelled before completion (deadline or client disconnect).",
+    ["provider", "operation"]
+))
+requests_aborted = registry.register(Counter(
+    "http_requests_aborted_total", "Requests aborted after their deadline, a client disconnect or a newer turn.",
+    ["endpoint", "reason"]
+))
+hint_index_lookups = registry.register(Counter(
+    "hint_index_lookups_total", "Hint phrase index lookups by result (a miss falls back to the LLM).",
+    ["result"]
+))
+hint_index_lookup_seconds = registry.register(Histogram(
+    "hint_index_lookup_seconds", "Latency of a hint phrase index lookup.",
+    buckets=FAST_LOOKUP_BUCKETS
+))
+http_request_seconds = registry.register(Histogram(
+    "http_request_duration_seconds", "Latency of HTTP requests until the response headers are sent.",
+    ["endpoint", "method", "status"]
+))
+
+call_logger = logging.getLogger("english_learning.calls")
+call_logger.setLevel(logging.WARNING)
+call_logger.propagate = False
+
+
+class JsonFormatter(logging.Formatter):
+    """ログを1行1つの JSON として出力するフォーマッター"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {"ts": round(record.created, 3), "event": record.getMessage()}
+        entry.update(getattr(record, "fields", {}))
+        return json.dumps(entry, ensure_ascii=False)
+
+
+def configure_json_logs(enabled: bool) -> None:
+    """プロバイダー呼び出しごとの JSON ログ（標準エラー出力）を有効・無効にする"""
+    for handler in list(call_logger.handlers):
+        call_logger.removeHandler(handler)
+    if enabled:
+        handler = logging.StreamHandler()
+        handler.setFormatter(JsonFormatter())
+        call_logger.addHandler(handler)
+        call_logger.setLevel(logging.INFO)
+    else:
+        call_logger.setLevel(logging.WARNING)
+
+
+def record_error(provider: str, operation: str, error: BaseException) -> None:
+    """失敗した呼び出しをエラーの種類ごとに記録"""
+    llm_errors.inc(provider=provider, operation=operation, error_class=type(error).__name__)
+
+
+def record_call(provider: str, operation: str, duration: float, completion: Any = None,
+                error: Optional[BaseException] = None) -> None:
+    """1回のプロバイダー呼び出しを記録（completion はトークン使用量を持つ回答）"""
+    level = current_level.get()
+    outcome = "success" if error is None else "error"
+    llm_request_seconds.observe(duration, provider=provider, operation=operation, level=level, outcome=outcome)
+    if error is not None:
+        record_error(provider, operation, error)
+    input_tokens = getattr(completion, "input_tokens", 0)
+    output_tokens = getattr(completion, "output_tokens", 0)
+    if input_tokens:
+        llm_tokens.inc(input_tokens, provider=provider, operation=operation, level=level, direction="input")
+    if output_tokens:
+        llm_tokens.inc(output_tokens, provider=provider, operation=operation, level=level, direction="output")
+    # プロンプトキャッシュから読んだ・キャッシュに書いた入力トークン（input に含まれる内訳）
+    cache_read_tokens = getattr(completion, "cache_read_tokens", 0)
+    cache_write_tokens = getattr(completion, "cache_write_tokens", 0)
+    if cache_read_tokens:
+        llm_tokens.inc(cache_read_tokens, provider=provider, operation=operation, level=level,
+                       direction="cache_read")
+    if cache_write_tokens:
+        llm_tokens.inc(cache_write_tokens, provider=provider, operation=operation, level=level,
+                       direction="cache_write")
+
+    if call_logger.isEnabledFor(logging.INFO):
+        fields = {
+            "provider": provider,
+            "operation": operation,
+            "level": level,
+            "outcome": outcome,
+            "latency_ms": round(duration * 1000, 1),
+            "input_tokens": input_tokens,
+            "output_tokens": output_tokens,
+            "cache_read_tokens": cache_read_tokens,
+            "cache_write_tokens": cache_write_tokens,
+            "stop_reason": getattr(completion, "stop_reason", None),
+        }
+        if error is not None:
+            fields["error_class"] = type(error).__name__
+            fields["error"] = str(error)
+        call_logger.info("provider_call", extra={"fields": fields})
+
+
+def record_retry(provider: str, operation: str) -> None:
+    """再試行を記録"""
+    llm_retries.inc(provider=provider, operation=operation)
+
+
+def record_truncated(provider: str, operation: str) -> None:
+    """max_tokens で切れた回答を記録"""
+    llm_truncated.inc(provider=provider, operation=operation)
+
+
+def record_cancelled(provider: str, operation: str, duration: float) -> None:
+    """途中でキャンセルされた呼び出しを記録"""
+    llm_cancelled.inc(provider=provider, operation=operation)
+    llm_request_seconds.observe(duration, provider=provider, operation=operation, level=current_level.get(),
+                                outcome="cancelled")
+
+
+def record_queue_wait(provider: str, priority_class: str, duration: float) -> None:
+    """同時実行枠を確保するまでの待ち時間を記録"""
+    llm_queue_wait_seconds.observe(duration, provider=provider, priority_class=priority_class)
+
+
+def record_hint_lookup(hit: bool, duration: float) -> None:
+    """ヒント用フレーズ索引の検索を記録"""
+    hint_index_lookups.inc(result="hit" if hit else "miss")
+    hint_index_lookup_seconds.observe(duration)
+
+
+def record_first_token(provider: str, operation: str, duration: float) -> None:
+    """ストリーミングの初回トークンまでの時間を記録"""
+    llm_first_token_seconds.observe(duration, provider=provider, operation=operation, level=current_level.get())
+
+
+class SamplingProfiler:
+    """リクエストの一部を cProfile で計測し、.prof ファイルとして保存するクラス
+
+    sample_rate の割合のリクエストを計測する。同時に計測するのは1リクエストだけで、
+    計測中に来たリクエストは対象外にする。計測するのはリクエストを処理するスレッドのみで、
+    イベントループ上のプロバイダー呼び出しは含まない。
+    """
+
+    def __init__(self, sample_rate: float = 0.0, output_dir: str = "data/profiles"):
+        self.sample_rate = sample_rate
+        self.output_dir = Path(output_dir)
+        self._busy = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return self.sample_rate > 0
+
+    def start(self) -> Optional[cProfile.Profile]:
+        """サンプリング対象なら計測を開始してプロファイラーを返す"""
+        if not self.enabled or random.random() >= self.sample_rate:
+            return None
+        if not self._busy.acquire(blocking=False):
+            return None
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError:
+            # 他のプロファイラーが動作中
+            self._busy.release()
+            return None
+        return profile
+
+    def stop(self, profile: cProfile.Profile, name: str) -> Optional[Path]:
+        """計測を終了して保存し、保存先のパスを返す"""
+        try:
+            profile.disable()
+            self.output_dir.mkdir(parents=True, exist_ok=True)
+            path = self.output_dir / f"{time.strftime('%Y%m%d-%H%M%S')}-{name}-{time.perf_counter_ns()}.prof"
+            profile.dump_stats(str(path))
+            return path
+        except OSError as e:
+            print(f"Error saving profile: {e}")
+            return None
+        finally:
+            self._busy.release()
@@ -0,0 +1,165 @@
+#!/usr/bin/env python3
+"""
+/api/chat 同時実行スループットのベンチマーク
+
+ローカルの疑似プロバイダー（fake_server.py）に対して create_app() を起動し、
+指定した同時接続数で /api/chat を叩いてスループットとレイテンシを計測する。
+疑似プロバイダー・アプリ・負荷生成はそれぞれ別プロセスで動かし、GIL を共有しない。
+
+使い方:
+    python benchmarks/bench_chat_concurrency.py --requests 1000 --concurrency 200 --latency 0.5
+
+--mode production を指定すると、開発サーバーの代わりに main.py --production と同じ
+gunicorn（gthread ワーカー）でアプリを起動する。--workers と --threads で構成を変えられる。
+
+変更前後を比較する場合は、比較したいコミットを git worktree で取り出し、
+同じ引数でこのスクリプトを実行する。
+"""
+
+import argparse
+import json
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+ROOT_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT_DIR))
+
+from fake_server import start_in_subprocess
+
+
+def _serve_app(mode: str, port: int, workers: int, threads: int) -> None:
+    """create_app() を開発サーバーと同じ条件（threaded=True）または本番モードで起動"""
+    if mode == "production":
+        from backend.server import ProductionServer, build_options
+
+        options = build_options({
+            "host": "127.0.0.1",
+            "port": port,
+            "production": {"workers": workers, "threads": threads},
+        })
+        options["loglevel"] = "warning"
+        ProductionServer(options).run()
+        return
+
+    from werkzeug.serving import WSGIRequestHandler, make_server
+    from backend.app import create_app
+
+    class QuietHandler(WSGIRequestHandler):
+        def log_request(self, *args, **kwargs) -> None:
+            pass
+
+    server = make_server("127.0.0.1", port, create_app(), threaded=True, request_handler=QuietHandler)
+    server.socket.listen(1024)
+    server.serve_forever()
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def _start_app(fake_url: str, mode: str, workers: int, threads: int) -> tuple:
+    env = dict(os.environ, ANTHROPIC_API_KEY="fake-key", ANTHROPIC_BASE_URL=fake_url)
+    port = _free_port()
+    proc = subprocess.Popen(
+        [sys.executable, __file__, "--serve", "--mode", mode, "--port", str(port),
+         "--workers", str(workers), "--threads", str(threads)],
+        cwd=str(ROOT_DIR),
+        env=env,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    # すべてのワーカーが起動するまで /readyz を待つ
+    url = f"http://127.0.0.1:{port}"
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        try:
+            with urllib.request.urlopen(f"{url}/readyz", timeout=1) as resp:
+                if resp.status == 200:
+                    time.sleep(1)
+                    return proc, url
+        except OSError:
+            time.sleep(0.2)
+    proc.terminate()
+    raise RuntimeError("app did not become ready")
+
+
+# プロバイダー呼び出しに失敗したときに /api/chat が返す定型文
+ERROR_RESPONSES = ("I apologize", "I'm sorry")
+
+
+def _post_chat(url: str) -> tuple:
+    """(レイテンシ秒, 成功したか) を返す"""
+    body = json.dumps({"message": "Hello!", "level": "400", "history": []}).encode("utf-8")
+    req = urllib.request.Request(url, data=body, headers={"Content-Type": "application/json"})
+    start = time.perf_counter()
+    with urllib.request.urlopen(req, timeout=120) as resp:
+        data = json.loads(resp.read())
+    return time.perf_counter() - start, not data.get("response", "").startswith(ERROR_RESPONSES)
+
+
+def _percentile(values, pct: float) -> float:
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=1000, help="総リクエスト数")
+    parser.add_argument("--concurrency", type=int, default=200, help="同時接続数")
+    parser.add_argument("--latency", type=float, default=0.5, help="疑似プロバイダーの応答遅延（秒）")
+    parser.add_argument("--mode", choices=["development", "production"], default="development",
+                        help="アプリの起動方法")
+    parser.add_argument("--workers", type=int, default=0, help="本番モードのワーカープロセス数（0 で既定値）")
+    parser.add_argument("--threads", type=int, default=0, help="本番モードのワーカーあたりのスレッド数（0 で既定値）")
+    parser.add_argument("--serve", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--port", type=int, default=0, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve:
+        _serve_app(args.mode, args.port, args.workers, args.threads)
+        return
+
+    fake_proc, fake_url = start_in_subprocess(args.latency)
+    app_proc, app_url = _start_app(fake_url, args.mode, args.workers, args.threads)
+    url = f"{app_url}/api/chat"
+
+    try:
+        # ウォームアップ
+        _post_chat(url)
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+            results = list(pool.map(lambda _: _post_chat(url), range(args.requests)))
+        elapsed = time.perf_counter() - start
+    finally:
+        app_proc.terminate()
+        fake_proc.terminate()
+
+    server = args.mode
+    if args.mode == "production":
+        from backend.server import DEFAULT_THREADS, default_workers
+
+        server = (f"production workers={args.workers or default_workers()} "
+                  f"threads={args.threads or DEFAULT_THREADS}")
+    print(f"server={server} requests={args.requests} concurrency={args.concurrency} "
+          f"provider_latency={args.latency}s")
+    latencies = [latency for latency, _ in results]
+    errors = sum(1 for _, ok in results if not ok)
+    print(f"throughput: {args.requests / elapsed:.1f} req/s (elapsed {elapsed:.2f}s, errors {errors})")
+    print(f"latency p50={statistics.median(latencies) * 1000:.0f}ms "
+          f"p95={_percentile(latencies, 95) * 1000:.0f}ms "
+          f"p99={_percentile(latencies, 99) * 1000:.0f}ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,286 @@
+#!/usr/bin/env python3
+"""
+エンドツーエンドの負荷ベンチマーク
+
+疑似プロバイダー（backend/fake_provider.py）を設定した create_app() に対して、
+学習者の1ターン分の流れを --users 人が同時に --turns 回ずつ繰り返す。
+
+1. 確率 --hint-rate で /api/hint（日本語からのヒント）
+2. /api/chat/stream（done イベントまで読む）
+3. /api/translate ×2（学習者と先生の発言）と /api/feedback を並列に
+
+エンドポイントごとに次の値を出力する。
+
+- requests / errors: リクエスト数と、200 以外・SSE の error イベントの数
+- rps: 計測時間全体でのリクエスト数/秒
+- p50_ms / p95_ms / p99_ms: レスポンスを最後まで読むまでの時間
+- peak_kib: tracemalloc で計測した1リクエストあたりのピークの割り当て量（別途、順番に実行して計測）
+
+プロバイダーの遅延・トークンレート・エラーと 429 の発生率は引数で指定する。--replay を
+指定すると、recording.mode = record で記録したやり取りを再生する（入力が記録と一致する
+必要があるため、記録時と同じ --seed・--users・--turns で実行する）。
+アプリは werkzeug のテストクライアントで同じプロセス内から呼び出す（ネットワークは通さない）。
+
+--json を付けると1行の JSON を出力する。--baseline に以前の JSON を渡すと、p95 が
+--tolerance（割合）を超えて悪化したか、スループットが同じ割合を超えて落ちたエンドポイントが
+あれば終了コード 1 で終わる。
+
+使い方:
+    python benchmarks/bench_e2e.py --users 20 --turns 5
+    python benchmarks/bench_e2e.py --users 20 --turns 5 --rate-limit-rate 0.05 --json > before.json
+    python benchmarks/bench_e2e.py --users 20 --turns 5 --baseline before.json --tolerance 0.2
+"""
+
+import argparse
+import json
+import random
+import resource
+import statistics
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+ROOT_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT_DIR))
+
+LEVELS = ["400", "600", "800"]
+SUBJECTS = ["I", "My friend", "My sister", "We", "My boss", "Our teacher"]
+VERBS = ["went to", "want to visit", "talked about", "really like", "am planning to go to"]
+OBJECTS = ["Tokyo", "the park", "a new cafe", "the library", "a concert", "the beach", "my hometown"]
+TIMES = ["yesterday", "last weekend", "next month", "after work", "with my family"]
+HINT_TEXTS = ["お腹すいた", "明日の会議が不安だ", "週末は家でゆっくりしたい", "駅までの道を教えてください",
+              "最近ジムに通い始めた", "その映画はもう見ました"]
+ENDPOINTS = ["hint", "chat_stream", "translate", "feedback"]
+
+
+def build_config(args: argparse.Namespace) -> dict:
+    """疑似プロバイダー（または再生）を使う設定"""
+    config = {
+        "default_provider": "fake",
+        "fake_provider": {
+            "enabled": True,
+            "ttft_ms": {"distribution": "lognormal", "median": args.ttft_ms, "sigma": args.ttft_sigma},
+            "output_tokens": {"distribution": "lognormal", "median": args.output_tokens, "sigma": 0.5},
+            "tokens_per_second": args.tokens_per_second,
+            "error_rate": args.error_rate,
+            "rate_limit_rate": args.rate_limit_rate,
+            "seed": args.seed,
+        },
+        "config_reload": {"enabled": False},
+        # 疑似プロバイダーのエラーで実際のプロバイダーに切り替えない
+        "router": {"failover": False},
+    }
+    if args.replay:
+        config["default_provider"] = args.replay_provider
+        config["recording"] = {"mode": "replay", "path": str(Path(args.replay).resolve())}
+    return config
+
+
+def make_message(rng: random.Random) -> str:
+    return f"{rng.choice(SUBJECTS)} {rng.choice(VERBS)} {rng.choice(OBJECTS)} {rng.choice(TIMES)}."
+
+
+def read_sse_done(body: str) -> tuple:
+    """SSE の本文から (done イベントのデータ, error イベントがあったか) を返す"""
+    done, failed = None, False
+    for block in body.split("\n\n"):
+        lines = block.split("\n")
+        if "event: done" in lines:
+            done = json.loads(next(line[5:].strip() for line in lines if line.startswith("data:")))
+        elif "event: error" in lines:
+            failed = True
+    return done, failed
+
+
+class Recorder:
+    """エンドポイントごとの所要時間とエラー数を集める"""
+
+    def __init__(self):
+        self.durations = defaultdict(list)
+        self.errors = defaultdict(int)
+        self._lock = threading.Lock()
+
+    def add(self, endpoint: str, duration: float, ok: bool) -> None:
+        with self._lock:
+            self.durations[endpoint].append(duration)
+            if not ok:
+                self.errors[endpoint] += 1
+
+
+def post(client, recorder: Recorder, endpoint: str, path: str, payload: dict) -> dict:
+    """JSON を POST して本文を最後まで読み、所要時間を記録する"""
+    start = time.perf_counter()
+    response = client.post(path, json=payload)
+    body = response.get_data(as_text=True)
+    duration = time.perf_counter() - start
+    if endpoint == "chat_stream":
+        done, failed = read_sse_done(body)
+        recorder.add(endpoint, duration, response.status_code == 200 and done is not None and not failed)
+        return done or {}
+    recorder.add(endpoint, duration, response.status_code == 200)
+    return json.loads(body) if response.status_code == 200 else {}
+
+
+def run_user(client, recorder: Recorder, analysis_pool: ThreadPoolExecutor, seed: int,
+             turns: int, hint_rate: float) -> None:
+    """1人の学習者のターンを順に実行"""
+    rng = random.Random(seed)
+    level = rng.choice(LEVELS)
+    session_id = None
+    for _ in range(turns):
+        if rng.random() < hint_rate:
+            post(client, recorder, "hint", "/api/hint",
+                 {"japanese_text": rng.choice(HINT_TEXTS), "level": level, "session_id": session_id})
+        message = make_message(rng)
+        done = post(client, recorder, "chat_stream", "/api/chat/stream",
+                    {"message": message, "level": level, "session_id": session_id})
+        session_id = done.get("session_id", session_id)
+        teacher_text = done.get("response") or "That sounds great!"
+        futures = [
+            analysis_pool.submit(post, client, recorder, "translate", "/api/translate",
+                                 {"text": message, "target_language": "japanese", "session_id": session_id}),
+            analysis_pool.submit(post, client, recorder, "translate", "/api/translate",
+                                 {"text": teacher_text, "target_language": "japanese", "session_id": session_id}),
+            analysis_pool.submit(post, client, recorder, "feedback", "/api/feedback",
+                                 {"text": message, "level": level, "teacher_text": teacher_text,
+                                  "session_id": session_id}),
+        ]
+        for future in futures:
+            future.result()
+
+
+def measure_memory(client, samples: int, seed: int) -> dict:
+    """エンドポイントごとに順番にリクエストし、1リクエストあたりのピークの割り当て量（KiB）を計測"""
+    rng = random.Random(seed)
+    recorder = Recorder()
+    payloads = {
+        "hint": ("/api/hint", lambda: {"japanese_text": rng.choice(HINT_TEXTS), "level": "600"}),
+        "chat_stream": ("/api/chat/stream", lambda: {"message": make_message(rng), "level": "600"}),
+        "translate": ("/api/translate", lambda: {"text": make_message(rng), "target_language": "japanese"}),
+        "feedback": ("/api/feedback", lambda: {"text": make_message(rng), "level": "600"}),
+    }
+    peaks = {}
+    tracemalloc.start()
+    try:
+        for endpoint, (path, payload) in payloads.items():
+            values = []
+            for _ in range(samples):
+                baseline = tracemalloc.get_traced_memory()[0]
+                tracemalloc.reset_peak()
+                post(client, recorder, endpoint, path, payload())
+                values.append((tracemalloc.get_traced_memory()[1] - baseline) / 1024)
+            peaks[endpoint] = round(statistics.median(values), 1)
+    finally:
+        tracemalloc.stop()
+    return peaks
+
+
+def summarize(recorder: Recorder, elapsed: float, peaks: dict) -> dict:
+    endpoints = {}
+    for endpoint in ENDPOINTS:
+        durations = recorder.durations.get(endpoint)
+        if not durations:
+            continue
+        quantiles = statistics.quantiles(durations, n=100) if len(durations) > 1 else [durations[0]] * 99
+        endpoints[endpoint] = {
+            "requests": len(durations),
+            "errors": recorder.errors.get(endpoint, 0),
+            "rps": round(len(durations) / elapsed, 2),
+            "p50_ms": round(quantiles[49] * 1000, 1),
+            "p95_ms": round(quantiles[94] * 1000, 1),
+            "p99_ms": round(quantiles[98] * 1000, 1),
+            "peak_kib": peaks.get(endpoint),
+        }
+    total = sum(len(durations) for durations in recorder.durations.values())
+    return {
+        "elapsed_s": round(elapsed, 2),
+        "rps": round(total / elapsed, 2),
+        "max_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        "endpoints": endpoints,
+    }
+
+
+def compare(result: dict, baseline: dict, tolerance: float) -> list:
+    """baseline より p95 が悪化した・スループットが落ちたエンドポイントを返す"""
+    regressions = []
+    for endpoint, current in result["endpoints"].items():
+        previous = baseline.get("endpoints", {}).get(endpoint)
+        if not previous:
+            continue
+        if current["p95_ms"] > previous["p95_ms"] * (1 + tolerance):
+            regressions.append(f"{endpoint}: p95 {previous['p95_ms']}ms -> {current['p95_ms']}ms")
+        if current["rps"] < previous["rps"] * (1 - tolerance):
+            regressions.append(f"{endpoint}: rps {previous['rps']} -> {current['rps']}")
+    return regressions
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=20, help="同時に会話する学習者の数")
+    parser.add_argument("--turns", type=int, default=5, help="学習者ごとのターン数")
+    parser.add_argument("--hint-rate", type=float, default=0.3, help="ターンの前にヒントを求める確率")
+    parser.add_argument("--ttft-ms", type=float, default=400, help="初回トークンまでの時間の中央値（ミリ秒）")
+    parser.add_argument("--ttft-sigma", type=float, default=0.35, help="初回トークンまでの時間の対数正規分布の sigma")
+    parser.add_argument("--output-tokens", type=float, default=60, help="出力トークン数の中央値")
+    parser.add_argument("--tokens-per-second", type=float, default=50, help="1秒あたりの出力トークン数")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="500 エラーにする呼び出しの割合")
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0, help="429 にする呼び出しの割合")
+    parser.add_argument("--replay", help="recording.mode = record で記録した JSONL を再生する")
+    parser.add_argument("--replay-provider", default="anthropic", help="再生するプロバイダー名")
+    parser.add_argument("--memory-samples", type=int, default=20, help="メモリ計測でのエンドポイントごとの回数")
+    parser.add_argument("--seed", type=int, default=0, help="乱数のシード")
+    parser.add_argument("--baseline", help="比較する以前の --json の出力")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="悪化とみなす割合")
+    parser.add_argument("--json", action="store_true", help="結果を1行の JSON で出力")
+    args = parser.parse_args()
+
+    from config.settings import settings
+
+    config_dir = tempfile.mkdtemp(prefix="bench_e2e_")
+    config_file = Path(config_dir) / "config.json"
+    config_file.write_text(json.dumps(build_config(args)), encoding="utf-8")
+    settings.config_file = config_file
+
+    from backend.app import create_app
+
+    client = create_app().test_client()
+    recorder = Recorder()
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.users * 3) as analysis_pool, \
+            ThreadPoolExecutor(max_workers=args.users) as user_pool:
+        futures = [user_pool.submit(run_user, client, recorder, analysis_pool, args.seed * 100003 + i,
+                                    args.turns, args.hint_rate)
+                   for i in range(args.users)]
+        for future in futures:
+            future.result()
+    elapsed = time.perf_counter() - start
+
+    peaks = measure_memory(client, args.memory_samples, args.seed) if args.memory_samples else {}
+    result = summarize(recorder, elapsed, peaks)
+
+    if args.json:
+        print(json.dumps(result))
+    else:
+        print(f"elapsed: {result['elapsed_s']}s  rps: {result['rps']}  max_rss: {result['max_rss_mb']}MB")
+        print(f"{'endpoint':>12} {'requests':>8} {'errors':>6} {'rps':>7} {'p50_ms':>8} {'p95_ms':>8} "
+              f"{'p99_ms':>8} {'peak_kib':>8}")
+        for endpoint, row in result["endpoints"].items():
+            print(f"{endpoint:>12} {row['requests']:>8} {row['errors']:>6} {row['rps']:>7} {row['p50_ms']:>8} "
+                  f"{row['p95_ms']:>8} {row['p99_ms']:>8} {row['peak_kib'] or '-':>8}")
+
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            regressions = compare(result, json.load(f), args.tolerance)
+        for regression in regressions:
+            print(f"regression: {regression}", file=sys.stderr)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+"""
+出力トークン予算のベンチマーク
+
+呼び出しごとの (呼び出しの種類, レベル, 入力トークン数, 出力トークン数) のコーパスを再生し、
+max_tokens を従来の固定値にした場合と、OutputBudget で決めた場合を比べる。
+生成時間は「初回トークンまでの時間 + 出力トークン数 × 1トークンあたりの時間」で見積もる
+（プロバイダーは呼ばない）。予算で切れた呼び出しは、和訳は上限の予算で取り直した時間を足し、
+それ以外は切り詰めた回答として数える。
+
+- p50_ms / p95_ms: 見積もった生成時間
+- mean_output_tokens: 1回あたりの出力トークン数（取り直しを含む）
+- truncated_rate: 予算で切れた呼び出しの割合
+- retried_rate / trimmed_rate: 取り直した・切り詰めた呼び出しの割合
+
+--corpus には output_budget.record_path に記録した JSONL を指定する（切れた呼び出しは
+本当の長さが分からないため除く）。指定しない場合は合成したコーパスを使い、結果に
+"corpus": "synthetic" と表示する。--json を付けると1行の JSON を出力する。
+
+使い方:
+    python benchmarks/bench_output_budget.py
+    python benchmarks/bench_output_budget.py --corpus logs/output_lengths.jsonl --json
+"""
+
+import argparse
+import json
+import random
+import statistics
+import sys
+from pathlib import Path
+
+ROOT_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT_DIR))
+
+from backend.ai_service import MAX_OUTPUT_TOKENS
+from backend.output_budget import OutputBudget
+from backend.providers import Completion
+
+LEVELS = ["400", "600", "800"]
+# 合成コーパスの出力の長さ（入力に比例する種類は 出力 / 入力 の比、それ以外はトークン数）の中央値
+SYNTHETIC_MEDIANS = {"chat": 2.5, "translate": 1.6, "feedback": 220, "hint": 110}
+SYNTHETIC_MIX = ["chat"] * 6 + ["translate"] * 2 + ["feedback", "hint"]
+
+
+def load_corpus(path: str) -> list:
+    """記録した JSONL を (種類, レベル, 入力トークン数, 出力トークン数) のリストにする"""
+    corpus = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            entry = json.loads(line)
+            if entry.get("stop_reason") in ("max_tokens", "length") or not entry.get("output_tokens"):
+                continue
+            corpus.append((entry["operation"], entry.get("level") or "", entry["input_tokens"],
+                           entry["output_tokens"]))
+    return corpus
+
+
+def synthetic_corpus(rng: random.Random, size: int) -> list:
+    """学習者の発言に似せた長さの合成コーパス（5% は話が長くなった回答）"""
+    corpus = []
+    for _ in range(size):
+        operation = rng.choice(SYNTHETIC_MIX)
+        level = rng.choice(LEVELS)
+        input_tokens = max(3, int(rng.lognormvariate(2.8, 0.6)))
+        size_factor = SYNTHETIC_MEDIANS[operation] * rng.lognormvariate(0, 0.35)
+        if operation in ("chat", "translate"):
+            output_tokens = size_factor * input_tokens
+        else:
+            output_tokens = size_factor
+        if rng.random() < 0.05:
+            output_tokens *= rng.uniform(2, 4)
+        ceiling = MAX_OUTPUT_TOKENS[operation]
+        corpus.append((operation, level, input_tokens, max(1, min(int(output_tokens), ceiling))))
+    return corpus
+
+
+def replay(corpus: list, budget, ttft_ms: float, per_token_ms: float) -> dict:
+    """コーパスを再生し、生成時間と切れた回数を集計する（budget が None なら固定値）"""
+    times, outputs = [], []
+    truncated = retried = trimmed = 0
+    for operation, level, input_tokens, natural in corpus:
+        ceiling = MAX_OUTPUT_TOKENS.get(operation, natural)
+        max_tokens = budget.max_tokens(operation, level, input_tokens, ceiling) if budget else ceiling
+        generated = min(natural, max_tokens)
+        cut = natural > max_tokens
+        completion = Completion("", input_tokens, generated, "max_tokens" if cut else "end_turn")
+        if budget:
+            budget.record(operation, level, input_tokens, completion, max_tokens)
+        elapsed = ttft_ms + generated * per_token_ms
+        if cut:
+            truncated += 1
+            if budget and budget.on_truncation(operation) == "retry" and max_tokens < ceiling:
+                retried += 1
+                retry_tokens = min(natural, ceiling)
+                elapsed += ttft_ms + retry_tokens * per_token_ms
+                generated += retry_tokens
+            else:
+                trimmed += 1
+        times.append(elapsed)
+        outputs.append(generated)
+
+    quantiles = statistics.quantiles(times, n=100)
+    return {
+        "p50_ms": round(quantiles[49], 1),
+        "p95_ms": round(quantiles[94], 1),
+        "mean_output_tokens": round(statistics.mean(outputs), 1),
+        "truncated_rate": round(truncated / len(corpus), 4),
+        "retried_rate": round(retried / len(corpus), 4),
+        "trimmed_rate": round(trimmed / len(corpus), 4),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--corpus", help="output_budget.record_path に記録した JSONL")
+    parser.add_argument("--size", type=int, default=20000, help="合成コーパスの呼び出し数")
+    parser.add_argument("--ttft-ms", type=float, default=400.0, help="初回トークンまでの時間（ミリ秒）")
+    parser.add_argument("--per-token-ms", type=float, default=15.0, help="1トークンあたりの生成時間（ミリ秒）")
+    parser.add_argument("--percentile", type=float, default=99, help="学習する出力の長さのパーセンタイル")
+    parser.add_argument("--headroom", type=float, default=1.25, help="学習した長さに掛ける余裕")
+    parser.add_argument("--seed", type=int, default=0, help="乱数のシード")
+    parser.add_argument("--json", action="store_true", help="結果を1行の JSON で出力")
+    args = parser.parse_args()
+
+    if args.corpus:
+        corpus = load_corpus(args.corpus)
+    else:
+        corpus = synthetic_corpus(random.Random(args.seed), args.size)
+    budget = OutputBudget({"percentile": args.percentile, "headroom": args.headroom})
+
+    result = {
+        "corpus": args.corpus or "synthetic",
+        "calls": len(corpus),
+        "static": replay(corpus, None, args.ttft_ms, args.per_token_ms),
+        "adaptive": replay(corpus, budget, args.ttft_ms, args.per_token_ms),
+    }
+
+    if args.json:
+        print(json.dumps(result))
+    else:
+        print(f"corpus: {result['corpus']} ({result['calls']} calls)")
+        for name in ("static", "adaptive"):
+            print(f"{name}:")
+            for key, value in result[name].items():
+                print(f"  {key:>18}: {value}")
+
+
+if __name__ == "__main__":
+    main()
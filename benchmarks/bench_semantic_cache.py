@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+"""
+近似重複キャッシュのベンチマーク
+
+学習者の入力に似せた英文を --entries 件キャッシュに入れ、次の時間を計測する。
+
+- set_us: 1件の保存（特徴の計算を含む）の平均
+- exact_p50_ms / exact_p99_ms: 保存済みの文を大文字・小文字や句読点、短縮形だけ変えて引いた時間
+  （正規化後に一致するため辞書から引ける）
+- near_p50_ms / near_p99_ms: 保存済みの文に冠詞を1つ足して引いた時間（行列全体との類似度から
+  上位 top_k 件の候補を選び、冠詞を除いた語が同じものを返す）
+- changed_p50_ms / changed_p99_ms: 保存済みの文の1語を別の語に変えて引いた時間
+- miss_p50_ms / miss_p99_ms: キャッシュにない文を引いた時間
+- exact_hit_rate / near_hit_rate / changed_hit_rate: それぞれ、元の文の回答が見つかった割合
+  （changed_hit_rate は意味の違う文に回答を返した割合で、0 になるべき値）
+
+プロバイダーは使わず、CPU のみで実行する。--json を付けると1行の JSON を出力する。
+
+使い方:
+    python benchmarks/bench_semantic_cache.py --entries 100000
+    python benchmarks/bench_semantic_cache.py --entries 100000 --dim 512 --json
+"""
+
+import argparse
+import json
+import random
+import statistics
+import sys
+import time
+from pathlib import Path
+
+ROOT_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT_DIR))
+
+from backend.semantic_cache import SemanticCache
+
+SUBJECTS = ["I", "My friend", "My sister", "We", "They", "My boss", "Our teacher", "My father", "She", "He"]
+VERBS = ["went to", "visited", "want to visit", "will go to", "have been to", "am planning to go to",
+         "talked about", "really like", "don't like", "can't forget"]
+PLACES = ["Tokyo", "the park", "a new cafe", "the library", "Kyoto", "the beach", "a concert", "the office",
+          "my hometown", "a museum", "the gym", "a Japanese restaurant", "the station", "the mountains"]
+TIMES = ["yesterday", "last weekend", "this morning", "next month", "every Sunday", "after work",
+         "during the summer vacation", "with my family", "for the first time", "two years ago"]
+
+
+def make_sentence(rng: random.Random, serial: int) -> str:
+    """学習者の入力に似せた英文（serial で全件を異なる文にする）"""
+    return (f"{rng.choice(SUBJECTS)} {rng.choice(VERBS)} {rng.choice(PLACES)} {rng.choice(TIMES)}"
+            f" and it was day {serial}.")
+
+
+def paraphrase(sentence: str) -> str:
+    """大文字・小文字、句読点、短縮形だけを変えた言い換え"""
+    text = sentence.lower().rstrip(".").replace("don't", "do not").replace("can't", "can not")
+    return text.replace(" and it was", ", and it was") + "!"
+
+
+def near_duplicate(sentence: str) -> str:
+    """冠詞を1つ足しただけの近似重複"""
+    return sentence.replace(" and it was day", " and it was the day")
+
+
+def changed_word(sentence: str) -> str:
+    """1語を別の語に変えた（意味の違う）文"""
+    return sentence.replace(" and it was day", " and it was night")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--entries", type=int, default=100000, help="キャッシュに入れる件数")
+    parser.add_argument("--lookups", type=int, default=2000, help="ヒット・ミスそれぞれの検索回数")
+    parser.add_argument("--dim", type=int, default=256, help="特徴ベクトルの次元数")
+    parser.add_argument("--threshold", type=float, default=0.8, help="類似度のしきい値")
+    parser.add_argument("--top-k", type=int, default=5, help="近似一致の候補の件数")
+    parser.add_argument("--seed", type=int, default=0, help="乱数のシード")
+    parser.add_argument("--json", action="store_true", help="結果を1行の JSON で出力")
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    cache = SemanticCache(max_entries=args.entries, dim=args.dim, thresholds={"translate": args.threshold},
+                          top_k=args.top_k)
+    namespace = "translate:bench:japanese"
+    sentences = [make_sentence(rng, i) for i in range(args.entries)]
+
+    start = time.perf_counter()
+    for i, sentence in enumerate(sentences):
+        cache.set(sentence, namespace, f"translation {i}")
+    set_seconds = time.perf_counter() - start
+
+    times = {"exact": [], "near": [], "changed": [], "miss": []}
+    hits = {"exact": 0, "near": 0, "changed": 0}
+    for i in rng.sample(range(args.entries), min(args.lookups, args.entries)):
+        for kind, text in (("exact", paraphrase(sentences[i])), ("near", near_duplicate(sentences[i])),
+                           ("changed", changed_word(sentences[i]))):
+            start = time.perf_counter()
+            found = cache.get(text, namespace, "translate")
+            times[kind].append(time.perf_counter() - start)
+            hits[kind] += found == f"translation {i}"
+    for i in range(args.lookups):
+        start = time.perf_counter()
+        cache.get(f"Could you recommend a good book about topic number {i}?", namespace, "translate")
+        times["miss"].append(time.perf_counter() - start)
+
+    def percentile(samples, pct):
+        return statistics.quantiles(samples, n=100)[pct - 1] * 1000
+
+    result = {
+        "entries": args.entries,
+        "dim": args.dim,
+        "matrix_mb": round(cache._vectors.nbytes / 1024 / 1024, 1),
+        "set_us": round(set_seconds / args.entries * 1e6, 1),
+    }
+    for kind, samples in times.items():
+        result[f"{kind}_p50_ms"] = round(percentile(samples, 50), 3)
+        result[f"{kind}_p99_ms"] = round(percentile(samples, 99), 3)
+    for kind, count in hits.items():
+        result[f"{kind}_hit_rate"] = round(count / len(times[kind]), 3)
+
+    if args.json:
+        print(json.dumps(result))
+    else:
+        for name, value in result.items():
+            print(f"{name:>14}: {value}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+"""
+ワーカー間の共有状態のベンチマーク
+
+本番モードと同じく --workers 個のプロセスを起動し、共有状態の保存先（memory / sqlite / redis）
+ごとに次の2つを計測する。redis は Redis の代わりに benchmarks/resp_server.py を起動して使う
+（--redis-port を指定すると、そのポートの Redis を使う）。
+
+1. キャッシュ: 各ワーカーが --keys 種類のプロンプト（Zipf 分布）を --lookups 回ずつ
+   ResponseCache で引き、外れたら保存する。全ワーカー合計のヒット率と、1回の get の
+   p50 / p99 を出力する。memory ではワーカーごとに別のキャッシュになる。
+2. 流量制限: 各ワーカーが同じプロバイダーの ProviderLimiter（requests_per_minute = --rpm）で
+   --seconds 秒間できるだけ呼び出し枠を取り、全ワーカー合計の呼び出し数/分を出力する。
+   memory ではワーカー数倍、共有すると設定値に近くなる。
+
+使い方:
+    python benchmarks/bench_shared_state.py
+    python benchmarks/bench_shared_state.py --workers 8 --keys 2000 --lookups 5000
+    python benchmarks/bench_shared_state.py --backends sqlite redis --json
+"""
+
+import argparse
+import asyncio
+import json
+import multiprocessing
+import random
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+ROOT_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT_DIR))
+sys.path.insert(0, str(ROOT_DIR / "benchmarks"))
+
+from backend.cache import ResponseCache  # noqa: E402
+from backend.limiter import ProviderLimiter, _percentile  # noqa: E402
+from backend.shared_state import create_state_backend  # noqa: E402
+
+
+def _cache_worker(config, args, seed, results) -> None:
+    state = create_state_backend(config)
+    cache = ResponseCache(max_entries=args.keys, shared=state if state.shared else None)
+    rng = random.Random(seed)
+    weights = [1 / (rank + 1) for rank in range(args.keys)]
+    keys = rng.choices(range(args.keys), weights=weights, k=args.lookups)
+    times = []
+    for key in keys:
+        start = time.perf_counter()
+        value = cache.get(f"prompt-{key}")
+        times.append(time.perf_counter() - start)
+        if value is None:
+            cache.set(f"prompt-{key}", "response " * 40)
+    stats = cache.get_stats()
+    results.put({"hits": stats["hits"] + stats["shared_hits"], "lookups": args.lookups, "times": times})
+    state.close()
+
+
+def _limiter_worker(config, args, results) -> None:
+    state = create_state_backend(config)
+    limiter = ProviderLimiter({"requests_per_minute": args.rpm, "burst": args.burst}, name="bench",
+                              shared=state if state.shared else None)
+
+    async def run() -> int:
+        calls = 0
+        deadline = time.monotonic() + args.seconds
+        while time.monotonic() < deadline:
+            async with limiter.acquire():
+                calls += 1
+        return calls
+
+    results.put(asyncio.run(run()))
+    state.close()
+
+
+def _run_workers(target, worker_args) -> list:
+    results = multiprocessing.Queue()
+    processes = [multiprocessing.Process(target=target, args=(*extra, results)) for extra in worker_args]
+    for process in processes:
+        process.start()
+    collected = [results.get() for _ in processes]
+    for process in processes:
+        process.join()
+    return collected
+
+
+def bench_backend(name: str, config: dict, args) -> dict:
+    cache_results = _run_workers(_cache_worker, [(config, args, seed) for seed in range(args.workers)])
+    times = [t for result in cache_results for t in result["times"]]
+    hits = sum(result["hits"] for result in cache_results)
+    lookups = sum(result["lookups"] for result in cache_results)
+
+    # 流量制限のカウンターは窓ごとのキーなので、前の実行の値は残らない
+    limiter_results = _run_workers(_limiter_worker, [(config, args)] * args.workers)
+    return {
+        "backend": name,
+        "hit_rate": round(hits / lookups, 3),
+        "get_p50_us": round(_percentile(times, 50) * 1e6, 1),
+        "get_p99_us": round(_percentile(times, 99) * 1e6, 1),
+        "calls_per_minute": round(sum(limiter_results) / args.seconds * 60, 1),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="ワーカー間の共有状態のベンチマーク")
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--backends", nargs="+", default=["memory", "sqlite", "redis"],
+                        choices=["memory", "sqlite", "redis"])
+    parser.add_argument("--keys", type=int, default=1000, help="プロンプトの種類数")
+    parser.add_argument("--lookups", type=int, default=3000, help="ワーカーごとのキャッシュ参照回数")
+    parser.add_argument("--rpm", type=int, default=600, help="流量制限の requests_per_minute")
+    parser.add_argument("--burst", type=int, default=5)
+    parser.add_argument("--seconds", type=float, default=5, help="流量制限を計測する秒数")
+    parser.add_argument("--redis-port", type=int, default=0, help="既存の Redis のポート（省略時は疑似サーバー）")
+    parser.add_argument("--json", action="store_true", help="結果を JSON で出力")
+    args = parser.parse_args()
+
+    proc = None
+    rows = []
+    with tempfile.TemporaryDirectory() as tmp:
+        try:
+            for name in args.backends:
+                config = {"backend": name}
+                if name == "sqlite":
+                    config["sqlite_path"] = str(Path(tmp) / "shared_state.db")
+                elif name == "redis":
+                    port = args.redis_port
+                    if not port:
+                        import resp_server
+                        proc, port = resp_server.start_in_subprocess()
+                    config["redis"] = {"port": port}
+                rows.append(bench_backend(name, config, args))
+        finally:
+            if proc is not None:
+                proc.kill()
+
+    if args.json:
+        print(json.dumps({"workers": args.workers, "rpm": args.rpm, "results": rows}))
+        return
+    print(f"workers={args.workers} keys={args.keys} lookups/worker={args.lookups} rpm={args.rpm}")
+    print(f"{'backend':<8} {'hit_rate':>8} {'get_p50_us':>10} {'get_p99_us':>10} {'calls/min':>10}")
+    for row in rows:
+        print(f"{row['backend']:<8} {row['hit_rate']:>8} {row['get_p50_us']:>10} {row['get_p99_us']:>10} "
+              f"{row['calls_per_minute']:>10}")
+
+
+if __name__ == "__main__":
+    main()
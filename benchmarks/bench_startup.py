@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+"""
+起動時間のベンチマーク
+
+新しい Python プロセスで次の時間を計測し、複数回の中央値を出力する。
+
+- import_ms: backend.app の import
+- create_app_ms: create_app()（設定の読み込みと AIService の初期化）
+- first_request_ms: 最初の /api/translate（SDK の読み込みとクライアント生成を含む）
+
+疑似プロバイダー（fake_server.py）を Anthropic として設定して計測する。
+--json を付けると1行の JSON を出力し、--budget-ms を指定すると合計の中央値が
+それを超えたときに終了コード 1 を返す（CI で起動時間の悪化を検知するため）。
+
+使い方:
+    python benchmarks/bench_startup.py --runs 5
+    python benchmarks/bench_startup.py --runs 5 --json --budget-ms 2000
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+from pathlib import Path
+
+ROOT_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT_DIR))
+
+from fake_server import start_in_subprocess
+
+PHASES = ["import_ms", "create_app_ms", "first_request_ms"]
+
+# 計測用の子プロセスで実行するコード
+_MEASURE = """
+import json, sys, time
+start = time.perf_counter()
+from backend.app import create_app
+imported = time.perf_counter()
+app = create_app()
+created = time.perf_counter()
+response = app.test_client().post("/api/translate", json={"text": "Hello!"})
+assert response.status_code == 200, response.status_code
+finished = time.perf_counter()
+print(json.dumps({
+    "import_ms": (imported - start) * 1000,
+    "create_app_ms": (created - imported) * 1000,
+    "first_request_ms": (finished - created) * 1000,
+    "sdk_modules": sorted(name for name in ("anthropic", "openai") if name in sys.modules),
+}))
+"""
+
+
+def _measure_once(fake_url: str) -> dict:
+    env = dict(os.environ, ANTHROPIC_API_KEY="fake-key", ANTHROPIC_BASE_URL=fake_url)
+    for name in ("AZURE_OPENAI_API_KEY", "AZURE_OPENAI_ENDPOINT"):
+        env.pop(name, None)
+    output = subprocess.run(
+        [sys.executable, "-c", _MEASURE],
+        cwd=str(ROOT_DIR),
+        env=env,
+        capture_output=True,
+        text=True,
+        check=True,
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5, help="計測回数")
+    parser.add_argument("--json", action="store_true", help="結果を1行の JSON で出力")
+    parser.add_argument("--budget-ms", type=float, help="合計時間（中央値）の上限")
+    args = parser.parse_args()
+
+    fake_proc, fake_url = start_in_subprocess(0.0)
+    try:
+        # 1回目はファイルシステムのキャッシュを温めるために捨てる
+        _measure_once(fake_url)
+        runs = [_measure_once(fake_url) for _ in range(args.runs)]
+    finally:
+        fake_proc.terminate()
+
+    result = {phase: round(statistics.median(run[phase] for run in runs), 1) for phase in PHASES}
+    result["total_ms"] = round(statistics.median(sum(run[phase] for phase in PHASES) for run in runs), 1)
+    result["sdk_modules"] = runs[-1]["sdk_modules"]
+    result["runs"] = args.runs
+
+    if args.json:
+        print(json.dumps(result))
+    else:
+        print(f"runs={args.runs} (median)")
+        for phase in PHASES + ["total_ms"]:
+            print(f"{phase:>18}: {result[phase]:8.1f}")
+        print(f"{'sdk_modules':>18}: {', '.join(result['sdk_modules']) or '-'}")
+
+    if args.budget_ms is not None and result["total_ms"] > args.budget_ms:
+        print(f"startup time {result['total_ms']:.1f}ms exceeds budget {args.budget_ms:.1f}ms", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,167 @@
+"""ベンチマーク用のローカル疑似 LLM プロバイダー
+
+Anthropic Messages API と Azure OpenAI Chat Completions API の最小限の応答を
+固定の遅延付きで返す HTTP サーバー。実 API を呼ばずに負荷計測を行うために使う。
+"stream": true のリクエストには、単語ごとに SSE で応答する。
+計測対象のボトルネックにならないよう、asyncio のストリームで最小限の
+HTTP/1.1（keep-alive 対応）だけを実装している。
+"""
+
+import argparse
+import asyncio
+import json
+import subprocess
+import sys
+import time
+from typing import Tuple
+
+REPLY_TEXT = "That sounds great! What did you do last weekend?"
+TOKEN_INTERVAL = 0.02
+
+
+def _anthropic_body() -> dict:
+    return {
+        "id": "msg_fake",
+        "type": "message",
+        "role": "assistant",
+        "model": "fake",
+        "content": [{"type": "text", "text": REPLY_TEXT}],
+        "stop_reason": "end_turn",
+        "stop_sequence": None,
+        "usage": {"input_tokens": 100, "output_tokens": 12},
+    }
+
+
+def _azure_openai_body() -> dict:
+    return {
+        "id": "chatcmpl-fake",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": "fake",
+        "choices": [{
+            "index": 0,
+            "message": {"role": "assistant", "content": REPLY_TEXT},
+            "finish_reason": "stop",
+        }],
+        "usage": {"prompt_tokens": 100, "completion_tokens": 12, "total_tokens": 112},
+    }
+
+
+def _anthropic_stream_events() -> list:
+    words = REPLY_TEXT.split(" ")
+    events = [("message_start", {"type": "message_start", "message": {**_anthropic_body(), "content": [],
+                                                                     "stop_reason": None}}),
+              ("content_block_start", {"type": "content_block_start", "index": 0,
+                                       "content_block": {"type": "text", "text": ""}})]
+    for i, word in enumerate(words):
+        text = word if i == 0 else " " + word
+        events.append(("content_block_delta", {"type": "content_block_delta", "index": 0,
+                                               "delta": {"type": "text_delta", "text": text}}))
+    events += [("content_block_stop", {"type": "content_block_stop", "index": 0}),
+               ("message_delta", {"type": "message_delta", "delta": {"stop_reason": "end_turn", "stop_sequence": None},
+                                  "usage": {"output_tokens": len(words)}}),
+               ("message_stop", {"type": "message_stop"})]
+    return [f"event: {name}\ndata: {json.dumps(data)}\n\n".encode("utf-8") for name, data in events]
+
+
+def _azure_openai_stream_events() -> list:
+    events = []
+    for i, word in enumerate(REPLY_TEXT.split(" ")):
+        text = word if i == 0 else " " + word
+        chunk = {"id": "chatcmpl-fake", "object": "chat.completion.chunk", "created": int(time.time()),
+                 "model": "fake", "choices": [{"index": 0, "delta": {"content": text}, "finish_reason": None}]}
+        events.append(f"data: {json.dumps(chunk)}\n\n".encode("utf-8"))
+    done = {"id": "chatcmpl-fake", "object": "chat.completion.chunk", "created": int(time.time()),
+            "model": "fake", "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}]}
+    usage = {"id": "chatcmpl-fake", "object": "chat.completion.chunk", "created": int(time.time()),
+             "model": "fake", "choices": [], "usage": _azure_openai_body()["usage"]}
+    events.append(f"data: {json.dumps(done)}\n\n".encode("utf-8"))
+    events.append(f"data: {json.dumps(usage)}\n\n".encode("utf-8"))
+    events.append(b"data: [DONE]\n\n")
+    return events
+
+
+async def _write_stream(writer: asyncio.StreamWriter, events: list) -> None:
+    writer.write(b"HTTP/1.1 200 OK\r\nContent-Type: text/event-stream\r\nTransfer-Encoding: chunked\r\n\r\n")
+    for event in events:
+        writer.write(f"{len(event):x}\r\n".encode("ascii") + event + b"\r\n")
+        await writer.drain()
+        await asyncio.sleep(TOKEN_INTERVAL)
+    writer.write(b"0\r\n\r\n")
+    await writer.drain()
+
+
+async def _handle_connection(reader: asyncio.StreamReader, writer: asyncio.StreamWriter, latency: float) -> None:
+    try:
+        while True:
+            request_line = await reader.readline()
+            if not request_line:
+                break
+            path = request_line.split(b" ")[1].decode("latin-1")
+
+            length = 0
+            while True:
+                line = await reader.readline()
+                if line in (b"\r\n", b"\n", b""):
+                    break
+                name, _, value = line.partition(b":")
+                if name.strip().lower() == b"content-length":
+                    length = int(value.strip())
+            request_body = await reader.readexactly(length) if length else b"{}"
+
+            await asyncio.sleep(latency)
+
+            if json.loads(request_body).get("stream"):
+                is_anthropic = path.startswith("/v1/messages")
+                await _write_stream(writer, _anthropic_stream_events() if is_anthropic else _azure_openai_stream_events())
+                continue
+
+            body = _anthropic_body() if path.startswith("/v1/messages") else _azure_openai_body()
+            payload = json.dumps(body).encode("utf-8")
+            writer.write(
+                b"HTTP/1.1 200 OK\r\n"
+                b"Content-Type: application/json\r\n"
+                b"Content-Length: " + str(len(payload)).encode("ascii") + b"\r\n\r\n" + payload
+            )
+            await writer.drain()
+    except (ConnectionError, asyncio.IncompleteReadError):
+        pass
+    finally:
+        writer.close()
+
+
+async def serve(latency: float, port: int = 0) -> None:
+    """疑似プロバイダーを起動し、ベースURLを標準出力に書き出して待機"""
+    server = await asyncio.start_server(
+        lambda r, w: _handle_connection(r, w, latency), "127.0.0.1", port, backlog=4096
+    )
+    host, bound_port = server.sockets[0].getsockname()[:2]
+    print(f"http://{host}:{bound_port}", flush=True)
+    async with server:
+        await server.serve_forever()
+
+
+def start_in_subprocess(latency: float) -> Tuple[subprocess.Popen, str]:
+    """別プロセスでサーバーを起動し、(プロセス, ベースURL) を返す
+
+    計測対象と GIL を共有しないよう、ベンチマークでは別プロセスで動かす。
+    """
+    proc = subprocess.Popen(
+        [sys.executable, __file__, "--latency", str(latency)],
+        stdout=subprocess.PIPE,
+        text=True,
+    )
+    base_url = proc.stdout.readline().strip()
+    return proc, base_url
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="疑似 LLM プロバイダーを起動")
+    parser.add_argument("--latency", type=float, default=0.5)
+    parser.add_argument("--port", type=int, default=0)
+    args = parser.parse_args()
+
+    try:
+        asyncio.run(serve(args.latency, args.port))
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,162 @@
+"""ベンチマーク用のローカル疑似 Redis サーバー
+
+共有状態の RedisBackend（backend/shared_state.py）が使うコマンドだけを実装した
+RESP2 サーバー。Redis をインストールしていない環境で、ワーカー間の共有を計測するために使う。
+対応するコマンドは PING / GET / SET（PX 付き）/ DEL / INCRBY / PEXPIRE（NX 付き）/ AUTH / SELECT と
+WATCH / UNWATCH / MULTI / EXEC / DISCARD で、期限はアクセス時に確認する。データはプロセス内の辞書で、
+永続化しない。コマンドは1つのイベントループで順に処理するため、EXEC はキューに溜めたコマンドを
+他の接続のコマンドと交互にならずに実行する。
+"""
+
+import argparse
+import asyncio
+import subprocess
+import sys
+import time
+from typing import Dict, List, Optional, Tuple
+
+# キー → (値, 期限の時刻。None なら無期限)
+_store: Dict[bytes, Tuple[bytes, Optional[float]]] = {}
+# キー → 書き換えられた回数（WATCH したキーが EXEC までに書き換えられたかの判定に使う）
+_versions: Dict[bytes, int] = {}
+
+WRITE_COMMANDS = (b"SET", b"DEL", b"INCRBY", b"PEXPIRE")
+
+
+def _live(key: bytes) -> Optional[Tuple[bytes, Optional[float]]]:
+    entry = _store.get(key)
+    if entry is not None and entry[1] is not None and entry[1] <= time.monotonic():
+        del _store[key]
+        return None
+    return entry
+
+
+def _bulk(value: Optional[bytes]) -> bytes:
+    if value is None:
+        return b"$-1\r\n"
+    return b"$%d\r\n%s\r\n" % (len(value), value)
+
+
+def _execute(args: List[bytes]) -> bytes:
+    command = args[0].upper()
+    if command == b"PING":
+        return b"+PONG\r\n"
+    if command in (b"AUTH", b"SELECT"):
+        return b"+OK\r\n"
+    if command == b"GET":
+        entry = _live(args[1])
+        return _bulk(entry[0] if entry else None)
+    if command in WRITE_COMMANDS:
+        _touch(args)
+    if command == b"SET":
+        expires_at = None
+        if len(args) >= 5 and args[3].upper() == b"PX":
+            expires_at = time.monotonic() + int(args[4]) / 1000
+        _store[args[1]] = (args[2], expires_at)
+        return b"+OK\r\n"
+    if command == b"DEL":
+        return b":%d\r\n" % sum(_store.pop(key, None) is not None for key in args[1:])
+    if command == b"INCRBY":
+        entry = _live(args[1])
+        try:
+            value = int(entry[0] if entry else b"0") + int(args[2])
+        except ValueError:
+            return b"-ERR value is not an integer or out of range\r\n"
+        _store[args[1]] = (str(value).encode("ascii"), entry[1] if entry else None)
+        return b":%d\r\n" % value
+    if command == b"PEXPIRE":
+        entry = _live(args[1])
+        if entry is None or (len(args) >= 4 and args[3].upper() == b"NX" and entry[1] is not None):
+            return b":0\r\n"
+        _store[args[1]] = (entry[0], time.monotonic() + int(args[2]) / 1000)
+        return b":1\r\n"
+    return b"-ERR unknown command '%s'\r\n" % command
+
+
+def _touch(args: List[bytes]) -> None:
+    keys = args[1:] if args[0].upper() == b"DEL" else args[1:2]
+    for key in keys:
+        _versions[key] = _versions.get(key, 0) + 1
+
+
+def _execute_in_connection(args: List[bytes], state: dict) -> bytes:
+    """接続ごとの状態（WATCH したキー・MULTI で溜めたコマンド）を扱ってからコマンドを実行"""
+    command = args[0].upper()
+    if command == b"WATCH":
+        for key in args[1:]:
+            state["watched"].setdefault(key, _versions.get(key, 0))
+        return b"+OK\r\n"
+    if command == b"UNWATCH":
+        state["watched"].clear()
+        return b"+OK\r\n"
+    if command == b"MULTI":
+        state["queued"] = []
+        return b"+OK\r\n"
+    if command == b"DISCARD":
+        state["queued"] = None
+        state["watched"].clear()
+        return b"+OK\r\n"
+    if command == b"EXEC":
+        queued, state["queued"] = state["queued"] or [], None
+        changed = any(_versions.get(key, 0) != version for key, version in state["watched"].items())
+        state["watched"].clear()
+        if changed:
+            return b"*-1\r\n"
+        return b"*%d\r\n" % len(queued) + b"".join(_execute(queued_args) for queued_args in queued)
+    if state["queued"] is not None:
+        state["queued"].append(args)
+        return b"+QUEUED\r\n"
+    return _execute(args)
+
+
+async def _read_command(reader: asyncio.StreamReader) -> Optional[List[bytes]]:
+    line = await reader.readline()
+    if not line:
+        return None
+    count = int(line[1:-2])
+    args = []
+    for _ in range(count):
+        length = int((await reader.readline())[1:-2])
+        args.append((await reader.readexactly(length + 2))[:-2])
+    return args
+
+
+async def _handle_connection(reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+    state = {"watched": {}, "queued": None}
+    try:
+        while True:
+            args = await _read_command(reader)
+            if args is None:
+                break
+            writer.write(_execute_in_connection(args, state))
+            await writer.drain()
+    except (ConnectionError, asyncio.IncompleteReadError):
+        pass
+    finally:
+        writer.close()
+
+
+async def serve(port: int = 0) -> None:
+    """疑似 Redis サーバーを起動し、ポート番号を標準出力に書き出して待機"""
+    server = await asyncio.start_server(_handle_connection, "127.0.0.1", port, backlog=4096)
+    print(server.sockets[0].getsockname()[1], flush=True)
+    async with server:
+        await server.serve_forever()
+
+
+def start_in_subprocess() -> Tuple[subprocess.Popen, int]:
+    """別プロセスでサーバーを起動し、(プロセス, ポート番号) を返す"""
+    proc = subprocess.Popen([sys.executable, __file__], stdout=subprocess.PIPE, text=True)
+    port = int(proc.stdout.readline().strip())
+    return proc, port
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="疑似 Redis サーバーを起動")
+    parser.add_argument("--port", type=int, default=0)
+    args = parser.parse_args()
+
+    try:
+        asyncio.run(serve(args.port))
+    except KeyboardInterrupt:
+        pass
@@ -1,28 +1,208 @@
 import os
 import json
+import tempfile
+import threading
 from pathlib import Path
-from typing import Dict, Any, Optional
+from types import MappingProxyType
+from typing import Dict, Any, Callable, List, Mapping, Optional, Tuple
+
+# 設定ファイルで指定できるプロバイダー名
+_PROVIDER_NAMES = ("anthropic", "azure_openai", "fake")
+# 共有状態の保存先の名前（backend/shared_state.py）
+_STATE_BACKEND_NAMES = ("memory", "sqlite", "redis")
+# 値がオブジェクトでなければならないセクション
+_SECTION_NAMES = (
+    "api_keys", "azure_openai", "server", "models", "ui", "cache", "sessions", "history",
+    "router", "observability", "translation_batch", "limits", "config_reload", "static_assets",
+    "deadlines", "hint_index", "semantic_cache", "output_budget", "prompt_cache", "fake_provider",
+    "recording", "shared_state"
+)
+
+def _freeze(value: Any) -> Any:
+    """設定値を変更できない形（dict → MappingProxyType, list → tuple）に変換"""
+    if isinstance(value, dict):
+        return MappingProxyType({key: _freeze(item) for key, item in value.items()})
+    if isinstance(value, list):
+        return tuple(_freeze(item) for item in value)
+    return value
+
+def _thaw(value: Any) -> Any:
+    """_freeze した設定値を JSON に書き出せる形に戻す"""
+    if isinstance(value, Mapping):
+        return {key: _thaw(item) for key, item in value.items()}
+    if isinstance(value, tuple):
+        return [_thaw(item) for item in value]
+    return value
+
+def _validate_config(config: Any) -> List[str]:
+    """設定の内容を検証し、問題点の一覧を返す（問題がなければ空）"""
+    if not isinstance(config, dict):
+        return ["設定ファイルの最上位は JSON オブジェクトにしてください"]
+    
+    errors = []
+    for section in _SECTION_NAMES:
+        if config.get(section) is not None and not isinstance(config[section], dict):
+            errors.append(f"{section} はオブジェクトにしてください")
+    
+    default_provider = config.get("default_provider", "anthropic")
+    if default_provider not in _PROVIDER_NAMES:
+        errors.append(f"default_provider は {' / '.join(_PROVIDER_NAMES)} のいずれかにしてください: {default_provider}")
+    
+    models = config.get("models")
+    if isinstance(models, dict):
+        for name, value in models.items():
+            if not isinstance(value, str):
+                errors.append(f"models.{name} は文字列にしてください")
+    
+    server = config.get("server")
+    if isinstance(server, dict) and "port" in server:
+        port = server["port"]
+        if isinstance(port, bool) or not isinstance(port, int) or not 0 < port < 65536:
+            errors.append(f"server.port が不正です: {port}")
+    
+    shared_state = config.get("shared_state")
+    if isinstance(shared_state, dict) and shared_state.get("backend", "memory") not in _STATE_BACKEND_NAMES:
+        errors.append(f"shared_state.backend は {' / '.join(_STATE_BACKEND_NAMES)} のいずれかにしてください: "
+                      f"{shared_state.get('backend')}")
+    return errors
 
 class Settings:
-    """アプリケーション設定を管理するクラス"""
+    """アプリケーション設定を管理するクラス
+    
+    設定ファイルは最初に参照されたときに読み込み、変更できないスナップショットとして
+    保持する（import 時にはファイルを読まない）。start_watching() を呼ぶと
+    バックグラウンドでファイルの変更を監視し、検証を通った新しいスナップショットに
+    丸ごと差し替える。読み出しはスナップショットの参照だけなのでロックを取らない。
+    サーバー設定（ポート・ワーカー数など）の変更は再起動するまで反映されない。
+    """
     
     def __init__(self):
         self.config_dir = Path(__file__).parent
         self.config_file = self.config_dir / "config.json"
-        self._config = self._load_config()
+        self._snapshot: Optional[Mapping[str, Any]] = None
+        self._defaults: Optional[Mapping[str, Any]] = None
+        self._lock = threading.Lock()
+        self._listeners: Dict[Any, Callable[[Mapping[str, Any], Mapping[str, Any]], None]] = {}
+        self._file_state: Optional[Tuple[int, int]] = None
+        self._watcher: Optional[threading.Thread] = None
+        self._stop_watching = threading.Event()
+    
+    @property
+    def _config(self) -> Mapping[str, Any]:
+        """現在の設定のスナップショット（初回参照時に読み込む）"""
+        snapshot = self._snapshot
+        if snapshot is None:
+            with self._lock:
+                if self._snapshot is None:
+                    self._snapshot = _freeze(self._load_config())
+                snapshot = self._snapshot
+        return snapshot
+    
+    def _default(self, section: str) -> Any:
+        """デフォルト設定のセクションを取得（デフォルト設定は一度だけ生成する）"""
+        if self._defaults is None:
+            self._defaults = _freeze(self._default_config())
+        return self._defaults[section]
+    
+    def _section(self, section: str) -> Any:
+        """設定のセクションを取得（設定ファイルになければデフォルト）"""
+        value = self._config.get(section)
+        return value if value is not None else self._default(section)
     
     def _load_config(self) -> Dict[str, Any]:
         """設定ファイルを読み込む"""
+        self._file_state = self._stat_config_file()
         if self.config_file.exists():
             try:
                 with open(self.config_file, 'r', encoding='utf-8') as f:
-                    return json.load(f)
+                    config = json.load(f)
             except (json.JSONDecodeError, IOError) as e:
                 print(f"設定ファイルの読み込みエラー: {e}")
                 return self._default_config()
+            errors = _validate_config(config)
+            if errors:
+                print(f"設定ファイルの内容が不正です: {'; '.join(errors)}")
+                return self._default_config()
+            return config
         else:
             return self._default_config()
     
+    def _stat_config_file(self) -> Optional[Tuple[int, int]]:
+        """設定ファイルの更新時刻とサイズ（ファイルがなければ None）"""
+        try:
+            stat = self.config_file.stat()
+        except OSError:
+            return None
+        return (stat.st_mtime_ns, stat.st_size)
+    
+    def add_listener(self, callback: Callable[[Mapping[str, Any], Mapping[str, Any]], None],
+                     name: Optional[str] = None) -> None:
+        """設定を差し替えたときに callback(古い設定, 新しい設定) を呼ぶよう登録
+        
+        name を指定した場合は、同じ名前で登録済みのものを置き換える（アプリを作り直しても
+        古いアプリの callback が残らないようにする）。
+        """
+        self._listeners[name if name is not None else callback] = callback
+    
+    def remove_listener(self, name_or_callback: Any) -> None:
+        """add_listener で登録したもの（名前か callback）を解除"""
+        self._listeners.pop(name_or_callback, None)
+    
+    def reload(self) -> bool:
+        """設定ファイルを読み直し、検証を通れば新しいスナップショットに差し替える
+        
+        読み込みや検証に失敗した場合は今の設定を使い続け、False を返す。
+        """
+        with self._lock:
+            self._file_state = self._stat_config_file()
+            if self._file_state is None:
+                return False
+            try:
+                with open(self.config_file, 'r', encoding='utf-8') as f:
+                    config = json.load(f)
+            except (json.JSONDecodeError, IOError) as e:
+                print(f"設定ファイルの再読み込みエラー（今の設定を使い続けます）: {e}")
+                return False
+            errors = _validate_config(config)
+            if errors:
+                print(f"設定ファイルの内容が不正です（今の設定を使い続けます）: {'; '.join(errors)}")
+                return False
+            
+            old = self._snapshot if self._snapshot is not None else _freeze({})
+            new = _freeze(config)
+            self._snapshot = new
+        
+        print("設定ファイルを再読み込みしました")
+        for callback in list(self._listeners.values()):
+            try:
+                callback(old, new)
+            except Exception as e:
+                print(f"設定の反映エラー: {e}")
+        return True
+    
+    def start_watching(self, interval: float = 2.0) -> None:
+        """設定ファイルの変更の監視を開始（ワーカーごとに1つのスレッドで更新時刻を調べる）"""
+        if self._watcher is not None and self._watcher.is_alive():
+            return
+        # 監視の基準にするため、まだ読み込んでいなければここで読み込む
+        self._config
+        if self._file_state is None:
+            self._file_state = self._stat_config_file()
+        self._stop_watching.clear()
+        
+        def watch() -> None:
+            while not self._stop_watching.wait(interval):
+                state = self._stat_config_file()
+                if state is not None and state != self._file_state:
+                    self.reload()
+        
+        self._watcher = threading.Thread(target=watch, name="config-watcher", daemon=True)
+        self._watcher.start()
+    
+    def stop_watching(self) -> None:
+        """設定ファイルの監視を停止"""
+        self._stop_watching.set()
+    
     def _default_config(self) -> Dict[str, Any]:
         """デフォルト設定を返す"""
         return {
@@ -39,7 +219,19 @@ class Settings:
             "server": {
                 "host": "0.0.0.0",
                 "port": 8000,
-                "debug": True
+                "debug": False,
+                "mode": "development",
+                "production": {
+                    "workers": 0,
+                    "threads": 128,
+                    "keepalive": 5,
+                    "timeout": 120,
+                    "graceful_timeout": 30,
+                    "backlog": 2048,
+                    "max_requests": 0,
+                    "max_requests_jitter": 0,
+                    "accesslog": ""
+                }
             },
             "models": {
                 "anthropic": "claude-3-haiku-20240307",
@@ -48,16 +240,183 @@ class Settings:
             "ui": {
                 "default_level": "400",
                 "theme": "light"
+            },
+            "cache": {
+                "enabled": True,
+                "max_entries": 1000,
+                "ttl_seconds": 86400,
+                "disk_path": ""
+            },
+            "semantic_cache": {
+                "enabled": True,
+                "max_entries": 20000,
+                "dim": 256,
+                "ttl_seconds": 86400,
+                "top_k": 5,
+                "thresholds": {
+                    "translate": 0.8
+                }
+            },
+            "sessions": {
+                "max_turns": 20,
+                "ttl_seconds": 21600,
+                "max_sessions": 10000,
+                "db_path": ""
+            },
+            "history": {
+                "max_messages": 16,
+                "min_recent_messages": 2,
+                "summary_max_tokens": 300,
+                "input_token_budgets": {
+                    "anthropic": {"400": 1500, "600": 2000, "800": 3000},
+                    "azure_openai": {"400": 1500, "600": 2000, "800": 3000}
+                }
+            },
+            "router": {
+                "failover": True,
+                "window_size": 100,
+                "min_samples": 10,
+                "error_threshold": 0.5,
+                "failure_threshold": 3,
+                "cooldown_seconds": 30,
+                "hedge": {
+                    "enabled": False,
+                    "percentile": 95,
+                    "min_samples": 20,
+                    "min_delay_ms": 300
+                }
+            },
+            "observability": {
+                "metrics_enabled": True,
+                "json_logs": False,
+                "profiler": {
+                    "sample_rate": 0.0,
+                    "output_dir": "data/profiles"
+                }
+            },
+            "translation_batch": {
+                "max_texts": 200,
+                "max_items": 20,
+                "max_input_tokens": 1500,
+                "max_output_tokens": 4000,
+                "output_ratio": 3
+            },
+            "limits": {
+                "providers": {
+                    "anthropic": {"max_concurrency": 64, "requests_per_minute": 0, "burst": 5},
+                    "azure_openai": {"max_concurrency": 64, "requests_per_minute": 0, "burst": 5}
+                },
+                "max_queue": 1000,
+                "queue_timeout_seconds": 30,
+                "priority_classes": {
+                    "interactive": {"share": 1.0},
+                    "analysis": {"share": 0.75, "max_wait_seconds": 20},
+                    "background": {"share": 0.25, "max_wait_seconds": 60}
+                },
+                "coalesce": True,
+                "client_shards": 8,
+                "retry": {
+                    "max_retries": 2,
+                    "base_delay_ms": 500,
+                    "max_delay_ms": 8000,
+                    "max_retry_after_seconds": 20
+                }
+            },
+            "config_reload": {
+                "enabled": True,
+                "interval_seconds": 2
+            },
+            "prompt_cache": {
+                "enabled": True
+            },
+            "fake_provider": {
+                "enabled": False,
+                "ttft_ms": {"distribution": "lognormal", "median": 400, "sigma": 0.35},
+                "output_tokens": {"distribution": "lognormal", "median": 60, "sigma": 0.5},
+                "tokens_per_second": 50,
+                "error_rate": 0.0,
+                "rate_limit_rate": 0.0,
+                "retry_after_seconds": 1,
+                "seed": None
+            },
+            "recording": {
+                "mode": "off",
+                "path": "data/recordings/provider_calls.jsonl",
+                "replay_timing": True
+            },
+            "shared_state": {
+                "backend": "memory",
+                "sqlite_path": "data/shared_state.db",
+                "call_timeout_ms": 50,
+                "redis": {
+                    "host": "127.0.0.1",
+                    "port": 6379,
+                    "db": 0,
+                    "password": "",
+                    "timeout_seconds": 1.0
+                }
+            },
+            "output_budget": {
+                "enabled": True,
+                "percentile": 99,
+                "headroom": 1.25,
+                "min_samples": 20,
+                "window_size": 500,
+                "record_path": "",
+                "endpoints": {
+                    "chat": {"ratio": 4.0, "base": 80, "min_tokens": 150, "on_truncation": "trim"},
+                    "translate": {"ratio": 3.0, "base": 40, "min_tokens": 80, "on_truncation": "retry"},
+                    "feedback": {"base": 400, "min_tokens": 250, "on_truncation": "trim"},
+                    "hint": {"base": 250, "min_tokens": 150, "on_truncation": "trim"}
+                }
+            },
+            "deadlines": {
+                "endpoints": {
+                    "chat": 60,
+                    "chat_stream": 120,
+                    "translate": 30,
+                    "translate_batch": 90,
+                    "feedback": 30,
+                    "turn_analysis": 45,
+                    "hint": 20
+                },
+                "disconnect_check_interval_ms": 250
+            },
+            "static_assets": {
+                "compress_min_bytes": 512,
+                "gzip_level": 9,
+                "brotli_quality": 11,
+                "auto_rebuild": False
+            },
+            "hint_index": {
+                "enabled": True,
+                "seed_path": "data/hint_phrases.json",
+                "db_path": "",
+                "min_score": 0.8,
+                "write_back": False
             }
         }
     
     def save_config(self) -> None:
-        """設定をファイルに保存"""
+        """設定をファイルに保存
+        
+        同じディレクトリの一時ファイルに書き出してから置き換えるため、
+        監視中のワーカーが書きかけのファイルを読むことはない。
+        """
+        temp_path = None
         try:
-            with open(self.config_file, 'w', encoding='utf-8') as f:
-                json.dump(self._config, f, indent=2, ensure_ascii=False)
+            with tempfile.NamedTemporaryFile('w', encoding='utf-8', dir=self.config_dir,
+                                             prefix='.config-', suffix='.json', delete=False) as f:
+                temp_path = f.name
+                json.dump(_thaw(self._config), f, indent=2, ensure_ascii=False)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(temp_path, self.config_file)
+            self._file_state = self._stat_config_file()
         except IOError as e:
             print(f"設定ファイルの保存エラー: {e}")
+            if temp_path and os.path.exists(temp_path):
+                os.unlink(temp_path)
     
     def get_api_key(self, provider: str) -> Optional[str]:
         """APIキーを取得（環境変数 > 設定ファイルの順）"""
@@ -74,22 +433,105 @@ class Settings:
         # 設定ファイルから取得
         return self._config.get("api_keys", {}).get(provider)
     
-    def get_server_config(self) -> Dict[str, Any]:
+    def get_server_config(self) -> Mapping[str, Any]:
         """サーバー設定を取得"""
-        return self._config.get("server", self._default_config()["server"])
+        return self._section("server")
     
     def get_model(self, provider: str) -> str:
         """指定されたプロバイダーのモデル名を取得"""
-        models = self._config.get("models", self._default_config()["models"])
+        models = self._section("models")
         return models.get(provider, models["anthropic"])
     
     def get_default_provider(self) -> str:
         """デフォルトプロバイダーを取得"""
         return self._config.get("default_provider", "anthropic")
     
-    def get_ui_config(self) -> Dict[str, Any]:
+    def get_ui_config(self) -> Mapping[str, Any]:
         """UI設定を取得"""
-        return self._config.get("ui", self._default_config()["ui"])
+        return self._section("ui")
+    
+    def get_cache_config(self) -> Mapping[str, Any]:
+        """レスポンスキャッシュ設定を取得"""
+        return self._section("cache")
+    
+    def get_semantic_cache_config(self) -> Mapping[str, Any]:
+        """近似重複キャッシュの設定を取得（thresholds は呼び出しの種類ごとの類似度のしきい値）"""
+        return self._section("semantic_cache")
+    
+    def get_session_config(self) -> Mapping[str, Any]:
+        """会話セッション設定を取得"""
+        return self._section("sessions")
+    
+    def get_history_config(self) -> Mapping[str, Any]:
+        """会話履歴ウィンドウ設定を取得"""
+        return self._section("history")
+    
+    def get_history_budget(self, provider: str, level: str) -> int:
+        """プロバイダー・レベルごとの会話履歴の入力トークン予算を取得"""
+        default_budgets = self._default("history")["input_token_budgets"]
+        budgets = self.get_history_config().get("input_token_budgets", default_budgets)
+        provider_budgets = budgets.get(provider, default_budgets["anthropic"])
+        return provider_budgets.get(level, provider_budgets.get("400", 1500))
+    
+    def get_router_config(self) -> Mapping[str, Any]:
+        """プロバイダールーティング設定を取得"""
+        return self._section("router")
+    
+    def get_observability_config(self) -> Mapping[str, Any]:
+        """メトリクス・ログ・プロファイラーの設定を取得"""
+        return self._section("observability")
+    
+    def get_translation_batch_config(self) -> Mapping[str, Any]:
+        """一括翻訳の設定を取得"""
+        return self._section("translation_batch")
+    
+    def get_limits_config(self) -> Mapping[str, Any]:
+        """外部 API 呼び出しの流量制御設定を取得（requests_per_minute が 0 なら無制限）"""
+        return self._section("limits")
+    
+    def get_config_reload_config(self) -> Mapping[str, Any]:
+        """設定ファイルの監視・再読み込みの設定を取得"""
+        return self._section("config_reload")
+    
+    def get_fake_provider_config(self) -> Mapping[str, Any]:
+        """負荷試験用の疑似プロバイダー（遅延・トークンレート・エラーの発生率）の設定を取得"""
+        return self._section("fake_provider")
+    
+    def get_recording_config(self) -> Mapping[str, Any]:
+        """プロバイダー呼び出しの記録・再生（mode: off / record / replay）の設定を取得"""
+        return self._section("recording")
+    
+    def get_shared_state_config(self) -> Mapping[str, Any]:
+        """ワーカー間で共有する状態の保存先（backend: memory / sqlite / redis）の設定を取得
+        
+        保存先は起動時に開くため、変更は再起動するまで反映されない。
+        """
+        return self._section("shared_state")
+    
+    def get_prompt_cache_config(self) -> Mapping[str, Any]:
+        """プロバイダー側のプロンプトキャッシュ（Anthropic の cache_control）の設定を取得"""
+        return self._section("prompt_cache")
+    
+    def get_output_budget_config(self) -> Mapping[str, Any]:
+        """出力トークン予算（呼び出しの種類ごとの max_tokens の決め方）の設定を取得"""
+        return self._section("output_budget")
+    
+    def get_deadlines_config(self) -> Mapping[str, Any]:
+        """エンドポイントごとの締め切りの設定を取得"""
+        return self._section("deadlines")
+    
+    def get_deadline(self, endpoint: Optional[str]) -> Optional[float]:
+        """エンドポイントの締め切り（秒）を取得（0 または未設定なら締め切りなし）"""
+        endpoints = self.get_deadlines_config().get("endpoints", self._default("deadlines")["endpoints"])
+        return endpoints.get(endpoint) or None
+    
+    def get_static_assets_config(self) -> Mapping[str, Any]:
+        """静的ファイル配信（ハッシュ付き URL・事前圧縮）の設定を取得"""
+        return self._section("static_assets")
+    
+    def get_hint_index_config(self) -> Mapping[str, Any]:
+        """ヒント用フレーズ索引の設定を取得"""
+        return self._section("hint_index")
     
     def get_azure_openai_endpoint(self) -> Optional[str]:
         """Azure OpenAI エンドポイントを取得（環境変数 > 設定ファイルの順）"""
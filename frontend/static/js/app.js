@@ -7,6 +7,9 @@ class EnglishLearningApp {
     constructor() {
         this.conversationHistory = [];
         this.translationHistory = [];
+        this.sessionId = null;
+        // 会話のリセット時に、実行中のチャット・分析のリクエストを中止する
+        this.abortController = new AbortController();
         this.currentLevel = '400';
         this.currentProvider = 'anthropic';
         this.isDarkMode = false;
@@ -229,33 +232,50 @@ class EnglishLearningApp {
         this.conversationHistory.push({ role: 'user', content: message });
         
         try {
-            // まずAI回答を取得して表示
-            const aiResponse = await this.getAIResponse(message);
-            const teacherMessageId = this.addMessageToConversation(aiResponse, 'ai');
+            // AI回答をストリーミングで受け取り、最初のトークンが届いた時点で表示を開始
+            let teacherMessageId = null;
+            let teacherTextElement = null;
+            const aiResponse = await this.getAIResponse(message, (partialText) => {
+                if (!teacherTextElement) {
+                    // 回答の表示が始まったらLoadingを終了
+                    this.hideLoading();
+                    teacherMessageId = this.addMessageToConversation('', 'ai');
+                    teacherTextElement = this.elements.conversationContent.lastElementChild.querySelector('.message-content p');
+                }
+                teacherTextElement.textContent = partialText;
+                this.scrollToBottom(this.elements.conversationContent);
+            });
+            if (!teacherMessageId) {
+                this.hideLoading();
+                teacherMessageId = this.addMessageToConversation(aiResponse, 'ai');
+            } else {
+                teacherTextElement.textContent = aiResponse;
+            }
             this.conversationHistory.push({ role: 'assistant', content: aiResponse });
-            
-            // AI回答が表示されたらLoadingを終了
-            this.hideLoading();
 
             // 翻訳とフィードバックを背景で並列処理
             this.showPanelLoading();
             this.processTranslationAndFeedback(message, aiResponse, this.lastUserMessageId, teacherMessageId);
 
         } catch (error) {
-            console.error('AI response error:', error);
-            this.addSystemMessage('AI回答の取得中にエラーが発生しました。');
             this.hideLoading();
+            if (error.name === 'AbortError') return;
+            console.error('AI response error:', error);
+            if (error.message.includes('deadline_exceeded') || error.message.includes('504')) {
+                this.addSystemMessage('AI回答に時間がかかりすぎたため中止しました。もう一度お試しください。');
+            } else {
+                this.addSystemMessage('AI回答の取得中にエラーが発生しました。');
+            }
         }
     }
 
     async processTranslationAndFeedback(userMessage, aiResponse, userMessageId, teacherMessageId) {
         try {
-            // 並列処理で翻訳とフィードバックを取得
-            const [userTranslation, teacherTranslation, feedback] = await Promise.all([
-                this.getTranslation(userMessage),
-                this.getTranslation(aiResponse),
-                this.getFeedback(userMessage)
-            ]);
+            // 翻訳2件とフィードバックを1リクエストで取得（サーバー側で並列処理）
+            const analysis = await this.getTurnAnalysis(userMessage, aiResponse);
+            // 次のターンに追い越された分析は表示しない
+            if (!analysis) return;
+            const { userTranslation, teacherTranslation, feedback } = analysis;
 
             // 翻訳とフィードバックを更新
             this.updateTranslation(userMessage, userTranslation, userMessageId);
@@ -263,6 +283,7 @@ class EnglishLearningApp {
             this.updateFeedback(feedback);
 
         } catch (error) {
+            if (error.name === 'AbortError') return;
             console.error('Translation/Feedback error:', error);
             this.addSystemMessage('翻訳またはフィードバックの取得中にエラーが発生しました。');
         } finally {
@@ -270,23 +291,95 @@ class EnglishLearningApp {
         }
     }
 
-    async getAIResponse(message) {
-        const response = await fetch('/api/chat', {
+    async getAIResponse(message, onPartial = null) {
+        const response = await fetch('/api/chat/stream', {
             method: 'POST',
             headers: { 'Content-Type': 'application/json' },
             body: JSON.stringify({
                 message: message,
                 level: this.currentLevel,
-                history: this.conversationHistory
-            })
+                session_id: this.sessionId
+            }),
+            signal: this.abortController.signal
         });
 
         if (!response.ok) {
             throw new Error(`AI API Error: ${response.status}`);
         }
 
+        // Server-Sent Events を読み取り、届いたトークンを逐次反映する
+        const reader = response.body.getReader();
+        const decoder = new TextDecoder();
+        let buffer = '';
+        let text = '';
+
+        while (true) {
+            const { value, done } = await reader.read();
+            if (done) break;
+            buffer += decoder.decode(value, { stream: true });
+
+            let separatorIndex;
+            while ((separatorIndex = buffer.indexOf('\n\n')) !== -1) {
+                const event = this.parseServerSentEvent(buffer.slice(0, separatorIndex));
+                buffer = buffer.slice(separatorIndex + 2);
+
+                if (event.type === 'delta') {
+                    text += event.data.text;
+                    if (onPartial) onPartial(text);
+                } else if (event.type === 'done') {
+                    // 会話履歴はサーバー側のセッションで保持される
+                    this.sessionId = event.data.session_id || this.sessionId;
+                    return event.data.response;
+                } else if (event.type === 'error') {
+                    throw new Error(`AI API Error: ${event.data.error}`);
+                }
+            }
+        }
+
+        return text;
+    }
+
+    parseServerSentEvent(block) {
+        let type = 'message';
+        const dataLines = [];
+        for (const line of block.split('\n')) {
+            if (line.startsWith('event:')) {
+                type = line.slice(6).trim();
+            } else if (line.startsWith('data:')) {
+                dataLines.push(line.slice(5).trim());
+            }
+        }
+        return { type: type, data: dataLines.length ? JSON.parse(dataLines.join('\n')) : {} };
+    }
+
+    async getTurnAnalysis(userMessage, aiResponse) {
+        const response = await fetch('/api/turn-analysis', {
+            method: 'POST',
+            headers: { 'Content-Type': 'application/json' },
+            body: JSON.stringify({
+                user_text: userMessage,
+                teacher_text: aiResponse,
+                context_text: this.getLastTeacherMessage(),
+                level: this.currentLevel,
+                session_id: this.sessionId
+            }),
+            signal: this.abortController.signal
+        });
+
+        if (response.status === 409) {
+            // 次のターンが始まったため、サーバーが分析を打ち切った（何も表示しない）
+            return null;
+        }
+        if (!response.ok) {
+            throw new Error(`Turn analysis API Error: ${response.status}`);
+        }
+
         const data = await response.json();
-        return data.response;
+        return {
+            userTranslation: data.user_translation,
+            teacherTranslation: data.teacher_translation,
+            feedback: data.feedback
+        };
     }
 
     async getTranslation(text) {
@@ -295,10 +388,14 @@ class EnglishLearningApp {
             headers: { 'Content-Type': 'application/json' },
             body: JSON.stringify({
                 text: text,
-                target_language: 'japanese'
+                target_language: 'japanese',
+                session_id: this.sessionId
             })
         });
 
+        if (response.status === 409) {
+            return null;
+        }
         if (!response.ok) {
             throw new Error(`Translation API Error: ${response.status}`);
         }
@@ -320,6 +417,9 @@ class EnglishLearningApp {
             })
         });
 
+        if (response.status === 409) {
+            return null;
+        }
         if (!response.ok) {
             throw new Error(`Feedback API Error: ${response.status}`);
         }
@@ -396,6 +496,21 @@ class EnglishLearningApp {
     }
 
     async resetConversation() {
+        // 実行中のリクエストを中止（サーバー側でもプロバイダーへの呼び出しが取り消される）
+        this.abortController.abort();
+        this.abortController = new AbortController();
+
+        // サーバー側のセッションを破棄
+        if (this.sessionId) {
+            fetch(`/api/session/${this.sessionId}`, { method: 'DELETE' }).catch((error) => {
+                console.error('セッションの削除に失敗しました:', error);
+            });
+            this.sessionId = null;
+
+            // プロバイダーの選択は新しいセッションに引き継ぐ
+            await this.switchProvider(this.currentProvider, false);
+        }
+
         // 会話履歴をクリア
         this.conversationHistory = [];
         this.translationHistory = [];
@@ -544,7 +659,8 @@ class EnglishLearningApp {
                 },
                 body: JSON.stringify({
                     japanese_text: japaneseText,
-                    level: this.currentLevel
+                    level: this.currentLevel,
+                    session_id: this.sessionId
                 })
             });
 
@@ -590,12 +706,12 @@ class EnglishLearningApp {
         document.body.style.overflow = '';
     }
 
-    async switchProvider(provider) {
+    async switchProvider(provider, announce = true) {
         try {
             const response = await fetch('/api/switch-provider', {
                 method: 'POST',
                 headers: { 'Content-Type': 'application/json' },
-                body: JSON.stringify({ provider: provider })
+                body: JSON.stringify({ provider: provider, session_id: this.sessionId })
             });
 
             if (!response.ok) {
@@ -604,6 +720,11 @@ class EnglishLearningApp {
 
             const data = await response.json();
             if (data.success) {
+                // プロバイダーの選択はセッションに紐づく
+                this.sessionId = data.session_id;
+                if (!announce) {
+                    return;
+                }
                 const providerNames = {
                     'anthropic': 'Claude (Anthropic)',
                     'azure_openai': 'GPT (Azure OpenAI)'
@@ -4,19 +4,53 @@ English Learning App
 メインエントリーポイント
 """
 
+import argparse
 from backend.app import create_app
 from config.settings import settings
 
+def parse_args() -> argparse.Namespace:
+    """コマンドライン引数を解析（指定した値は設定ファイルより優先）"""
+    parser = argparse.ArgumentParser(description="English Learning App")
+    parser.add_argument('--production', action='store_true',
+                        help='本番モード（gunicorn の複数ワーカー）で起動する')
+    parser.add_argument('--workers', type=int, help='本番モードのワーカープロセス数')
+    parser.add_argument('--threads', type=int, help='本番モードのワーカーあたりのスレッド数')
+    parser.add_argument('--port', type=int, help='待ち受けポート')
+    return parser.parse_args()
+
 def main():
     """アプリケーションを起動"""
-    print("English Learning App を起動しています...")
-    
-    app = create_app()
-    server_config = settings.get_server_config()
+    args = parse_args()
+    server_config = dict(settings.get_server_config())
+    production_config = dict(server_config.get('production', {}))
+    if args.port:
+        server_config['port'] = args.port
+    if args.workers:
+        production_config['workers'] = args.workers
+    if args.threads:
+        production_config['threads'] = args.threads
+    server_config['production'] = production_config
     
     host = server_config.get('host', '0.0.0.0')
     port = server_config.get('port', 8000)
-    debug = server_config.get('debug', True)
+    debug = server_config.get('debug', False)
+    production = args.production or server_config.get('mode', 'development') == 'production'
+    
+    if production:
+        try:
+            from backend.server import build_options, run_production
+        except ImportError:
+            print("本番モードには gunicorn が必要です: pip install gunicorn")
+            return
+        options = build_options(server_config)
+        print(f"English Learning App を本番モードで起動しています: http://localhost:{port} "
+              f"(workers={options['workers']}, threads={options['threads']})")
+        run_production(server_config)
+        return
+    
+    print("English Learning App を起動しています...")
+    
+    app = create_app()
     
     print(f"サーバーを起動しました: http://localhost:{port}")
     
@@ -28,4 +62,4 @@ def main():
         print(f"エラーが発生しました: {e}")
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,57 @@
+"""テスト共通の設定"""
+
+import sys
+from pathlib import Path
+
+import pytest
+
+ROOT_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT_DIR))
+
+from config.settings import _freeze, settings  # noqa: E402
+
+
+@pytest.fixture
+def use_config(monkeypatch):
+    """設定のスナップショットを差し替える関数（テストの終わりに元に戻す）
+
+    指定しなかったセクションはデフォルト設定になる。API キーは環境変数からも
+    読まれるため、テスト中は消しておく。
+    """
+    for name in ("ANTHROPIC_API_KEY", "AZURE_OPENAI_API_KEY", "AZURE_OPENAI_ENDPOINT"):
+        monkeypatch.delenv(name, raising=False)
+
+    def apply(config=None):
+        monkeypatch.setattr(settings, "_snapshot", _freeze(config or {}))
+
+    apply()
+    return apply
+
+
+# 遅延なしで短い回答を返す疑似プロバイダーの設定
+FAST_FAKE_PROVIDER = {
+    "enabled": True,
+    "ttft_ms": {"distribution": "fixed", "value": 0},
+    "output_tokens": {"distribution": "fixed", "value": 5},
+    "tokens_per_second": 100000,
+    "seed": 1
+}
+
+
+@pytest.fixture
+def app(use_config, monkeypatch):
+    """疑似プロバイダーをデフォルトにした Flask アプリ"""
+    from backend.app import create_app
+
+    use_config({
+        "default_provider": "fake",
+        "fake_provider": FAST_FAKE_PROVIDER,
+        "config_reload": {"enabled": False}
+    })
+    monkeypatch.setattr(settings, "_listeners", {})
+    return create_app()
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
@@ -0,0 +1,134 @@
+"""Flask エンドポイントのテスト"""
+
+import asyncio
+import json
+import time
+
+from backend.scheduler import SupersededError
+
+
+def test_translate_returns_translation(client):
+    response = client.post("/api/translate", json={"text": "I went to Tokyo yesterday."})
+
+    assert response.status_code == 200
+    assert response.get_json()["translation"]
+
+
+def test_turn_analysis_returns_all_three_results(client):
+    response = client.post("/api/turn-analysis", json={
+        "user_text": "I went to Tokyo.", "teacher_text": "What did you do there?", "level": "600"
+    })
+
+    assert response.status_code == 200
+    assert set(response.get_json()) == {"user_translation", "teacher_translation", "feedback"}
+
+
+def supersede(app, monkeypatch):
+    async def call(*args, **kwargs):
+        raise SupersededError("a newer turn started in this session")
+
+    monkeypatch.setattr(app.extensions["ai_service"].router, "call", call)
+
+
+def test_superseded_turn_analysis_returns_409(app, client, monkeypatch):
+    supersede(app, monkeypatch)
+    response = client.post("/api/turn-analysis", json={
+        "user_text": "I went to Tokyo.", "teacher_text": "What did you do there?", "session_id": "s1"
+    })
+
+    assert response.status_code == 409
+    assert response.get_json()["superseded"] is True
+
+
+def test_superseded_translate_and_feedback_return_409(app, client, monkeypatch):
+    supersede(app, monkeypatch)
+
+    assert client.post("/api/translate", json={"text": "I went to Kyoto."}).status_code == 409
+    assert client.post("/api/feedback", json={"text": "I went to Kyoto."}).status_code == 409
+
+
+def test_turn_analysis_requires_both_texts(client):
+    response = client.post("/api/turn-analysis", json={"user_text": "I went to Tokyo."})
+
+    assert response.status_code == 400
+
+
+def test_turn_analysis_runs_calls_in_parallel_with_context_text(app, client, monkeypatch):
+    service = app.extensions["ai_service"]
+    feedback_contexts = []
+
+    async def translation(text, target_language="japanese", provider=None):
+        await asyncio.sleep(0.2)
+        return f"ja:{text}"
+
+    async def feedback(text, level, teacher_text=None, provider=None):
+        feedback_contexts.append(teacher_text)
+        await asyncio.sleep(0.2)
+        return "feedback"
+
+    monkeypatch.setattr(service, "get_translation", translation)
+    monkeypatch.setattr(service, "get_feedback", feedback)
+    start = time.perf_counter()
+    response = client.post("/api/turn-analysis", json={
+        "user_text": "I went to Tokyo.", "teacher_text": "Nice!", "context_text": "Where did you go?"
+    })
+
+    assert time.perf_counter() - start < 0.5
+    assert response.get_json() == {
+        "user_translation": "ja:I went to Tokyo.", "teacher_translation": "ja:Nice!", "feedback": "feedback"
+    }
+    assert feedback_contexts == ["Where did you go?"]
+
+
+def sse_events(response):
+    """SSE のレスポンスを (イベント名, データ) のリストにする"""
+    events = []
+    for block in response.get_data(as_text=True).strip().split("\n\n"):
+        lines = dict(line.split(": ", 1) for line in block.splitlines())
+        events.append((lines["event"], json.loads(lines["data"])))
+    return events
+
+
+def test_chat_stream_sends_deltas_then_full_response(client):
+    response = client.post("/api/chat/stream", json={"message": "Hello!", "level": "400"})
+
+    assert response.mimetype == "text/event-stream"
+    assert response.headers["Cache-Control"] == "no-cache"
+    events = sse_events(response)
+    deltas = [data["text"] for name, data in events if name == "delta"]
+    name, done = events[-1]
+    assert name == "done" and deltas
+    assert done["response"] == "".join(deltas)
+    assert done["session_id"]
+
+
+def test_chat_stream_requires_message(client):
+    assert client.post("/api/chat/stream", json={"message": ""}).status_code == 400
+
+
+def test_chat_session_keeps_history_on_the_server(app, client):
+    service = app.extensions["ai_service"]
+    create = service.providers["fake"].create
+    sent = []
+
+    async def recording_create(system, messages, *args, **kwargs):
+        sent.append(messages)
+        return await create(system, messages, *args, **kwargs)
+
+    service.providers["fake"].create = recording_create
+    session_id = client.post("/api/chat", json={"message": "I like cats."}).get_json()["session_id"]
+    second = client.post("/api/chat", json={"message": "Do you?", "session_id": session_id}).get_json()
+
+    assert second["session_id"] == session_id
+    assert sent[1][0]["content"] == "I like cats." and sent[1][-1]["content"] == "Do you?"
+
+    assert client.delete(f"/api/session/{session_id}").get_json() == {"success": True}
+    assert service.session_store.get(session_id) is None
+
+
+def test_chat_with_client_history_does_not_create_session(client):
+    response = client.post("/api/chat", json={
+        "message": "Do you?", "history": [{"role": "user", "content": "I like cats."}]
+    })
+
+    assert "session_id" not in response.get_json()
@@ -0,0 +1,93 @@
+"""静的ファイル配信（AssetPipeline / StaticAsset / 静的ファイルのエンドポイント）のテスト"""
+
+import gzip
+import re
+
+import pytest
+
+from backend.assets import IMMUTABLE_CACHE_CONTROL, REVALIDATE_CACHE_CONTROL, AssetPipeline, brotli
+
+
+@pytest.fixture
+def static_site(tmp_path):
+    static_dir = tmp_path / "static"
+    (static_dir / "css").mkdir(parents=True)
+    (static_dir / "css" / "style.css").write_text("body { color: red; }\n" * 100)
+    (static_dir / "small.js").write_text("x = 1;")
+    index_file = tmp_path / "index.html"
+    index_file.write_text('<link href="static/css/style.css"><script src="/static/small.js"></script>'
+                          '<img src="static/missing.png">')
+    return static_dir, index_file
+
+
+def test_fingerprint_inserts_digest_before_suffix():
+    assert AssetPipeline.fingerprint("css/style.css", "abc") == "css/style.abc.css"
+    assert AssetPipeline.fingerprint("LICENSE", "abc") == "LICENSE.abc"
+    assert AssetPipeline.fingerprint("v1.0/LICENSE", "abc") == "v1.0/LICENSE.abc"
+
+
+def test_build_rewrites_index_references(static_site):
+    pipeline = AssetPipeline(*static_site)
+    html = pipeline.index.variants["identity"].decode()
+
+    assert f'href="static/{pipeline.urls["css/style.css"]}"' in html
+    assert f'src="/static/{pipeline.urls["small.js"]}"' in html
+    assert 'src="static/missing.png"' in html
+    assert pipeline.lookup(pipeline.urls["small.js"]) == (pipeline.assets["small.js"], True)
+    assert pipeline.lookup("small.js") == (pipeline.assets["small.js"], False)
+
+
+def test_only_compressible_files_get_compressed_variants(static_site):
+    pipeline = AssetPipeline(*static_site)
+    style = pipeline.assets["css/style.css"]
+
+    assert gzip.decompress(style.variants["gzip"]) == style.variants["identity"]
+    assert ("br" in style.variants) == (brotli is not None)
+    assert list(pipeline.assets["small.js"].variants) == ["identity"]
+
+
+def test_auto_rebuild_picks_up_changed_files(static_site):
+    static_dir, index_file = static_site
+    pipeline = AssetPipeline(static_dir, index_file, auto_rebuild=True)
+    old_url = pipeline.urls["small.js"]
+    (static_dir / "small.js").write_text("x = 2;")
+    pipeline._mtimes[static_dir / "small.js"] -= 1
+
+    pipeline.refresh()
+
+    assert pipeline.urls["small.js"] != old_url
+    assert pipeline.lookup(old_url) == (None, False)
+
+
+def static_url(client, name):
+    html = client.get("/").get_data(as_text=True)
+    return re.search(rf'/?static/{name}\.[0-9a-f]{{12}}\.\w+', html).group(0)
+
+
+def test_fingerprinted_asset_is_cached_immutably(client):
+    url = static_url(client, "js/app")
+    response = client.get(url, headers={"Accept-Encoding": "gzip"})
+
+    assert response.status_code == 200
+    assert response.headers["Cache-Control"] == IMMUTABLE_CACHE_CONTROL
+    assert response.headers["Content-Encoding"] == "gzip"
+    assert "Accept-Encoding" in response.headers["Vary"]
+    assert b"EnglishLearningApp" in gzip.decompress(response.data)
+
+
+def test_matching_etag_returns_304(client):
+    url = static_url(client, "css/style")
+    etag = client.get(url).headers["ETag"]
+    response = client.get(url, headers={"If-None-Match": etag})
+
+    assert response.status_code == 304
+    assert response.data == b""
+
+
+def test_index_and_unhashed_urls_revalidate(client):
+    index = client.get("/")
+    assert index.headers["Cache-Control"] == REVALIDATE_CACHE_CONTROL
+    assert client.get("/", headers={"If-None-Match": index.headers["ETag"]}).status_code == 304
+
+    assert client.get("/static/css/style.css").headers["Cache-Control"] == REVALIDATE_CACHE_CONTROL
+    assert client.get("/static/nothing.js").status_code == 404
@@ -0,0 +1,86 @@
+"""一括翻訳（parse_batch_translations / チャンク分割 / /api/translate/batch）のテスト"""
+
+import pytest
+
+import backend.ai_service as ai_service_module
+from backend.ai_service import parse_batch_translations
+
+
+@pytest.mark.parametrize("response, expected", [
+    ('["一", "二"]', ["一", "二"]),
+    ('```json\n[" 一 ", "二"]\n```', ["一", "二"]),
+    ('Here are the [2] translations:\n["一", "二"]', ["一", "二"]),
+    ('["一", "二"]\nNote: [1] is the polite form.', ["一", "二"]),
+    ('["[注] 一", "二"]', ["[注] 一", "二"]),
+    ('[["一", "二"]]', ["一", "二"]),
+    ('[1] 一\n[2] 二\n', ["一", "二"]),
+    ('[2] 二\n[1] 一', ["一", "二"]),
+    ('[1]\n一行目\n二行目\n[2]\n二', ["一行目\n二行目", "二"]),
+])
+def test_parses_translations(response, expected):
+    assert parse_batch_translations(response, 2) == expected
+
+
+@pytest.mark.parametrize("response", [
+    "",
+    "一と二",
+    '["一"]',
+    '["一", "二", "三"]',
+    '["一", 2]',
+    '["一", "二"',
+    "[1] 一\n[3] 三",
+    "[1] 一",
+])
+def test_rejects_responses_without_matching_count(response):
+    assert parse_batch_translations(response, 2) is None
+
+
+def test_chunks_respect_item_and_token_limits(use_config):
+    from backend.ai_service import AIService
+
+    use_config({"translation_batch": {"max_items": 3, "max_input_tokens": 10}})
+    service = AIService()
+
+    assert [len(chunk) for chunk in service._chunk_texts(["short"] * 7)] == [3, 3, 1]
+    assert [len(chunk) for chunk in service._chunk_texts(["x" * 24, "x" * 24, "short"])] == [1, 2]
+
+
+@pytest.fixture
+def provider_calls(app):
+    """疑似プロバイダーへの呼び出しのプロンプトを記録する"""
+    service = app.extensions["ai_service"]
+    fake = service.providers["fake"]
+    create = fake.create
+    prompts = []
+
+    async def recording_create(system, messages, *args, **kwargs):
+        prompts.append(messages[-1]["content"])
+        return await create(system, messages, *args, **kwargs)
+
+    fake.create = recording_create
+    return prompts
+
+
+def test_batch_endpoint_translates_in_one_call(client, provider_calls):
+    texts = ["I like cats.", "I went to Tokyo.", "I like cats.", "See you tomorrow."]
+    response = client.post("/api/translate/batch", json={"texts": texts})
+
+    translations = response.get_json()["translations"]
+    assert len(translations) == 4 and translations[0] == translations[2]
+    assert len(provider_calls) == 1 and "JSON array of 3 strings" in provider_calls[0]
+
+    client.post("/api/translate", json={"text": "I went to Tokyo."})
+    assert len(provider_calls) == 1
+
+
+def test_unparseable_batch_falls_back_to_single_translations(client, provider_calls, monkeypatch):
+    monkeypatch.setattr(ai_service_module, "parse_batch_translations", lambda response, count: None)
+    response = client.post("/api/translate/batch", json={"texts": ["I like cats.", "I went to Tokyo."]})
+
+    assert len(response.get_json()["translations"]) == 2
+    assert len(provider_calls) == 3
+
+
+@pytest.mark.parametrize("body", [{}, {"texts": []}, {"texts": ["ok", ""]}, {"texts": ["ok"] * 201}])
+def test_batch_endpoint_rejects_invalid_texts(client, body):
+    assert client.post("/api/translate/batch", json=body).status_code == 400
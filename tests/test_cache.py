@@ -0,0 +1,123 @@
+"""ResponseCache のテスト"""
+
+import asyncio
+import time
+
+from backend.cache import ResponseCache
+
+
+def test_key_depends_on_every_part():
+    key = ResponseCache.make_key("anthropic", "model", 100, "prompt")
+
+    assert key == ResponseCache.make_key("anthropic", "model", 100, "prompt")
+    assert len({key, ResponseCache.make_key("azure_openai", "model", 100, "prompt"),
+                ResponseCache.make_key("anthropic", "other", 100, "prompt"),
+                ResponseCache.make_key("anthropic", "model", 200, "prompt"),
+                ResponseCache.make_key("anthropic", "model", 100, "other")}) == 5
+
+
+def test_evicts_least_recently_used_entry():
+    cache = ResponseCache(max_entries=2)
+    cache.set("a", "1")
+    cache.set("b", "2")
+    cache.get("a")
+    cache.set("c", "3")
+
+    assert cache.get("b") is None
+    assert cache.get("a") == "1" and cache.get("c") == "3"
+    assert cache.get_stats()["evictions"] == 1
+
+
+def test_expired_entry_misses():
+    cache = ResponseCache(ttl_seconds=60)
+    cache.set("a", "1")
+    cache._entries["a"] = ("1", time.time() - 120)
+
+    assert cache.get("a") is None
+    stats = cache.get_stats()
+    assert stats["expirations"] == 1 and stats["misses"] == 1
+
+
+def test_disk_tier_survives_restart(tmp_path):
+    disk_path = str(tmp_path / "cache.db")
+    cache = ResponseCache(disk_path=disk_path)
+    cache.set("a", "1")
+    cache.flush()
+    restarted = ResponseCache(disk_path=disk_path)
+
+    assert restarted.get("a") == "1"
+    assert restarted.get("a") == "1"
+    stats = restarted.get_stats()
+    assert stats["disk_hits"] == 1 and stats["hits"] == 1
+
+
+def test_expired_disk_rows_are_dropped(tmp_path):
+    disk_path = str(tmp_path / "cache.db")
+    cache = ResponseCache(ttl_seconds=60, disk_path=disk_path)
+    cache._db.execute("INSERT INTO responses (key, value, created_at) VALUES ('a', '1', ?)", (time.time() - 120,))
+    cache._db.commit()
+
+    assert cache.get("a") is None
+    assert cache._db.execute("SELECT COUNT(*) FROM responses").fetchone()[0] == 0
+
+
+def test_repeated_translate_uses_cache(app, client):
+    service = app.extensions["ai_service"]
+    service.semantic_cache = None
+    calls = []
+    create = service.providers["fake"].create
+
+    async def counting_create(*args, **kwargs):
+        calls.append(args)
+        return await create(*args, **kwargs)
+
+    service.providers["fake"].create = counting_create
+    for _ in range(2):
+        client.post("/api/translate", json={"text": "I went to Tokyo yesterday."})
+
+    assert len(calls) == 1
+    assert service.response_cache.get_stats()["hits"] == 1
+
+
+class SlowCommitConnection:
+    """commit に時間がかかる（fsync が遅い）ディスクの代わり"""
+
+    def __init__(self, db, delay):
+        self.db = db
+        self.delay = delay
+
+    def execute(self, *args):
+        return self.db.execute(*args)
+
+    def commit(self):
+        time.sleep(self.delay)
+        self.db.commit()
+
+
+def test_slow_disk_write_does_not_block_event_loop(tmp_path):
+    cache = ResponseCache(disk_path=str(tmp_path / "cache.db"))
+    cache._db = SlowCommitConnection(cache._db, 0.3)
+
+    async def main():
+        ticks = 0
+
+        async def ticker():
+            nonlocal ticks
+            while True:
+                await asyncio.sleep(0.01)
+                ticks += 1
+
+        task = asyncio.create_task(ticker())
+        start = time.perf_counter()
+        cache.set("a", "1")
+        set_seconds = time.perf_counter() - start
+        # ディスクの読み込みは遅い書き込みの後に並ぶが、待っている間もループは動く
+        value = await cache.aget("b")
+        task.cancel()
+        return set_seconds, value, ticks
+
+    set_seconds, value, ticks = asyncio.run(main())
+
+    assert set_seconds < 0.05
+    assert value is None and ticks >= 10
+    assert ResponseCache(disk_path=str(tmp_path / "cache.db")).get("a") == "1"
@@ -0,0 +1,90 @@
+"""締め切り（with_deadline）とクライアント切断の検出のテスト"""
+
+import asyncio
+import socket
+
+import pytest
+
+from backend.deadlines import (ClientDisconnectedError, DeadlineExceededError, disconnect_checker,
+                               remaining_time, with_deadline)
+from backend.event_loop import BackgroundLoop
+
+
+def test_finished_work_returns_result_with_deadline_set():
+    async def work():
+        return remaining_time()
+
+    remaining = asyncio.run(with_deadline(work(), 5))
+
+    assert 0 < remaining <= 5
+    assert asyncio.run(with_deadline(work(), None)) is None
+
+
+def test_unfinished_work_is_cancelled_after_deadline():
+    cancelled = []
+
+    async def work():
+        try:
+            await asyncio.sleep(10)
+        except asyncio.CancelledError:
+            cancelled.append(True)
+            raise
+
+    with pytest.raises(DeadlineExceededError):
+        asyncio.run(with_deadline(work(), 0.01))
+    assert cancelled == [True]
+
+
+def test_inner_timeout_is_not_reported_as_deadline():
+    async def work():
+        raise asyncio.TimeoutError()
+
+    with pytest.raises(asyncio.TimeoutError) as info:
+        asyncio.run(with_deadline(work(), 5))
+    assert not isinstance(info.value, DeadlineExceededError)
+
+
+def test_disconnect_checker_detects_closed_peer():
+    server, peer = socket.socketpair()
+    try:
+        is_disconnected = disconnect_checker({"werkzeug.socket": server})
+        assert is_disconnected() is False
+        peer.close()
+        assert is_disconnected() is True
+    finally:
+        server.close()
+
+    assert disconnect_checker({}) is None
+
+
+def test_loop_cancels_work_when_client_disconnects():
+    loop = BackgroundLoop()
+    cancelled = asyncio.Event()
+
+    async def work():
+        try:
+            await asyncio.sleep(10)
+        except asyncio.CancelledError:
+            cancelled.set()
+            raise
+
+    with pytest.raises(ClientDisconnectedError):
+        loop.run(work(), disconnected=lambda: True, poll_interval=0.01)
+    loop.run(asyncio.wait_for(cancelled.wait(), 1))
+
+
+def test_endpoint_past_deadline_returns_504(app, client, use_config, monkeypatch):
+    fake = app.extensions["ai_service"].providers["fake"]
+
+    async def slow_create(*args, **kwargs):
+        await asyncio.sleep(10)
+
+    monkeypatch.setattr(fake, "create", slow_create)
+    use_config({"default_provider": "fake", "deadlines": {"endpoints": {"translate": 0.05}}})
+
+    response = client.post("/api/translate", json={"text": "Too slow."})
+
+    assert response.status_code == 504
+    assert response.get_json() == {"error": "deadline_exceeded"}
+    metrics = client.get("/metrics").get_data(as_text=True)
+    assert 'http_requests_aborted_total{endpoint="translate",reason="deadline_exceeded"}' in metrics
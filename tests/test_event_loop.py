@@ -0,0 +1,63 @@
+"""常駐イベントループ（BackgroundLoop）と API クライアントの分割（ClientShards）のテスト"""
+
+import asyncio
+import threading
+import time
+from concurrent.futures import TimeoutError as FutureTimeoutError
+
+import pytest
+
+from backend.event_loop import BackgroundLoop
+from backend.providers import ClientShards
+
+
+def test_requests_from_many_threads_run_concurrently_on_one_loop():
+    loop = BackgroundLoop()
+    threads_seen = set()
+
+    async def call():
+        threads_seen.add(threading.get_ident())
+        await asyncio.sleep(0.2)
+
+    start = time.perf_counter()
+    workers = [threading.Thread(target=loop.run, args=(call(),)) for _ in range(10)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+
+    assert time.perf_counter() - start < 1.0
+    assert len(threads_seen) == 1
+
+
+def test_timeout_cancels_work_on_loop():
+    loop = BackgroundLoop()
+    cancelled = asyncio.Event()
+
+    async def call():
+        try:
+            await asyncio.sleep(10)
+        except asyncio.CancelledError:
+            cancelled.set()
+            raise
+
+    with pytest.raises(FutureTimeoutError):
+        loop.run(call(), timeout=0.01)
+    loop.run(asyncio.wait_for(cancelled.wait(), 1))
+
+
+def test_iterate_yields_async_items_in_order():
+    async def numbers():
+        for i in range(3):
+            await asyncio.sleep(0)
+            yield i
+
+    assert list(BackgroundLoop().iterate(numbers())) == [0, 1, 2]
+
+
+def test_client_shards_rotate_between_clients():
+    created = []
+    shards = ClientShards(lambda: created.append(object()) or created[-1], shards=3)
+
+    assert [shards.next() for _ in range(4)] == created + created[:1]
+    assert len(ClientShards(object, shards=0).clients) == 1
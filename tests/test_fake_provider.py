@@ -0,0 +1,100 @@
+"""負荷試験用の疑似プロバイダーと記録・再生のテスト"""
+
+import asyncio
+import json
+
+import pytest
+
+from backend.fake_provider import (FakeProvider, FakeProviderError, RecordingProvider, ReplayMissError,
+                                   ReplayProvider, exchange_key, load_recording)
+from backend.providers import Completion, create_providers
+from conftest import FAST_FAKE_PROVIDER
+
+MESSAGES = [{"role": "user", "content": "Hello!"}]
+
+
+async def collect(chunks):
+    return [chunk async for chunk in chunks]
+
+
+def test_same_seed_gives_same_answers():
+    config = dict(FAST_FAKE_PROVIDER, output_tokens={"distribution": "uniform", "low": 5, "high": 30})
+
+    async def answers():
+        provider = FakeProvider(config)
+        return [(await provider.create(None, MESSAGES, 100)).text for _ in range(3)]
+
+    first = asyncio.run(answers())
+    assert first == asyncio.run(answers())
+    assert len(set(first)) == 3
+
+
+def test_answer_longer_than_max_tokens_is_truncated():
+    provider = FakeProvider(dict(FAST_FAKE_PROVIDER, output_tokens={"distribution": "fixed", "value": 50}))
+    completion = asyncio.run(provider.create(None, MESSAGES, 10))
+
+    assert completion.output_tokens == 10 and completion.stop_reason == "max_tokens"
+    assert len(completion.text.split()) == 10
+
+
+def test_injected_rate_limit_carries_retry_after():
+    provider = FakeProvider(dict(FAST_FAKE_PROVIDER, rate_limit_rate=1.0, retry_after_seconds=3))
+
+    with pytest.raises(FakeProviderError) as info:
+        asyncio.run(provider.create(None, MESSAGES, 100))
+    assert info.value.status_code == 429
+    assert info.value.response.headers == {"retry-after": "3"}
+
+
+def test_batch_prompt_gets_json_array_of_requested_size():
+    messages = [{"role": "user", "content": "Reply with only a JSON array of 3 strings."}]
+    completion = asyncio.run(FakeProvider(FAST_FAKE_PROVIDER).create(None, messages, 5))
+
+    assert len(json.loads(completion.text)) == 3
+
+
+def test_exchange_key_ignores_max_tokens_but_not_stop():
+    assert exchange_key("system", MESSAGES) == exchange_key("system", list(MESSAGES))
+    assert exchange_key("system", MESSAGES) != exchange_key("system", MESSAGES, ["\n"])
+    assert exchange_key("system", MESSAGES) != exchange_key("other", MESSAGES)
+
+
+def test_recorded_exchanges_replay_in_order(tmp_path):
+    path = str(tmp_path / "calls.jsonl")
+    recorder = RecordingProvider(FakeProvider, (dict(FAST_FAKE_PROVIDER, seed=None),), path)
+
+    async def record():
+        first = await recorder.create("system", MESSAGES, 100)
+        second = await recorder.create("system", MESSAGES, 100)
+        streamed = await collect(recorder.stream(None, MESSAGES, 100))
+        return first, second, streamed
+
+    first, second, streamed = asyncio.run(record())
+    assert [entry["provider"] for entry in load_recording(path)] == ["fake"] * 3
+
+    replay = ReplayProvider("fake", path, replay_timing=False)
+
+    async def play():
+        return ([(await replay.create("system", MESSAGES, 50)).text for _ in range(3)],
+                await collect(replay.stream(None, MESSAGES, 50)))
+
+    texts, replayed = asyncio.run(play())
+    assert texts == [first.text, second.text, first.text]
+    assert replayed[:-1] == streamed[:-1]
+    assert isinstance(replayed[-1], Completion) and replayed[-1].text == streamed[-1].text
+
+    with pytest.raises(ReplayMissError):
+        asyncio.run(replay.create("system", [{"role": "user", "content": "New input"}], 50))
+    assert replay.misses == 1
+
+
+def test_replay_mode_replaces_recorded_providers(use_config, tmp_path):
+    path = tmp_path / "calls.jsonl"
+    path.write_text(json.dumps({"provider": "anthropic", "key": exchange_key(None, MESSAGES),
+                                "text": "Recorded."}) + "\n", encoding="utf-8")
+    use_config({"recording": {"mode": "replay", "path": str(path), "replay_timing": False}})
+
+    providers = create_providers()
+
+    assert list(providers) == ["anthropic"] and isinstance(providers["anthropic"], ReplayProvider)
+    assert asyncio.run(providers["anthropic"].create(None, MESSAGES, 10)).text == "Recorded."
@@ -0,0 +1,64 @@
+"""会話履歴ウィンドウと要約のテスト"""
+
+import asyncio
+
+from backend.history import MESSAGE_OVERHEAD_TOKENS, HistoryManager, estimate_tokens
+from conftest import FAST_FAKE_PROVIDER
+
+
+def turns(count: int, content: str = "word " * 20):
+    return [{"role": "user" if i % 2 == 0 else "assistant", "content": f"{i} {content}", "seq": i}
+            for i in range(count)]
+
+
+def test_estimate_tokens_counts_wide_characters_individually():
+    assert estimate_tokens("abcd" * 10) == 10
+    assert estimate_tokens("こんにちは") == 5
+    assert estimate_tokens("") == 0
+
+
+def test_pack_keeps_newest_messages_within_budget():
+    manager = HistoryManager(min_recent_messages=2)
+    history = turns(10)
+    cost = manager.message_tokens(history[0])
+
+    window, start = manager.pack(history, cost * 4)
+
+    assert window == history[6:] and start == 6
+
+
+def test_pack_starts_window_with_user_message():
+    manager = HistoryManager(min_recent_messages=1)
+    history = turns(10)
+    cost = manager.message_tokens(history[0])
+
+    window, start = manager.pack(history, cost * 3)
+
+    assert window[0]["role"] == "user"
+    assert start == 8
+
+
+def test_pack_keeps_min_recent_messages_over_budget():
+    window, _ = HistoryManager(min_recent_messages=2).pack(turns(6), MESSAGE_OVERHEAD_TOKENS)
+
+    assert len(window) == 2
+
+
+def test_old_turns_are_folded_into_summary(use_config):
+    from backend.ai_service import AIService
+
+    use_config({
+        "default_provider": "fake",
+        "fake_provider": FAST_FAKE_PROVIDER,
+        "history": {"input_token_budgets": {"fake": {"400": 300}}}
+    })
+    service = AIService()
+    session_id = service.session_store.create()
+    for i in range(6):
+        service.session_store.append_turn(session_id, f"{i} " + "student " * 40, f"{i} " + "teacher " * 40)
+
+    asyncio.run(service._refresh_summary(session_id, "400", "fake"))
+
+    session = service.session_store.get(session_id)
+    assert session.summary
+    assert 0 <= session.summary_seq < session.next_seq - 2
@@ -0,0 +1,147 @@
+"""流量制御（RetryPolicy / ProviderLimiter / RequestCoalescer）と再試行のテスト"""
+
+import asyncio
+import time
+
+import pytest
+
+from backend.deadlines import with_deadline
+from backend.fake_provider import FakeProviderError
+from backend.limiter import LimiterBusyError, ProviderLimiter, RequestCoalescer, RetryPolicy, get_retry_after
+from backend.router import ProviderRouter
+
+
+def test_retry_policy_retries_transient_errors_only():
+    policy = RetryPolicy({"max_retries": 2, "base_delay_ms": 100, "max_delay_ms": 1000})
+
+    assert policy.get_delay(FakeProviderError(503, "unavailable"), 0) is not None
+    assert policy.get_delay(FakeProviderError(400, "bad request"), 0) is None
+    assert policy.get_delay(FakeProviderError(503, "unavailable"), 2) is None
+
+
+def test_retry_policy_prefers_retry_after():
+    policy = RetryPolicy({"max_retry_after_seconds": 20})
+
+    assert policy.get_delay(FakeProviderError(429, "slow down", retry_after=3), 0) == 3
+    # 長すぎる retry-after は待たずに別のプロバイダーへ任せる
+    assert policy.get_delay(FakeProviderError(429, "slow down", retry_after=60), 0) is None
+
+
+def test_get_retry_after_reads_milliseconds_header():
+    error = FakeProviderError(429, "slow down")
+    error.response.headers = {"retry-after-ms": "1500", "retry-after": "9"}
+
+    assert get_retry_after(error) == 1.5
+
+
+def test_limiter_caps_concurrency():
+    limiter = ProviderLimiter({"max_concurrency": 2})
+    peak = 0
+
+    async def call():
+        nonlocal peak
+        async with limiter.acquire():
+            peak = max(peak, limiter.in_flight)
+            await asyncio.sleep(0.01)
+
+    async def main():
+        await asyncio.gather(*(call() for _ in range(6)))
+
+    asyncio.run(main())
+    assert peak == 2
+    assert limiter.counters["acquired"] == 6
+
+
+def test_limiter_rejects_when_queue_is_full():
+    limiter = ProviderLimiter({"max_concurrency": 1}, max_queue=1)
+
+    async def main():
+        await limiter.enter()
+        waiting = asyncio.ensure_future(limiter.enter())
+        await asyncio.sleep(0)
+        with pytest.raises(LimiterBusyError):
+            await limiter.enter()
+        limiter.exit()
+        await waiting
+        limiter.exit()
+
+    asyncio.run(main())
+    assert limiter.counters["rejected"] == 1
+
+
+def test_limiter_spaces_calls_by_rate():
+    limiter = ProviderLimiter({"requests_per_minute": 600, "burst": 1})
+
+    async def main():
+        start = time.monotonic()
+        for _ in range(3):
+            async with limiter.acquire():
+                pass
+        return time.monotonic() - start
+
+    # 10回/秒でバーストは1回なので、2回目と3回目はそれぞれ約0.1秒待つ
+    assert asyncio.run(main()) >= 0.18
+
+
+def test_limiter_pause_delays_next_call():
+    limiter = ProviderLimiter()
+
+    async def main():
+        limiter.pause(0.1)
+        start = time.monotonic()
+        async with limiter.acquire():
+            pass
+        return time.monotonic() - start
+
+    assert asyncio.run(main()) >= 0.09
+
+
+def test_coalescer_shares_one_call_per_key():
+    coalescer = RequestCoalescer()
+    calls = 0
+
+    async def factory():
+        nonlocal calls
+        calls += 1
+        await asyncio.sleep(0.01)
+        return "result"
+
+    async def main():
+        return await asyncio.gather(*(coalescer.run("key", factory) for _ in range(5)))
+
+    assert asyncio.run(main()) == ["result"] * 5
+    assert calls == 1
+    assert coalescer.get_stats()["coalesced"] == 4
+
+
+class FailingProvider:
+    """常に 503 を返すテスト用のプロバイダー"""
+
+    name = "anthropic"
+
+    def __init__(self):
+        self.calls = 0
+
+    async def create(self, *args, **kwargs):
+        self.calls += 1
+        raise FakeProviderError(503, "unavailable")
+
+
+def test_backoff_records_failure_when_deadline_is_too_close():
+    provider = FailingProvider()
+    router = ProviderRouter(
+        {"anthropic": provider},
+        {"failover": False},
+        {"retry": {"max_retries": 3, "base_delay_ms": 5000, "max_delay_ms": 5000}}
+    )
+    # 待ち時間が締め切りを超えるよう、ジッターの下限を上げる
+    router.retry_policy.get_delay = lambda error, attempt: 5.0
+
+    async def main():
+        await with_deadline(router.call("anthropic", "chat", lambda p: p.create()), 1.0)
+
+    with pytest.raises(FakeProviderError):
+        asyncio.run(main())
+    assert provider.calls == 1
+    assert router.stats["anthropic"].consecutive_failures == 1
+    assert router.limiters["anthropic"].counters["retries"] == 0
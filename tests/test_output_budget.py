@@ -0,0 +1,63 @@
+"""出力トークン予算（OutputBudget / 切れた回答の扱い）のテスト"""
+
+from backend.output_budget import OutputBudget, is_truncated, trim_to_sentence
+from backend.providers import Completion
+
+
+def test_initial_budget_uses_config_until_learned():
+    budget = OutputBudget()
+
+    assert budget.max_tokens("translate", "400", 100, 1000) == 40 + 300
+    assert budget.max_tokens("translate", "400", 1, 1000) == 80
+    assert budget.max_tokens("feedback", "400", 100, 1000) == 400
+    assert budget.max_tokens("feedback", "400", 100, 300) == 300
+    assert budget.max_tokens("summary", "400", 100, 1000) == 1000 and not budget.handles("summary")
+
+
+def test_learned_budget_follows_percentile_with_headroom():
+    budget = OutputBudget({"min_samples": 10, "percentile": 90, "headroom": 1.5})
+    for output_tokens in range(1, 11):
+        budget.record("translate", "400", 10, Completion("x", output_tokens=output_tokens * 10), 1000)
+        budget.record("feedback", "400", 10, Completion("x", output_tokens=output_tokens * 30), 1000)
+
+    assert budget.max_tokens("translate", "400", 20, 1000) == 270
+    assert budget.max_tokens("feedback", "400", 20, 1000) == 405
+    assert budget.max_tokens("translate", "600", 20, 1000) == 40 + 60
+    assert budget.get_stats()["translate"]["levels"]["400"] == {"samples": 10, "learned": True}
+
+
+def test_truncated_answers_widen_the_budget():
+    budget = OutputBudget({"min_samples": 1})
+    truncated = Completion("x", output_tokens=300, stop_reason="max_tokens")
+
+    assert is_truncated(truncated) and not is_truncated(Completion("x", stop_reason="end_turn"))
+    assert budget.record("feedback", "400", 10, truncated, 300) is True
+    assert budget.max_tokens("feedback", "400", 10, 2000) == 750
+    assert budget.counters["feedback"]["truncated"] == 1
+
+
+def test_trim_to_sentence_drops_unfinished_sentence():
+    assert trim_to_sentence("Good job. You used the past tense. But") == "Good job. You used the past tense."
+    assert trim_to_sentence("よくできました。次は") == "よくできました。"
+    assert trim_to_sentence("No sentence end") == "No sentence end"
+    assert trim_to_sentence("Version 1.5 is") == "Version 1.5 is"
+
+
+def test_truncated_translation_is_retried_at_ceiling(app, client):
+    from backend.ai_service import MAX_OUTPUT_TOKENS
+
+    fake = app.extensions["ai_service"].providers["fake"]
+    budgets = []
+
+    async def truncating_create(system, messages, max_tokens, **options):
+        budgets.append(max_tokens)
+        if len(budgets) == 1:
+            return Completion("途中で", output_tokens=max_tokens, stop_reason="max_tokens")
+        return Completion("最後まで訳しました。", output_tokens=20, stop_reason="end_turn")
+
+    fake.create = truncating_create
+    response = client.post("/api/translate", json={"text": "I went to Tokyo yesterday."})
+
+    assert response.get_json()["translation"] == "最後まで訳しました。"
+    assert budgets[0] < budgets[1] == MAX_OUTPUT_TOKENS["translate"]
+    assert app.extensions["ai_service"].output_budget.counters["translate"]["retried"] == 1
@@ -0,0 +1,135 @@
+"""ヒント用フレーズ索引（PhraseIndex / /api/hint）のテスト"""
+
+import asyncio
+import json
+import time
+
+import pytest
+
+from backend.phrase_index import PhraseIndex, bigrams, normalize
+from backend.scheduler import SupersededError
+from conftest import FAST_FAKE_PROVIDER
+
+
+@pytest.fixture
+def seed_path(tmp_path):
+    path = tmp_path / "phrases.json"
+    path.write_text(json.dumps({"phrases": [
+        {"ja": ["お腹が空いた", "お腹すいた"], "hints": {"400": "I'm hungry.", "600": "I'm starving."}},
+        {"ja": ["明日は雨が降りそうだ"], "hints": {"400": "It looks like rain tomorrow."}},
+    ]}, ensure_ascii=False), encoding="utf-8")
+    return str(path)
+
+
+def test_normalize_ignores_width_case_and_punctuation():
+    assert normalize("Ｈｅｌｌｏ, World！") == "helloworld"
+    assert normalize("お腹が 空いた。") == "お腹が空いた"
+    assert bigrams("abc") == {"ab", "bc"} and bigrams("a") == {"a"} and bigrams("") == set()
+
+
+def test_exact_and_near_matches_use_level(seed_path):
+    index = PhraseIndex(seed_path)
+
+    assert index.lookup("お腹が空いた！", "400") == "I'm hungry."
+    assert index.lookup("お腹が空いた", "600") == "I'm starving."
+    assert index.lookup("明日は雨が降りそうです", "400") == "It looks like rain tomorrow."
+    assert index.lookup("お腹が空いた", "800") is None
+
+    stats = index.get_stats()
+    assert stats["hits"] == 3 and stats["exact_hits"] == 2 and stats["misses"] == 1
+
+
+def test_weak_matches_are_left_to_the_llm(seed_path):
+    index = PhraseIndex(seed_path, min_score=0.8)
+
+    assert index.lookup("お腹が痛くて病院に行った", "400") is None
+    assert index.lookup("！？", "400") is None
+
+
+def test_added_hints_survive_restart_with_db(seed_path, tmp_path):
+    db_path = str(tmp_path / "index" / "phrases.db")
+    index = PhraseIndex(seed_path, db_path)
+    index.add("宿題を忘れた", "400", "I forgot my homework.")
+    index.flush()
+    restarted = PhraseIndex(seed_path, db_path)
+
+    assert restarted.lookup("宿題を忘れた", "400") == "I forgot my homework."
+    assert restarted.lookup("お腹すいた", "400") == "I'm hungry."
+
+
+class SlowCommitConnection:
+    """commit に時間がかかる（fsync が遅い）データベースの代わり"""
+
+    def __init__(self, db, delay):
+        self.db = db
+        self.delay = delay
+
+    def execute(self, *args):
+        return self.db.execute(*args)
+
+    def commit(self):
+        time.sleep(self.delay)
+        self.db.commit()
+
+
+def test_add_does_not_wait_for_database_write(seed_path, tmp_path):
+    index = PhraseIndex(seed_path, str(tmp_path / "phrases.db"))
+    index._db = SlowCommitConnection(index._db, 0.3)
+
+    start = time.perf_counter()
+    index.add("宿題を忘れた", "400", "I forgot my homework.")
+
+    assert time.perf_counter() - start < 0.05
+    assert index.lookup("宿題を忘れた", "400") == "I forgot my homework."
+    index.flush()
+    assert index._db.execute("SELECT COUNT(*) FROM phrases WHERE source = 'llm'").fetchone()[0] == 1
+
+
+def count_calls(service):
+    calls = []
+    create = service.providers["fake"].create
+
+    async def counting_create(*args, **kwargs):
+        calls.append(args)
+        return await create(*args, **kwargs)
+
+    service.providers["fake"].create = counting_create
+    return calls
+
+
+def test_hint_endpoint_answers_indexed_phrase_without_llm(app, client):
+    calls = count_calls(app.extensions["ai_service"])
+    response = client.post("/api/hint", json={"japanese_text": "不安です", "level": "400"})
+
+    assert response.status_code == 200
+    assert "worried" in response.get_json()["hint"]
+    assert calls == []
+
+
+def test_llm_hints_are_written_back(use_config, seed_path):
+    from backend.ai_service import AIService
+
+    use_config({
+        "default_provider": "fake",
+        "fake_provider": FAST_FAKE_PROVIDER,
+        "hint_index": {"seed_path": seed_path, "write_back": True}
+    })
+    service = AIService()
+    calls = count_calls(service)
+
+    async def main():
+        return [await service.get_hint("宿題を忘れた", "400", "fake") for _ in range(2)]
+
+    first, second = asyncio.run(main())
+    assert first == second
+    assert len(calls) == 1
+
+
+def test_superseded_hint_returns_409(app, client, monkeypatch):
+    async def call(*args, **kwargs):
+        raise SupersededError("a newer turn started in this session")
+
+    monkeypatch.setattr(app.extensions["ai_service"].router, "call", call)
+    response = client.post("/api/hint", json={"japanese_text": "宿題を忘れた", "level": "400"})
+
+    assert response.status_code == 409
@@ -0,0 +1,119 @@
+"""プロンプトキャッシュ（PromptParts / cache_control の付与 / 使用量の集計）のテスト"""
+
+import asyncio
+from types import SimpleNamespace
+
+from backend.history import estimate_tokens
+from backend.prompts import PromptManager, PromptParts
+from backend.providers import AnthropicProvider, AzureOpenAIProvider, ClientShards
+from conftest import FAST_FAKE_PROVIDER
+
+
+def test_prefix_is_shared_per_level_and_excludes_input():
+    manager = PromptManager()
+    first = manager.get_feedback_prompt("I goed to school.", "600", teacher_text="How was your day?")
+    second = manager.get_feedback_prompt("I eated lunch.", "600")
+
+    assert first.prefix is second.prefix
+    assert "I goed" not in first.prefix and first.suffix.endswith("I goed to school.")
+    assert manager.get_feedback_prompt("x", "800").prefix != first.prefix
+    assert manager.get_system_prompt("400", summary="Talked about cats.").suffix.endswith("Talked about cats.")
+    assert str(first) == first.prefix + first.suffix
+
+
+def test_anthropic_marks_prefix_and_history_as_cacheable(use_config):
+    system = AnthropicProvider._system(PromptParts("instructions", "summary"))
+    assert system == [
+        {"type": "text", "text": "instructions", "cache_control": {"type": "ephemeral"}},
+        {"type": "text", "text": "summary"},
+    ]
+    assert AnthropicProvider._system("plain") == "plain"
+
+    messages = [{"role": "user", "content": "hi"}, {"role": "assistant", "content": "hello"},
+                {"role": "user", "content": "how are you?"}]
+    marked = AnthropicProvider._messages(messages)
+    assert marked[1]["content"] == [{"type": "text", "text": "hello", "cache_control": {"type": "ephemeral"}}]
+    assert marked[0] is messages[0] and marked[2] is messages[2]
+
+    use_config({"prompt_cache": {"enabled": False}})
+    assert AnthropicProvider._system(PromptParts("instructions", "summary")) == "instructionssummary"
+    assert AnthropicProvider._messages(messages) is messages
+
+
+def test_usage_includes_cached_input_tokens():
+    usage = SimpleNamespace(input_tokens=10, output_tokens=5, cache_read_input_tokens=900,
+                            cache_creation_input_tokens=0)
+    completion = AnthropicProvider._completion("ok", SimpleNamespace(usage=usage, stop_reason="end_turn"))
+    assert (completion.input_tokens, completion.cache_read_tokens) == (910, 900)
+
+    details = SimpleNamespace(cached_tokens=1024)
+    assert AzureOpenAIProvider._cached_tokens(SimpleNamespace(prompt_tokens_details=details)) == 1024
+    assert AzureOpenAIProvider._cached_tokens(SimpleNamespace(prompt_tokens_details=None)) == 0
+
+
+class StubMessages:
+    """messages.create の引数を記録する Anthropic クライアントの代わり"""
+
+    def __init__(self):
+        self.calls = []
+
+    async def create(self, **kwargs):
+        self.calls.append(kwargs)
+        usage = SimpleNamespace(input_tokens=20, output_tokens=5, cache_read_input_tokens=0,
+                                cache_creation_input_tokens=0)
+        return SimpleNamespace(content=[SimpleNamespace(text="Good.")], usage=usage, stop_reason="end_turn")
+
+
+def test_feedback_sends_prefix_as_cached_system_prompt(use_config):
+    from backend.ai_service import AIService
+
+    use_config({"api_keys": {"anthropic": "test-key"}, "default_provider": "anthropic"})
+    service = AIService()
+    messages = StubMessages()
+    service.providers["anthropic"]._client = ClientShards(lambda: SimpleNamespace(messages=messages))
+
+    async def main():
+        for text in ("I goed to school.", "I eated lunch."):
+            await service.get_feedback(text, "600", provider="anthropic")
+
+    asyncio.run(main())
+
+    first, second = messages.calls
+    assert first["system"] == second["system"]
+    assert first["system"][0]["cache_control"] == {"type": "ephemeral"}
+    assert first["messages"][0]["content"].endswith("I goed to school.")
+
+
+def test_turn_analysis_sends_the_same_prompt_tokens_as_separate_calls(use_config):
+    from backend.ai_service import AIService
+
+    use_config({
+        "default_provider": "fake",
+        "fake_provider": FAST_FAKE_PROVIDER,
+        "cache": {"enabled": False},
+        "semantic_cache": {"enabled": False}
+    })
+    service = AIService()
+    sent = []
+    create = service.providers["fake"].create
+
+    async def counting_create(system, messages, max_tokens, **kwargs):
+        sent.append(estimate_tokens(str(system or "")) + sum(estimate_tokens(m["content"]) for m in messages))
+        return await create(system, messages, max_tokens, **kwargs)
+
+    service.providers["fake"].create = counting_create
+    user_text, teacher_text = "I goed to the park yesterday.", "That sounds fun! What did you do there?"
+
+    async def separate():
+        await service.get_translation(user_text)
+        await service.get_translation(teacher_text)
+        await service.get_feedback(user_text, "400", teacher_text)
+
+    asyncio.run(separate())
+    separate_tokens = sum(sent)
+    sent.clear()
+    asyncio.run(service.get_turn_analysis(user_text, teacher_text, "400"))
+
+    # まとめるのは HTTP の往復だけで、送るプロンプトのトークン数は変わらない
+    assert len(sent) == 3
+    assert sum(sent) == separate_tokens
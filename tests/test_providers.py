@@ -0,0 +1,58 @@
+"""プロバイダーの遅延読み込みと create_providers のテスト"""
+
+import subprocess
+import sys
+
+from backend.providers import AnthropicProvider, AzureOpenAIProvider, create_providers
+from conftest import FAST_FAKE_PROVIDER, ROOT_DIR
+
+
+def test_sdks_are_imported_on_first_client_use():
+    script = (
+        "import sys\n"
+        "from backend.app import create_app\n"
+        "app = create_app()\n"
+        "provider = app.extensions['ai_service'].providers['anthropic']\n"
+        "print('anthropic' in sys.modules, 'openai' in sys.modules)\n"
+        "provider.client\n"
+        "print('anthropic' in sys.modules)\n"
+    )
+    env = {"PATH": "", "ANTHROPIC_API_KEY": "test-key"}
+    result = subprocess.run([sys.executable, "-c", script], cwd=ROOT_DIR, env=env,
+                            capture_output=True, text=True, timeout=60)
+
+    assert result.returncode == 0, result.stderr
+    assert result.stdout.splitlines()[-2:] == ["False False", "True"]
+
+
+def test_no_providers_without_keys(use_config):
+    assert create_providers() == {}
+
+    use_config({"fake_provider": FAST_FAKE_PROVIDER})
+    assert list(create_providers()) == ["fake"]
+
+
+def test_azure_openai_needs_key_and_endpoint(use_config):
+    use_config({"api_keys": {"azure_openai": "key"}})
+
+    assert create_providers() == {}
+
+
+def test_unchanged_adapters_are_reused(use_config):
+    use_config({
+        "api_keys": {"anthropic": "key-1", "azure_openai": "key"},
+        "azure_openai": {"endpoint": "https://example.openai.azure.com"}
+    })
+    current = create_providers()
+    assert isinstance(current["anthropic"], AnthropicProvider)
+    assert isinstance(current["azure_openai"], AzureOpenAIProvider)
+
+    use_config({
+        "api_keys": {"anthropic": "key-2", "azure_openai": "key"},
+        "azure_openai": {"endpoint": "https://example.openai.azure.com"}
+    })
+    providers = create_providers(current)
+
+    assert providers["azure_openai"] is current["azure_openai"]
+    assert providers["anthropic"] is not current["anthropic"]
+    assert providers["anthropic"].api_key == "key-2"
@@ -0,0 +1,138 @@
+"""ProviderRouter のフェイルオーバー・後回し・ヘッジのテスト"""
+
+import asyncio
+import time
+
+import pytest
+
+from backend.deadlines import DeadlineExceededError
+from backend.fake_provider import FakeProviderError
+from backend.router import NoProviderAvailableError, ProviderRouter
+from backend.scheduler import SupersededError
+
+
+class StubProvider:
+    """決まった遅延のあと、回答を返すかエラーを送出するテスト用のプロバイダー"""
+
+    def __init__(self, name, reply="ok", error=None, delay=0.0):
+        self.name = name
+        self.reply = reply
+        self.error = error
+        self.delay = delay
+        self.calls = 0
+
+    async def create(self):
+        self.calls += 1
+        await asyncio.sleep(self.delay)
+        if self.error is not None:
+            raise self.error
+        return self.reply
+
+    async def stream(self):
+        self.calls += 1
+        if self.error is not None:
+            raise self.error
+        for token in self.reply.split():
+            yield token
+
+
+def call(router, preferred="anthropic"):
+    return asyncio.run(router.call(preferred, "translate", lambda p: p.create()))
+
+
+def test_fails_over_to_next_provider():
+    primary = StubProvider("anthropic", error=FakeProviderError(400, "bad request"))
+    router = ProviderRouter({"anthropic": primary, "azure_openai": StubProvider("azure_openai", "from azure")})
+
+    assert call(router) == ("from azure", "azure_openai")
+    assert router.counters["failovers"] == 1
+    assert router.stats["anthropic"].consecutive_failures == 1
+
+
+def test_failing_provider_is_tried_last_during_cooldown():
+    router = ProviderRouter(
+        {"anthropic": StubProvider("anthropic", error=FakeProviderError(400, "bad request")),
+         "azure_openai": StubProvider("azure_openai")},
+        {"failure_threshold": 2, "cooldown_seconds": 60}
+    )
+    for _ in range(2):
+        call(router)
+
+    assert router.candidates("anthropic") == ["azure_openai", "anthropic"]
+    assert router.get_stats()["providers"]["anthropic"]["healthy"] is False
+
+
+def test_without_failover_only_preferred_provider_is_used():
+    router = ProviderRouter(
+        {"anthropic": StubProvider("anthropic", error=FakeProviderError(400, "bad request")),
+         "azure_openai": StubProvider("azure_openai")},
+        {"failover": False}
+    )
+
+    with pytest.raises(FakeProviderError):
+        call(router)
+    assert router.candidates("fake") == []
+    with pytest.raises(NoProviderAvailableError):
+        call(router, "fake")
+
+
+def test_hedge_sends_to_second_provider_when_first_is_slow():
+    slow = StubProvider("anthropic", "slow", delay=1.0)
+    fast = StubProvider("azure_openai", "fast")
+    router = ProviderRouter(
+        {"anthropic": slow, "azure_openai": fast},
+        {"hedge": {"enabled": True, "min_samples": 5, "min_delay_ms": 50}}
+    )
+    for _ in range(5):
+        router.record_success("anthropic", "translate", 0.01)
+
+    assert call(router) == ("fast", "azure_openai")
+    assert router.counters["hedges"] == 1 and router.counters["hedge_wins"] == 1
+
+
+def hedged_router(primary, secondary):
+    router = ProviderRouter(
+        {"anthropic": primary, "azure_openai": secondary},
+        {"hedge": {"enabled": True, "min_samples": 5, "min_delay_ms": 50}}
+    )
+    for _ in range(5):
+        router.record_success("anthropic", "translate", 0.01)
+    return router
+
+
+@pytest.mark.parametrize("error", [SupersededError("a newer turn started"), DeadlineExceededError("too late")])
+def test_hedge_passes_on_aborted_calls_without_counting_failures(error):
+    primary = StubProvider("anthropic", error=error, delay=0.2)
+    secondary = StubProvider("azure_openai", "late", delay=1.0)
+    router = hedged_router(primary, secondary)
+
+    start = time.perf_counter()
+    with pytest.raises(type(error)):
+        call(router)
+
+    assert time.perf_counter() - start < 0.6
+    assert router.counters["hedges"] == 1 and router.counters["failovers"] == 0
+    assert router.stats["anthropic"].consecutive_failures == 0
+
+
+def test_hedge_passes_on_cancelled_attempt_without_failover():
+    primary = StubProvider("anthropic", error=asyncio.CancelledError(), delay=0.0)
+    secondary = StubProvider("azure_openai", "fallback")
+    router = hedged_router(primary, secondary)
+
+    with pytest.raises(asyncio.CancelledError):
+        call(router)
+    assert secondary.calls == 0 and router.counters["failovers"] == 0
+
+
+def test_stream_fails_over_before_first_token():
+    router = ProviderRouter({
+        "anthropic": StubProvider("anthropic", error=FakeProviderError(400, "bad request")),
+        "azure_openai": StubProvider("azure_openai", "hello there")
+    })
+
+    async def main():
+        return [chunk async for chunk in router.stream("anthropic", lambda p: p.stream())]
+
+    assert asyncio.run(main()) == ["hello", "there"]
+    assert router.counters["failovers"] == 1
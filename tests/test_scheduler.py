@@ -0,0 +1,96 @@
+"""優先度スケジューリング（PriorityGate / TurnTracker）のテスト"""
+
+import asyncio
+
+import pytest
+
+from backend.scheduler import PriorityGate, SupersededError, TurnTracker, current_turn, get_priority_class
+
+
+def test_operations_map_to_priority_classes():
+    assert get_priority_class("chat") == "interactive"
+    assert get_priority_class("feedback") == "analysis"
+    assert get_priority_class("summary") == "background"
+
+
+def test_turn_tracker_marks_older_turns_stale():
+    turns = TurnTracker(max_sessions=2)
+    first = turns.begin("a")
+    turns.begin("a")
+
+    assert turns.is_stale(("a", first)) and not turns.is_stale(("a", first + 1))
+    assert not turns.is_stale(None)
+
+    turns.begin("b")
+    turns.begin("c")
+    assert turns.current("a") == 0
+
+
+def test_free_slot_goes_to_highest_priority_waiter():
+    gate = PriorityGate(1)
+    order = []
+
+    async def worker(priority):
+        await gate.acquire(priority)
+        order.append(priority)
+        await asyncio.sleep(0)
+        gate.release(priority)
+
+    async def main():
+        await gate.acquire("analysis")
+        tasks = [asyncio.create_task(worker(p)) for p in ("background", "analysis", "interactive")]
+        await asyncio.sleep(0)
+        gate.release("analysis")
+        await asyncio.gather(*tasks)
+
+    asyncio.run(main())
+    assert order == ["interactive", "analysis", "background"]
+
+
+def test_class_share_limits_concurrency():
+    gate = PriorityGate(4, {"background": {"share": 0.25}})
+
+    async def main():
+        await gate.acquire("background")
+        waiter = asyncio.create_task(gate.acquire("background"))
+        await asyncio.sleep(0)
+        assert not waiter.done() and gate.in_use == 1
+        await gate.acquire("interactive")
+        gate.release("background")
+        await waiter
+
+    asyncio.run(main())
+    assert gate.to_dict()["background"]["granted"] == 2
+
+
+def test_waiter_from_superseded_turn_is_dropped():
+    turns = TurnTracker()
+    gate = PriorityGate(1, turns=turns)
+
+    async def main():
+        await gate.acquire("interactive")
+        current_turn.set(("s1", turns.begin("s1")))
+        waiter = asyncio.create_task(gate.acquire("analysis"))
+        await asyncio.sleep(0)
+        turns.begin("s1")
+        gate.drop_stale()
+        with pytest.raises(SupersededError):
+            await waiter
+
+    asyncio.run(main())
+    assert gate.to_dict()["analysis"]["superseded"] == 1
+    assert gate.queue_depth("analysis") == 0
+
+
+def test_waiting_past_max_wait_expires():
+    gate = PriorityGate(1, {"analysis": {"max_wait_seconds": 0.01}})
+
+    async def main():
+        await gate.acquire("interactive")
+        with pytest.raises(asyncio.TimeoutError):
+            await gate.acquire("analysis")
+        gate.release("interactive")
+
+    asyncio.run(main())
+    stats = gate.to_dict()["analysis"]
+    assert stats["expired"] == 1 and stats["in_flight"] == 0 and gate.in_use == 0
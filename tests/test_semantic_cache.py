@@ -0,0 +1,123 @@
+"""SemanticCache のテスト"""
+
+import asyncio
+import time
+
+import pytest
+
+from backend.semantic_cache import SemanticCache, normalize
+from config.settings import settings
+
+NAMESPACE = "translate:fake:japanese"
+
+# (保存した入力, 引いた入力)。回答を共有してよい組
+SAME_MEANING = [
+    ("I'm fine, thank you.", "i am fine thank you"),
+    ("I can't swim.", "I CAN NOT swim!"),
+    ("It's   raining today.", "it is raining today"),
+    ("I went to the park yesterday.", "I went to park yesterday"),
+    ("Um, I think it was a good movie.", "I think it was good movie."),
+    ("I went to the park yesterday.", "Yesterday I went to the park."),
+]
+
+# 文字の類似度は高いが意味が違う組（回答を共有してはいけない）
+DIFFERENT_MEANING = [
+    ("I want to visit Tokyo next month with my family.", "I want to visit Kyoto next month with my family."),
+    ("I went shopping with my friends last weekend.", "I went hiking with my friends last weekend."),
+    ("It took 3 hours to get there by train.", "It took 5 hours to get there by train."),
+    ("I like it very much.", "I don't like it very much."),
+    ("He is my teacher.", "She is my teacher."),
+    ("I have a cat.", "I have the cat."),
+    ("a cat", "the cat"),
+]
+
+
+@pytest.fixture
+def cache(use_config):
+    """デフォルト設定のしきい値を使うキャッシュ"""
+    return SemanticCache(max_entries=100, thresholds=dict(settings.get_semantic_cache_config()["thresholds"]))
+
+
+def test_normalize_ignores_case_punctuation_and_whitespace():
+    assert normalize("  I'm FINE,\tthank   you!! ") == "i am fine thank you"
+
+
+@pytest.mark.parametrize("stored, lookup", SAME_MEANING)
+def test_same_meaning_pairs_hit(cache, stored, lookup):
+    cache.set(stored, NAMESPACE, "answer")
+
+    assert cache.get(lookup, NAMESPACE, "translate") == "answer"
+
+
+@pytest.mark.parametrize("stored, lookup", DIFFERENT_MEANING)
+def test_different_meaning_pairs_miss(cache, stored, lookup):
+    cache.set(stored, NAMESPACE, "answer")
+
+    assert cache.get(lookup, NAMESPACE, "translate") is None
+
+
+def test_endpoint_without_threshold_uses_only_normalized_match(cache):
+    cache.set("I went to the park.", NAMESPACE, "answer")
+
+    assert cache.get("i went to the park", NAMESPACE, "feedback") == "answer"
+    assert cache.get("I went to park.", NAMESPACE, "feedback") is None
+
+
+def test_namespaces_are_separate(cache):
+    cache.set("I went to the park.", NAMESPACE, "answer")
+
+    assert cache.get("I went to the park.", "translate:fake:english", "translate") is None
+
+
+def test_expired_entry_misses(cache):
+    cache.set("I went to the park.", NAMESPACE, "answer")
+    cache._created_at[:] = time.time() - cache.ttl_seconds - 1
+
+    assert cache.get("I went to the park.", NAMESPACE, "translate") is None
+    assert cache.get_stats()["expirations"] == 1
+
+
+def test_evicts_least_recently_used_entry():
+    cache = SemanticCache(max_entries=2)
+    cache.set("first sentence", NAMESPACE, "1")
+    cache.set("second sentence", NAMESPACE, "2")
+    cache.get("first sentence", NAMESPACE, "translate")
+    cache.set("third sentence", NAMESPACE, "3")
+
+    assert cache.get("second sentence", NAMESPACE, "translate") is None
+    assert cache.get("first sentence", NAMESPACE, "translate") == "1"
+    assert cache.get_stats()["evictions"] == 1
+
+
+def test_near_match_is_found_among_similar_entries(cache):
+    for day in range(50):
+        cache.set(f"I went to the park on day {day}.", NAMESPACE, str(day))
+
+    assert cache.get("I went to the park on the day 17.", NAMESPACE, "translate") == "17"
+    assert asyncio.run(cache.aget("Um, I went to park on day 42.", NAMESPACE, "translate")) == "42"
+    assert cache.get("I went to the park on day 50.", NAMESPACE, "translate") is None
+    assert cache.get_stats()["near_hits"] == 2
+
+
+def test_eviction_follows_use_order_when_full():
+    cache = SemanticCache(max_entries=3)
+    for name in ("a1", "b2", "c3"):
+        cache.set(f"sentence {name}", NAMESPACE, name)
+    cache.get("sentence a1", NAMESPACE, "translate")
+    cache.set("sentence d4", NAMESPACE, "d4")
+    cache.set("sentence e5", NAMESPACE, "e5")
+
+    assert [cache.get(f"sentence {name}", NAMESPACE, "translate") for name in ("a1", "b2", "c3", "d4", "e5")] == [
+        "a1", None, None, "d4", "e5"]
+    assert cache.get_stats()["evictions"] == 2
+
+
+def test_feedback_is_cached_per_teacher_text(client):
+    semantic = client.application.extensions["ai_service"].semantic_cache
+    text = "I went to Tokyo yesterday."
+    for teacher_text in ("Where did you go?", "What did you eat?", "Where did you go?"):
+        client.post("/api/feedback", json={"text": text, "teacher_text": teacher_text})
+
+    stats = semantic.get_stats()
+    assert stats["size"] == 2
+    assert stats["exact_hits"] == 1
@@ -0,0 +1,56 @@
+"""本番モード（gunicorn の設定・ヘルスチェック）のテスト"""
+
+import pytest
+
+
+def test_build_options_maps_production_config():
+    server = pytest.importorskip("backend.server")
+
+    options = server.build_options({
+        "host": "127.0.0.1", "port": 9000,
+        "production": {"workers": 4, "threads": 8, "timeout": 60}
+    })
+
+    assert options["bind"] == "127.0.0.1:9000"
+    assert options["worker_class"] == "gthread"
+    assert (options["workers"], options["threads"], options["timeout"]) == (4, 8, 60)
+    assert options["worker_exit"] is server._worker_exit
+
+
+def test_production_defaults_follow_cpu_count_and_disable_debug(monkeypatch):
+    server = pytest.importorskip("backend.server")
+    from config.settings import Settings
+
+    monkeypatch.setattr(server.os, "cpu_count", lambda: 3)
+    defaults = Settings()._default_config()["server"]
+    options = server.build_options(defaults)
+
+    assert (options["workers"], options["threads"]) == (3, server.DEFAULT_THREADS)
+    assert defaults["debug"] is False
+
+
+def test_threads_below_provider_concurrency_are_warned(use_config, capsys):
+    server = pytest.importorskip("backend.server")
+
+    use_config({"limits": {"providers": {"anthropic": {"max_concurrency": 64}}}})
+    server._check_threads(server.DEFAULT_THREADS)
+    assert capsys.readouterr().out == ""
+
+    server._check_threads(32)
+    assert "max_concurrency=64" in capsys.readouterr().out
+
+
+def test_healthz_and_readyz(client):
+    assert client.get("/healthz").get_json() == {"status": "ok"}
+    response = client.get("/readyz")
+
+    assert response.status_code == 200
+    assert response.get_json()["checks"] == {"providers": True, "event_loop": True}
+
+
+def test_readyz_fails_without_providers(app, client, monkeypatch):
+    monkeypatch.setattr(app.extensions["ai_service"], "providers", {})
+    response = client.get("/readyz")
+
+    assert response.status_code == 503
+    assert response.get_json()["status"] == "not ready"
@@ -0,0 +1,83 @@
+"""SessionStore のテスト"""
+
+import time
+
+from backend.session_store import SessionStore
+
+
+def test_keeps_only_the_latest_turns():
+    store = SessionStore(max_turns=4)
+    session_id = store.create()
+    for i in range(3):
+        store.append_turn(session_id, f"user {i}", f"assistant {i}")
+
+    turns = store.get(session_id).get_turns()
+    assert [turn["seq"] for turn in turns] == [2, 3, 4, 5]
+    assert store.get_history(session_id)[0] == {"role": "user", "content": "user 1"}
+
+
+def test_expired_session_is_dropped():
+    store = SessionStore(ttl_seconds=60)
+    session_id = store.create()
+    store.get(session_id).updated_at = time.time() - 120
+
+    assert store.get(session_id) is None
+    assert store.get_or_create(session_id) != session_id
+
+
+def test_evicts_least_recently_used_session():
+    store = SessionStore(max_sessions=2)
+    first, second = store.create(), store.create()
+    store.get(first)
+    third = store.create()
+
+    assert store.get(second) is None
+    assert store.get(first) is not None and store.get(third) is not None
+
+
+def test_restores_turns_and_summary_from_database(tmp_path):
+    db_path = str(tmp_path / "sessions.db")
+    store = SessionStore(max_turns=4, db_path=db_path)
+    session_id = store.create()
+    for i in range(3):
+        store.append_turn(session_id, f"user {i}", f"assistant {i}")
+    store.set_summary(session_id, "要約", 1)
+
+    restored = SessionStore(max_turns=4, db_path=db_path).get(session_id)
+    assert [turn["seq"] for turn in restored.get_turns()] == [2, 3, 4, 5]
+    assert restored.next_seq == 6
+    assert (restored.summary, restored.summary_seq) == ("要約", 1)
+
+
+def test_restores_provider_of_session_without_turns(tmp_path):
+    db_path = str(tmp_path / "sessions.db")
+    store = SessionStore(db_path=db_path)
+    session_id = store.create()
+    store.set_provider(session_id, "azure_openai")
+
+    restored = SessionStore(db_path=db_path).get(session_id)
+    assert restored is not None
+    assert restored.provider == "azure_openai"
+    assert restored.get_turns() == []
+
+
+def test_restores_provider_after_turns(tmp_path):
+    db_path = str(tmp_path / "sessions.db")
+    store = SessionStore(db_path=db_path)
+    session_id = store.create()
+    store.set_provider(session_id, "azure_openai")
+    store.append_turn(session_id, "hello", "hi")
+
+    restored = SessionStore(db_path=db_path).get(session_id)
+    assert restored.provider == "azure_openai"
+    assert restored.get_history() == [{"role": "user", "content": "hello"}, {"role": "assistant", "content": "hi"}]
+
+
+def test_deleted_session_is_not_restored(tmp_path):
+    db_path = str(tmp_path / "sessions.db")
+    store = SessionStore(db_path=db_path)
+    session_id = store.create()
+    store.set_provider(session_id, "azure_openai")
+    store.delete(session_id)
+
+    assert SessionStore(db_path=db_path).get(session_id) is None
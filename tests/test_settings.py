@@ -0,0 +1,86 @@
+"""設定のスナップショットと再読み込みのテスト"""
+
+import json
+
+import pytest
+
+from config.settings import Settings, settings
+
+
+@pytest.fixture
+def config_settings(tmp_path):
+    """tmp_path の config.json を読む Settings"""
+    instance = Settings()
+    instance.config_dir = tmp_path
+    instance.config_file = tmp_path / "config.json"
+    return instance
+
+
+def write(instance, config):
+    instance.config_file.write_text(json.dumps(config), encoding="utf-8")
+
+
+def test_snapshot_cannot_be_modified(config_settings):
+    write(config_settings, {"models": {"anthropic": "model-a"}})
+
+    with pytest.raises(TypeError):
+        config_settings.get_cache_config()["enabled"] = False
+    assert config_settings.get_model("anthropic") == "model-a"
+
+
+def test_reload_swaps_snapshot_and_notifies_listeners(config_settings):
+    write(config_settings, {"models": {"anthropic": "model-a"}})
+    config_settings.get_model("anthropic")
+    seen = []
+    config_settings.add_listener(lambda old, new: seen.append((old["models"]["anthropic"],
+                                                               new["models"]["anthropic"])))
+
+    write(config_settings, {"models": {"anthropic": "model-b"}})
+    assert config_settings.reload()
+    assert config_settings.get_model("anthropic") == "model-b"
+    assert seen == [("model-a", "model-b")]
+
+
+@pytest.mark.parametrize("content", ["{not json", json.dumps({"server": {"port": 70000}}),
+                                     json.dumps({"cache": "yes"})])
+def test_invalid_file_keeps_current_snapshot(config_settings, content):
+    write(config_settings, {"models": {"anthropic": "model-a"}})
+    config_settings.get_model("anthropic")
+
+    config_settings.config_file.write_text(content, encoding="utf-8")
+    assert not config_settings.reload()
+    assert config_settings.get_model("anthropic") == "model-a"
+
+
+def test_named_listener_is_replaced(config_settings):
+    write(config_settings, {})
+    seen = []
+    config_settings.add_listener(lambda old, new: seen.append("first"), name="app")
+    config_settings.add_listener(lambda old, new: seen.append("second"), name="app")
+
+    assert config_settings.reload()
+    assert seen == ["second"]
+
+    config_settings.remove_listener("app")
+    assert config_settings.reload()
+    assert seen == ["second"]
+
+
+def test_save_config_writes_snapshot_atomically(config_settings):
+    write(config_settings, {"models": {"anthropic": "model-a"}})
+    config_settings.get_model("anthropic")
+    config_settings.save_config()
+
+    assert json.loads(config_settings.config_file.read_text(encoding="utf-8"))["models"]["anthropic"] == "model-a"
+    assert [path.name for path in config_settings.config_dir.iterdir()] == ["config.json"]
+
+
+def test_create_app_registers_one_reload_listener(use_config, monkeypatch):
+    from backend.app import create_app
+
+    use_config({"config_reload": {"enabled": False}})
+    monkeypatch.setattr(settings, "_listeners", {})
+    create_app()
+    create_app()
+
+    assert list(settings._listeners) == ["app"]
@@ -0,0 +1,267 @@
+"""共有状態の保存先（StateBackend）のテスト"""
+
+import asyncio
+import importlib.util
+import threading
+import time
+from pathlib import Path
+
+import pytest
+
+from backend.cache import ResponseCache
+from backend.limiter import ProviderLimiter
+from backend.session_store import SessionStore
+from backend.shared_state import (MemoryBackend, RedisBackend, SQLiteBackend, StateBackendError,
+                                  create_state_backend)
+
+RESP_SERVER = Path(__file__).resolve().parent.parent / "benchmarks" / "resp_server.py"
+
+
+@pytest.fixture(scope="module")
+def redis_port():
+    """benchmarks/resp_server.py の疑似 Redis サーバーを起動"""
+    spec = importlib.util.spec_from_file_location("resp_server", RESP_SERVER)
+    resp_server = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(resp_server)
+    proc, port = resp_server.start_in_subprocess()
+    yield port
+    proc.kill()
+    proc.wait()
+
+
+@pytest.fixture(params=["memory", "sqlite", "redis"])
+def backend(request, tmp_path):
+    if request.param == "memory":
+        state = MemoryBackend()
+    elif request.param == "sqlite":
+        state = SQLiteBackend(str(tmp_path / "shared_state.db"))
+    else:
+        state = RedisBackend(port=request.getfixturevalue("redis_port"))
+    yield state
+    state.close()
+
+
+def test_get_set_delete(backend):
+    assert backend.get("missing") is None
+    backend.set("key", "value")
+    assert backend.get("key") == "value"
+    backend.delete("key")
+    assert backend.get("key") is None
+
+
+def test_ttl_expires_value(backend):
+    backend.set("short", "value", ttl_seconds=0.05)
+    assert backend.get("short") == "value"
+    time.sleep(0.1)
+    assert backend.get("short") is None
+
+
+def test_incr_counts_from_zero_and_restarts_after_ttl(backend):
+    assert backend.incr("counter", 1, ttl_seconds=0.05) == 1
+    assert backend.incr("counter", 2, ttl_seconds=0.05) == 3
+    time.sleep(0.1)
+    assert backend.incr("counter", 1, ttl_seconds=0.05) == 1
+
+
+def test_update_rewrites_value_and_leaves_it_on_error(backend):
+    assert backend.update("list", lambda value: (value or "") + "a") == "a"
+    assert backend.update("list", lambda value: (value or "") + "b", ttl_seconds=60) == "ab"
+
+    def fail(value):
+        raise ValueError("bad value")
+
+    with pytest.raises(ValueError):
+        backend.update("list", fail)
+    assert backend.get("list") == "ab"
+    assert backend.update("list", lambda value: value + "c") == "abc"
+
+
+@pytest.fixture(params=["sqlite", "redis"])
+def worker_backends(request, tmp_path):
+    """同じ保存先に別々に接続した2つのワーカーの保存先"""
+    if request.param == "sqlite":
+        states = [SQLiteBackend(str(tmp_path / "shared_state.db"), call_timeout=5) for _ in range(2)]
+    else:
+        port = request.getfixturevalue("redis_port")
+        states = [RedisBackend(port=port, call_timeout=5) for _ in range(2)]
+    yield states
+    for state in states:
+        state.close()
+
+
+def run_together(*funcs):
+    """funcs を別々のスレッドで同時に開始し、すべて終わるまで待つ"""
+    start = threading.Barrier(len(funcs))
+    threads = [threading.Thread(target=lambda func=func: (start.wait(), func())) for func in funcs]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+
+def test_concurrent_updates_from_two_workers_are_not_lost(worker_backends):
+    def append(state, name):
+        for i in range(30):
+            state.update("log", lambda value: (value or "") + f"{name}{i},")
+
+    run_together(*[lambda state=state, name=name: append(state, name)
+                   for state, name in zip(worker_backends, "ab")])
+
+    entries = worker_backends[0].get("log").rstrip(",").split(",")
+    assert sorted(entries) == sorted(f"{name}{i}" for name in "ab" for i in range(30))
+
+
+def test_backend_that_cannot_open_falls_back_to_memory():
+    state = create_state_backend({"backend": "sqlite", "sqlite_path": "/proc/cannot/create/state.db"})
+
+    assert isinstance(state, MemoryBackend)
+
+
+class SlowBackend(MemoryBackend):
+    """応答が call_timeout より遅い共有の保存先"""
+
+    shared = True
+
+    def __init__(self, delay: float):
+        super().__init__()
+        self.call_timeout = 0.02
+        self.delay = delay
+
+    def get(self, key):
+        time.sleep(self.delay)
+        return super().get(key)
+
+    def incr(self, key, amount=1, ttl_seconds=None):
+        time.sleep(self.delay)
+        return super().incr(key, amount, ttl_seconds)
+
+
+def test_slow_read_times_out():
+    state = SlowBackend(delay=0.5)
+    start = time.perf_counter()
+    with pytest.raises(StateBackendError):
+        state.run(state.get, "key")
+
+    assert time.perf_counter() - start < 0.2
+    state.close()
+
+
+def test_async_read_does_not_block_the_event_loop():
+    state = SlowBackend(delay=0.3)
+
+    async def main():
+        ticks = 0
+
+        async def tick():
+            nonlocal ticks
+            while True:
+                ticks += 1
+                await asyncio.sleep(0.001)
+
+        ticker = asyncio.ensure_future(tick())
+        with pytest.raises(StateBackendError):
+            await state.arun(state.get, "key")
+        ticker.cancel()
+        return ticks
+
+    assert asyncio.run(main()) >= 5
+    state.close()
+
+
+def test_writes_are_applied_in_order_without_waiting(tmp_path):
+    state = SQLiteBackend(str(tmp_path / "shared_state.db"))
+    for i in range(20):
+        state.submit(state.set, "key", str(i))
+
+    assert state.run(state.get, "key") == "19"
+    state.close()
+
+
+def test_limiter_falls_back_to_local_bucket_when_shared_state_is_slow():
+    state = SlowBackend(delay=0.3)
+    limiter = ProviderLimiter({"requests_per_minute": 6000, "burst": 2}, name="slow", shared=state)
+
+    async def main():
+        start = time.perf_counter()
+        for _ in range(2):
+            async with limiter.acquire():
+                pass
+        return time.perf_counter() - start
+
+    assert asyncio.run(main()) < 0.25
+    assert limiter.counters["shared_errors"] >= 2
+    state.close()
+
+
+def test_response_cache_reads_other_workers_entries(tmp_path):
+    state = SQLiteBackend(str(tmp_path / "shared_state.db"))
+    ResponseCache(shared=state).set("key", "value")
+    other = ResponseCache(shared=state)
+
+    assert asyncio.run(other.aget("key")) == "value"
+    assert other.get_stats()["shared_hits"] == 1
+    state.close()
+
+
+def test_session_continues_on_another_worker(tmp_path):
+    state = SQLiteBackend(str(tmp_path / "shared_state.db"))
+    first, second = SessionStore(shared=state), SessionStore(shared=state)
+    session_id = first.create()
+    first.append_turn(session_id, "Hello", "Hi!")
+    second.set_provider(session_id, "fake")
+
+    session = first.get(session_id)
+    assert session.provider == "fake"
+    assert [turn["content"] for turn in session.get_turns()] == ["Hello", "Hi!"]
+    state.close()
+
+
+def test_concurrent_append_turn_from_two_workers_keeps_every_turn(worker_backends):
+    stores = [SessionStore(max_turns=200, shared=state) for state in worker_backends]
+    session_id = stores[0].create()
+    stores[1].get(session_id)
+
+    def chat(store, name):
+        for i in range(15):
+            store.append_turn(session_id, f"{name} user {i}", f"{name} assistant {i}")
+
+    run_together(*[lambda store=store, name=name: chat(store, name) for store, name in zip(stores, "ab")])
+
+    turns = stores[1].get(session_id).get_turns()
+    assert len(turns) == 60
+    assert [turn["seq"] for turn in turns] == list(range(60))
+    for name in "ab":
+        contents = [turn["content"] for turn in turns if turn["content"].startswith(name)]
+        assert contents == [f"{name} {role} {i}" for i in range(15) for role in ("user", "assistant")]
+    assert all(store.shared_errors == 0 for store in stores)
+
+
+def test_summary_is_made_by_one_worker_at_a_time(tmp_path):
+    state = SQLiteBackend(str(tmp_path / "shared_state.db"))
+    first, second = SessionStore(shared=state), SessionStore(shared=state)
+    session_id = first.create()
+    second.get(session_id)
+
+    assert first.begin_summary(session_id)
+    assert not first.begin_summary(session_id)
+    assert not second.begin_summary(session_id)
+    first.end_summary(session_id)
+    assert second.begin_summary(session_id)
+
+    second.set_summary(session_id, "新しい要約", 5)
+    first.set_summary(session_id, "古い要約", 3)
+    assert (first.get(session_id).summary, first.get(session_id).summary_seq) == ("新しい要約", 5)
+    state.close()
+
+
+def test_busy_backend_rejects_new_operations():
+    state = SlowBackend(delay=0.05)
+    state.max_pending = 2
+    release = threading.Event()
+    state.submit(release.wait, 1)
+    state.submit(release.wait, 1)
+
+    with pytest.raises(StateBackendError):
+        state.run(state.get, "key")
+    release.set()
+    state.close()
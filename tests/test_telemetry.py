@@ -0,0 +1,56 @@
+"""メトリクス（Counter / Histogram / MetricsRegistry / /metrics）のテスト"""
+
+import re
+
+from backend.telemetry import Counter, Gauge, Histogram, MetricsRegistry
+
+
+def test_histogram_buckets_are_cumulative():
+    histogram = Histogram("latency_seconds", "Latency.", ["provider"], buckets=(0.1, 1))
+    for value in (0.05, 0.5, 5):
+        histogram.observe(value, provider="fake")
+
+    assert histogram.collect() == [
+        'latency_seconds_bucket{provider="fake",le="0.1"} 1',
+        'latency_seconds_bucket{provider="fake",le="1"} 2',
+        'latency_seconds_bucket{provider="fake",le="+Inf"} 3',
+        'latency_seconds_sum{provider="fake"} 5.55',
+        'latency_seconds_count{provider="fake"} 3',
+    ]
+
+
+def test_label_values_are_escaped():
+    counter = Counter("errors_total", "Errors.", ["error"])
+    counter.inc(error='say "hi"\n')
+
+    assert counter.collect() == ['errors_total{error="say \\"hi\\"\\n"} 1']
+
+
+def test_registry_renders_help_type_and_callback_values():
+    registry = MetricsRegistry()
+    registry.register(Gauge("queue_depth", "Queued calls.", ["provider"], lambda: {("fake",): 3}))
+    registry.register(Counter("calls_total", "Calls."))
+    replaced = registry.register(Counter("calls_total", "Calls."))
+    replaced.inc(2)
+
+    assert registry.render() == (
+        "# HELP queue_depth Queued calls.\n"
+        "# TYPE queue_depth gauge\n"
+        'queue_depth{provider="fake"} 3\n'
+        "# HELP calls_total Calls.\n"
+        "# TYPE calls_total counter\n"
+        "calls_total 2\n"
+    )
+
+
+def test_metrics_endpoint_reports_provider_calls(client):
+    client.post("/api/translate", json={"text": "Metrics test sentence."})
+    response = client.get("/metrics")
+
+    assert response.status_code == 200
+    assert response.mimetype == "text/plain"
+    text = response.get_data(as_text=True)
+    assert re.search(r'llm_request_duration_seconds_count\{provider="fake",operation="translate",'
+                     r'level="",outcome="success"\} [1-9]', text)
+    assert 'llm_tokens_total{provider="fake",operation="translate",level="",direction="output"}' in text
+    assert 'http_request_duration_seconds_count{endpoint="translate",method="POST",status="200"}' in text